@@ -0,0 +1,183 @@
+# Module to compute per band statistics for the Stand Condition Tool 16 bit BIL files in the same streaming pass that
+# writes them, instead of a second read of every output to build ArcGIS statistics
+# For each band the pixel count, NODATA count, minimum, maximum, mean, standard deviation and a fixed bin histogram
+# are kept, saved to a JSON sidecar file next to the bil file and can be merged across all the tiles of a batch
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import json
+import os
+
+import numpy as np
+
+# default histogram, 100 bins over the Landsat surface reflectance scale (0 to 10000)
+# values outside the range are counted as below or above the histogram
+statistics_histogram_min = 0
+statistics_histogram_max = 10000
+statistics_histogram_bins = 100
+
+statistics_file_extension = ".stats.json"
+
+
+###############################################################################################################
+# Class holding running statistics for each band of a raster
+# blocks are added with update(), statistics from other tiles with merge(), the mean and variance are combined with
+# the parallel algorithm of Chan et al. so blocks and tiles can be added in any order
+
+class BandStatistics(object):
+
+    def __init__(self, bands, histogram_min=statistics_histogram_min, histogram_max=statistics_histogram_max,
+                 histogram_bins=statistics_histogram_bins):
+        self.bands = bands
+        self.histogram_min = histogram_min
+        self.histogram_max = histogram_max
+        self.histogram_bins = histogram_bins
+        self.count = np.zeros(bands, dtype=np.int64)
+        self.nodata_count = np.zeros(bands, dtype=np.int64)
+        self.minimum = np.full(bands, np.inf)
+        self.maximum = np.full(bands, -np.inf)
+        self.mean = np.zeros(bands)
+        self.m2 = np.zeros(bands)  # sum of squared differences from the mean
+        self.below_histogram = np.zeros(bands, dtype=np.int64)
+        self.above_histogram = np.zeros(bands, dtype=np.int64)
+        self.histogram = np.zeros((bands, histogram_bins), dtype=np.int64)
+
+    # add the statistics of a count, mean and sum of squared differences to a band
+    def _combine(self, band, count, mean, m2):
+        total = self.count[band] + count
+        if total == 0:
+            return
+        delta = mean - self.mean[band]
+        self.mean[band] += delta * count / float(total)
+        self.m2[band] += m2 + delta * delta * self.count[band] * count / float(total)
+        self.count[band] = total
+
+    # add a block of pixels in BIL order, shaped (rows, bands, columns), pixels equal to nodata_value are only counted
+    def update(self, block, nodata_value):
+        bin_width = (self.histogram_max - self.histogram_min) / float(self.histogram_bins)
+        for band in range(self.bands):
+            band_values = block[:, band, :]
+            values = band_values[band_values != nodata_value]
+            self.nodata_count[band] += band_values.size - values.size
+            if values.size == 0:
+                continue
+            values = values.astype(np.float64)
+            self.minimum[band] = min(self.minimum[band], values.min())
+            self.maximum[band] = max(self.maximum[band], values.max())
+            block_mean = values.mean()
+            self._combine(band, values.size, block_mean, float(np.sum((values - block_mean) ** 2)))
+
+            bin_index = np.floor((values - self.histogram_min) / bin_width).astype(np.int64)
+            below = bin_index < 0
+            above = bin_index >= self.histogram_bins
+            self.below_histogram[band] += int(np.count_nonzero(below))
+            self.above_histogram[band] += int(np.count_nonzero(above))
+            self.histogram[band] += np.bincount(bin_index[~(below | above)], minlength=self.histogram_bins)
+
+    # add pixels that are NODATA in every band, without looking at a block of them
+    def add_nodata(self, pixel_count):
+        self.nodata_count += pixel_count
+
+    # add the statistics of another BandStatistics with the same bands and histogram
+    def merge(self, other):
+        if (other.bands, other.histogram_min, other.histogram_max, other.histogram_bins) != \
+                (self.bands, self.histogram_min, self.histogram_max, self.histogram_bins):
+            raise ValueError("statistics with different bands or histograms can not be merged")
+        for band in range(self.bands):
+            self._combine(band, other.count[band], other.mean[band], other.m2[band])
+        self.nodata_count += other.nodata_count
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+        self.below_histogram += other.below_histogram
+        self.above_histogram += other.above_histogram
+        self.histogram += other.histogram
+
+    # convert to a dictionary that can be saved as JSON
+    def to_dict(self):
+        band_statistics = []
+        for band in range(self.bands):
+            has_values = self.count[band] > 0
+            band_statistics.append({
+                'band': band + 1,
+                'count': int(self.count[band]),
+                'nodata_count': int(self.nodata_count[band]),
+                'min': float(self.minimum[band]) if has_values else None,
+                'max': float(self.maximum[band]) if has_values else None,
+                'mean': float(self.mean[band]) if has_values else None,
+                'std': float(np.sqrt(self.m2[band] / self.count[band])) if has_values else None,
+                'below_histogram': int(self.below_histogram[band]),
+                'above_histogram': int(self.above_histogram[band]),
+                'histogram': [int(bin_count) for bin_count in self.histogram[band]]})
+        return {'histogram_min': self.histogram_min,
+                'histogram_max': self.histogram_max,
+                'histogram_bins': self.histogram_bins,
+                'bands': band_statistics}
+
+    # build from a dictionary made by to_dict
+    @classmethod
+    def from_dict(cls, statistics_dict):
+        statistics = cls(len(statistics_dict['bands']), statistics_dict['histogram_min'],
+                         statistics_dict['histogram_max'], statistics_dict['histogram_bins'])
+        for band, band_statistics in enumerate(statistics_dict['bands']):
+            statistics.count[band] = band_statistics['count']
+            statistics.nodata_count[band] = band_statistics['nodata_count']
+            statistics.below_histogram[band] = band_statistics['below_histogram']
+            statistics.above_histogram[band] = band_statistics['above_histogram']
+            statistics.histogram[band] = band_statistics['histogram']
+            if band_statistics['count']:
+                statistics.minimum[band] = band_statistics['min']
+                statistics.maximum[band] = band_statistics['max']
+                statistics.mean[band] = band_statistics['mean']
+                statistics.m2[band] = band_statistics['std'] ** 2 * band_statistics['count']
+        return statistics
+
+
+###############################################################################################################
+# function to get the statistics sidecar file path for a bil file
+
+def get_statistics_path(bil_path):
+    return os.path.splitext(bil_path)[0] + statistics_file_extension
+
+
+###############################################################################################################
+# functions to save and load the statistics sidecar file of a bil file
+
+def write_statistics_file(bil_path, statistics):
+    statistics_path = get_statistics_path(bil_path)
+    statistics_dict = statistics.to_dict()
+    statistics_dict['raster'] = os.path.basename(bil_path)
+    with open(statistics_path, 'w') as statistics_file:
+        json.dump(statistics_dict, statistics_file, indent=1)
+    return statistics_path
+
+
+def read_statistics_file(bil_path):
+    with open(get_statistics_path(bil_path)) as statistics_file:
+        return BandStatistics.from_dict(json.load(statistics_file))
+
+
+###############################################################################################################
+# function to merge the statistics sidecar files of a list of bil files into batch level statistics
+# inputs are the list of bil files and the path of the merged statistics JSON file to write
+# output is a tuple of the merged BandStatistics (None if no statistics were found) and the list of bil files that
+# had no statistics file
+
+def merge_statistics_files(bil_paths, merged_statistics_path):
+    merged_statistics = None
+    missing_statistics = []
+    for bil_path in bil_paths:
+        if not os.path.exists(get_statistics_path(bil_path)):
+            missing_statistics.append(bil_path)
+            continue
+        statistics = read_statistics_file(bil_path)
+        if merged_statistics is None:
+            merged_statistics = statistics
+        else:
+            merged_statistics.merge(statistics)
+    if merged_statistics is not None:
+        statistics_dict = merged_statistics.to_dict()
+        statistics_dict['rasters'] = [os.path.basename(bil_path) for bil_path in bil_paths
+                                      if bil_path not in missing_statistics]
+        with open(merged_statistics_path, 'w') as statistics_file:
+            json.dump(statistics_dict, statistics_file, indent=1)
+    return merged_statistics, missing_statistics
@@ -0,0 +1,100 @@
+# Automated test module for the band statistics computed by the Stand Condition Tool Raster Converter project script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_BAND_STATISTICS
+import SCT_BIL_CONVERTER
+import SCT_TEST_DATA
+
+test_nodata = -32768
+
+
+# function to make a block of 16 bit pixels in BIL order (rows, bands, columns) with some NODATA pixels
+def make_test_block(seed, rows=20, bands=6, cols=15):
+    random_state = np.random.RandomState(seed)
+    block = random_state.randint(-500, 11000, size=(rows, bands, cols)).astype(np.int16)
+    block[random_state.rand(rows, bands, cols) < 0.2] = test_nodata
+    return block
+
+
+# function to check a band of statistics against values computed directly with numpy
+def check_band_statistics(statistics_dict, block, band):
+    band_values = block[:, band, :]
+    values = band_values[band_values != test_nodata].astype(np.float64)
+    band_statistics = statistics_dict['bands'][band]
+    assert band_statistics['count'] == values.size
+    assert band_statistics['nodata_count'] == band_values.size - values.size
+    assert band_statistics['min'] == values.min() and band_statistics['max'] == values.max()
+    assert abs(band_statistics['mean'] - values.mean()) < 1e-6
+    assert abs(band_statistics['std'] - values.std()) < 1e-6
+    # numpy would include 10000 in the last bin, the statistics count it as above the histogram
+    histogram, bin_edges = np.histogram(values[values < 10000], bins=100, range=(0, 10000))
+    assert band_statistics['histogram'] == list(histogram)
+    assert band_statistics['below_histogram'] == np.count_nonzero(values < 0)
+    assert band_statistics['above_histogram'] == np.count_nonzero(values >= 10000)
+
+
+# test that statistics built a block at a time and merged across tiles match statistics of all the pixels
+def test_block_and_merged_statistics():
+    blocks = [make_test_block(seed) for seed in range(4)]
+    all_pixels = np.concatenate(blocks, axis=0)
+
+    tile_statistics = []
+    for first_block in (0, 2):
+        statistics = SCT_BAND_STATISTICS.BandStatistics(6)
+        for block in blocks[first_block:first_block + 2]:
+            statistics.update(block, test_nodata)
+        tile_statistics.append(statistics)
+        for band in range(6):
+            check_band_statistics(statistics.to_dict(), np.concatenate(blocks[first_block:first_block + 2]), band)
+
+    # statistics are merged from their saved form, as the batch merge reads them from the sidecar files
+    merged_statistics = SCT_BAND_STATISTICS.BandStatistics.from_dict(tile_statistics[0].to_dict())
+    merged_statistics.merge(SCT_BAND_STATISTICS.BandStatistics.from_dict(tile_statistics[1].to_dict()))
+    for band in range(6):
+        check_band_statistics(merged_statistics.to_dict(), all_pixels, band)
+
+
+# test that the converter writes statistics for the converted pixels and that batch statistics merge the tiles
+def test_converter_statistics_files():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bil_paths = []
+        for index in range(2):
+            bands = np.full((6, 30, 20), 1000.0 * (index + 1), dtype=np.float32)
+            bands[:, :10, :] = np.nan
+            tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "tile%d.tif" % index), bands,
+                                                         rows_per_strip=4)
+            bil_path = os.path.join(test_folder, "tile%d.BIL" % index)
+            metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, block_memory_bytes=2048,
+                                                                compute_statistics=True)
+            SCT_BAND_STATISTICS.write_statistics_file(bil_path, metadata['statistics'])
+            bil_paths.append(bil_path)
+
+        tile_statistics = SCT_BAND_STATISTICS.read_statistics_file(bil_paths[0]).to_dict()
+        assert tile_statistics['bands'][0]['count'] == 400 and tile_statistics['bands'][0]['nodata_count'] == 200
+        assert tile_statistics['bands'][5]['mean'] == 1000.0 and tile_statistics['bands'][5]['std'] == 0.0
+
+        merged_statistics, missing_statistics = SCT_BAND_STATISTICS.merge_statistics_files(
+            bil_paths + [os.path.join(test_folder, "missing.BIL")], os.path.join(test_folder, "batch.json"))
+        assert [os.path.basename(bil_path) for bil_path in missing_statistics] == ["missing.BIL"]
+        merged_dict = merged_statistics.to_dict()
+        assert merged_dict['bands'][2]['count'] == 800 and merged_dict['bands'][2]['mean'] == 1500.0
+        assert merged_dict['bands'][2]['min'] == 1000.0 and merged_dict['bands'][2]['max'] == 2000.0
+        assert merged_dict['bands'][2]['histogram'][10] == 400 and merged_dict['bands'][2]['histogram'][20] == 400
+        assert os.path.exists(os.path.join(test_folder, "batch.json"))
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_block_and_merged_statistics()
+    test_converter_statistics_files()
+    print("Everything passed")
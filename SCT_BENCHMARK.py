@@ -0,0 +1,340 @@
+# Benchmark suite for the Stand Condition Tool input file converter
+# Writes synthetic 6 band float32 and float64 GeoTIFF tiles (up to the 9472 x 9472 production tile size) to a local
+# folder and times each stage of the conversion separately: GeoTIFF metadata validation, conversion to 16 bit BIL,
+# ENVI header writing, band statistics and whole batches with 1 to N worker processes
+# Each stage runs in its own process so its peak memory (RSS) can be measured, results are written to a JSON file
+# and can be compared with a stored baseline, the comparison fails if any stage is slower or uses more memory than
+# the baseline by more than the thresholds
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+# Usage: python SCT_BENCHMARK.py [--sizes 512 2048 9472] [--dtypes float32 float64] [--workers 1 2 4]
+#                                [--repeat 3] [--output results.json] [--baseline baseline.json]
+
+try:
+    import resource
+except ImportError:  # peak memory is not measured on Windows
+    resource = None
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import SCT_BAND_STATISTICS
+import SCT_BIL_CONVERTER
+import SCT_BIL_READER
+import SCT_CONVERT_RASTER_TO_ENVI
+import SCT_ENVI_HEADER
+import SCT_GEOTIFF
+
+benchmark_default_sizes = (512, 2048, 9472)
+benchmark_default_dtypes = ('float32', 'float64')
+benchmark_default_workers = (1, 2, 4)
+benchmark_batch_tile_size = 1024
+benchmark_batch_tile_count = 8
+benchmark_metadata_repeat = 200
+benchmark_header_repeat = 200
+benchmark_stage_repeat = 3  # each stage is run this many times and the fastest run kept
+benchmark_poll_seconds = 1.0  # wait for a stage result between checks that the stage process is still running
+
+# a stage regresses when it takes this much longer, or uses this much more memory, than its baseline
+benchmark_time_threshold = 0.25
+benchmark_memory_threshold = 0.25
+
+benchmark_pixel_size = 0.000269494585235856
+
+
+###############################################################################################################
+# function to get the peak resident memory of this process in MB, None where it can not be measured
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0
+
+
+###############################################################################################################
+# function to write a synthetic SCT input tile, a block of rows at a time so production size tiles can be made
+# reflectance values are random between 0 and 10000 with a band of NaN pixels along the top edge, the same seed
+# always gives the same tile
+# output is the tile path
+
+def write_benchmark_tile(tile_path, size, dtype, seed=0):
+    random_state = np.random.RandomState(seed)
+    geotransform = (140.5, benchmark_pixel_size, 0.0, -27.5, 0.0, -benchmark_pixel_size)
+    with SCT_GEOTIFF.GeoTiffWriter(tile_path, size, size, 6, dtype, geotransform) as writer:
+        block_rows = max(1, (16 * 1024 * 1024) // (size * 6 * 8))
+        for row_start in range(0, size, block_rows):
+            row_count = min(block_rows, size - row_start)
+            block = random_state.uniform(0, 10000, size=(6, row_count, size)).astype(dtype)
+            if row_start < size // 100:
+                block[:, :size // 100 - row_start] = np.nan
+            writer.write_rows(block)
+    return tile_path
+
+
+###############################################################################################################
+# benchmark stages, each is run in a separate process by run_stage and returns a result dictionary with at least the
+# stage name and the time taken in seconds
+
+def benchmark_metadata(tile_path, repeat=benchmark_metadata_repeat):
+    start_time = time.time()
+    for _ in range(repeat):
+        # the band and EPSG checks of check_input_description, without its messages
+        description = SCT_CONVERT_RASTER_TO_ENVI.describe_input_raster(tile_path)
+        if description['bands'] != SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_raster_bands_count or \
+                description['epsg'] != SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_data_spatial_reference_code:
+            raise ValueError("%s is not a valid SCT input: %s" % (tile_path, description))
+    return {'stage': 'metadata', 'seconds': (time.time() - start_time) / repeat}
+
+
+def benchmark_conversion(tile_path, bil_path, block_memory_bytes=SCT_BIL_CONVERTER.bil_default_block_memory_bytes,
+                         pipeline_depth=SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_pipeline_depth,
+                         skip_empty=SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_skip_empty):
+    start_time = time.time()
+    metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tile_path, bil_path, block_memory_bytes,
+                                                        pipeline_depth=pipeline_depth, skip_empty=skip_empty)
+    seconds = time.time() - start_time
+    SCT_ENVI_HEADER.write_envi_header(bil_path, metadata)
+    return {'stage': 'conversion', 'seconds': seconds, 'bytes': metadata['bytes_read']}
+
+
+def benchmark_header(bil_path, repeat=benchmark_header_repeat):
+    metadata = SCT_ENVI_HEADER.read_bil_header_metadata(bil_path)
+    start_time = time.time()
+    for _ in range(repeat):
+        SCT_ENVI_HEADER.write_envi_header(bil_path, metadata)
+    return {'stage': 'header', 'seconds': (time.time() - start_time) / repeat}
+
+
+def benchmark_statistics(bil_path, block_memory_bytes=SCT_BIL_CONVERTER.bil_default_block_memory_bytes):
+    start_time = time.time()
+    with SCT_BIL_READER.BilRaster(bil_path) as raster:
+        statistics = SCT_BAND_STATISTICS.BandStatistics(raster.bands)
+        block_rows = max(1, block_memory_bytes // (raster.bands * raster.samples * 8))
+        for row_start in range(0, raster.lines, block_rows):
+            statistics.update(raster.read_window(row_start, min(block_rows, raster.lines - row_start)),
+                              SCT_BIL_CONVERTER.bil_nodata_value)
+        statistics_bytes = raster.data.nbytes
+    return {'stage': 'statistics', 'seconds': time.time() - start_time, 'bytes': statistics_bytes}
+
+
+def benchmark_batch(tile_paths, output_folder, workers):
+    SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_worker_count = workers
+    SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_use_tile_cache = False
+    SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_overviews = "none"
+    start_time = time.time()
+    results = SCT_CONVERT_RASTER_TO_ENVI.run_batch(tile_paths, output_folder)
+    seconds = time.time() - start_time
+    failed = [result['input_raster'] for result in results if result['status'] != 'converted']
+    if failed:
+        raise RuntimeError("batch benchmark failed to convert %s" % failed)
+    return {'stage': 'batch', 'seconds': seconds, 'bytes': sum(os.path.getsize(path) for path in tile_paths),
+            'workers': workers}
+
+
+###############################################################################################################
+# function to run a benchmark stage in a new process, so the peak memory of the stage (and of its worker processes)
+# is measured on its own
+# the stage is run repeat times, each in a new process, and the fastest run is kept with the largest peak memory
+# output is the result dictionary of the stage with peak_rss_mb (the largest of the stage process and its workers)
+# and mb_per_second (for stages that read a number of bytes) added
+# raises RuntimeError if the stage fails, or its process exits without a result (eg. killed when out of memory)
+
+def run_stage(stage_function, args, repeat=benchmark_stage_repeat):
+    run_results = []
+    for _ in range(repeat):
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_stage_process, args=(result_queue, stage_function, args))
+        process.start()
+        try:
+            run_result, error = get_stage_result(process, result_queue, stage_function.__name__)
+        finally:
+            process.join()
+        if error is not None:
+            raise RuntimeError("benchmark stage %s failed: %s" % (stage_function.__name__, error))
+        run_results.append(run_result)
+    result = min(run_results, key=lambda run_result: run_result['seconds'])
+    if result['peak_rss_mb'] is not None:
+        result['peak_rss_mb'] = max(run_result['peak_rss_mb'] for run_result in run_results)
+    if 'bytes' in result and result['seconds'] > 0:
+        result['mb_per_second'] = result['bytes'] / (1024.0 * 1024.0) / result['seconds']
+    return result
+
+
+# function to wait for the result of a stage process, which is checked every benchmark_poll_seconds so a process that
+# dies without sending its result does not hang the benchmark
+# output is the (result, error) tuple sent by the process
+
+def get_stage_result(process, result_queue, stage_name):
+    while process.is_alive():
+        try:
+            return result_queue.get(timeout=benchmark_poll_seconds)
+        except queue.Empty:
+            pass
+    try:  # the result may have been sent just before the process exited
+        return result_queue.get(timeout=benchmark_poll_seconds)
+    except queue.Empty:
+        raise RuntimeError("benchmark stage %s exited with code %s without a result" % (stage_name, process.exitcode))
+
+
+def _run_stage_process(result_queue, stage_function, args):
+    try:
+        result = stage_function(*args)
+        result['peak_rss_mb'] = get_peak_rss_mb()
+        if resource is not None:
+            children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            if children_rss:
+                children_rss_mb = children_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' \
+                    else children_rss / 1024.0
+                result['peak_rss_mb'] = max(result['peak_rss_mb'], children_rss_mb)
+        result_queue.put((result, None))
+    except Exception as err:
+        result_queue.put((None, repr(err)))
+
+
+###############################################################################################################
+# function to run the whole benchmark suite
+# inputs are the tile sizes, data types and worker counts to benchmark, the folder to write the synthetic tiles
+# and outputs into (a temporary folder that is removed afterwards if not given), the size and number of tiles for
+# the batch stage and the number of times each stage is run
+# output is the results dictionary that is saved as JSON
+
+def run_benchmarks(sizes=benchmark_default_sizes, dtypes=benchmark_default_dtypes, workers=benchmark_default_workers,
+                   benchmark_folder=None, batch_tile_size=benchmark_batch_tile_size,
+                   batch_tile_count=benchmark_batch_tile_count, repeat=benchmark_stage_repeat):
+    remove_folder = benchmark_folder is None
+    if remove_folder:
+        benchmark_folder = tempfile.mkdtemp()
+    results = {'created': datetime.datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'cpu_count': multiprocessing.cpu_count(),
+               'results': []}
+    try:
+        for dtype in dtypes:
+            for size in sizes:
+                tile_path = write_benchmark_tile(os.path.join(benchmark_folder, "MDB_P75_%s_%d.tif" % (dtype, size)),
+                                                 size, dtype)
+                bil_path = os.path.splitext(tile_path)[0] + ".BIL"
+                for stage_function, args in [(benchmark_metadata, (tile_path,)),
+                                             (benchmark_conversion, (tile_path, bil_path)),
+                                             (benchmark_header, (bil_path,)),
+                                             (benchmark_statistics, (bil_path,))]:
+                    result = run_stage(stage_function, args, repeat)
+                    result.update({'size': size, 'dtype': dtype})
+                    results['results'].append(result)
+                for path in (tile_path, bil_path, os.path.splitext(bil_path)[0] + ".hdr"):
+                    os.remove(path)
+
+            batch_folder = os.path.join(benchmark_folder, "batch_%s" % dtype)
+            os.mkdir(batch_folder)
+            tile_paths = [write_benchmark_tile(os.path.join(batch_folder, "MDB_P75_%s_%d.tif" % (dtype, tile_number)),
+                                               batch_tile_size, dtype, seed=tile_number)
+                          for tile_number in range(batch_tile_count)]
+            for worker_count in workers:
+                output_folder = os.path.join(batch_folder, "output_%d" % worker_count)
+                os.mkdir(output_folder)
+                result = run_stage(benchmark_batch, (tile_paths, output_folder, worker_count), repeat)
+                result.update({'size': batch_tile_size, 'dtype': dtype})
+                results['results'].append(result)
+                shutil.rmtree(output_folder)
+            shutil.rmtree(batch_folder)
+    finally:
+        if remove_folder:
+            shutil.rmtree(benchmark_folder)
+    return results
+
+
+###############################################################################################################
+# function to compare benchmark results with a baseline
+# results are matched by stage, size, data type and worker count
+# output is a list of regression messages, empty if no stage is slower or uses more memory than the thresholds allow
+
+def compare_with_baseline(results, baseline, time_threshold=benchmark_time_threshold,
+                          memory_threshold=benchmark_memory_threshold):
+    def result_key(result):
+        return result['stage'], result['size'], result['dtype'], result.get('workers')
+
+    baseline_results = dict((result_key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results['results']:
+        baseline_result = baseline_results.get(result_key(result))
+        if baseline_result is None:
+            continue
+        name = "%s %s %dx%d%s" % (result['stage'], result['dtype'], result['size'], result['size'],
+                                  " %d workers" % result['workers'] if result.get('workers') else "")
+        if result['seconds'] > baseline_result['seconds'] * (1 + time_threshold):
+            regressions.append("%s took %.4fs, baseline %.4fs" % (name, result['seconds'],
+                                                                   baseline_result['seconds']))
+        if result.get('peak_rss_mb') and baseline_result.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > baseline_result['peak_rss_mb'] * (1 + memory_threshold):
+            regressions.append("%s used %.1fMB, baseline %.1fMB" % (name, result['peak_rss_mb'],
+                                                                     baseline_result['peak_rss_mb']))
+    return regressions
+
+
+###############################################################################################################
+# function to print the benchmark results as a table
+
+def print_results(results):
+    print("%-11s %-8s %6s %8s %11s %9s %11s" % ('stage', 'dtype', 'size', 'workers', 'seconds', 'MB/s',
+                                                'peak RSS MB'))
+    for result in results['results']:
+        print("%-11s %-8s %6d %8s %11.4f %9s %11s" % (
+            result['stage'], result['dtype'], result['size'], result.get('workers', ''), result['seconds'],
+            "%.1f" % result['mb_per_second'] if 'mb_per_second' in result else '',
+            "%.1f" % result['peak_rss_mb'] if result.get('peak_rss_mb') else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Stand Condition Tool input file converter")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(benchmark_default_sizes))
+    parser.add_argument('--dtypes', nargs='+', default=list(benchmark_default_dtypes))
+    parser.add_argument('--workers', type=int, nargs='+', default=list(benchmark_default_workers))
+    parser.add_argument('--batch-tile-size', type=int, default=benchmark_batch_tile_size)
+    parser.add_argument('--batch-tile-count', type=int, default=benchmark_batch_tile_count)
+    parser.add_argument('--repeat', type=int, default=benchmark_stage_repeat)
+    parser.add_argument('--folder', help="folder for the synthetic tiles, a temporary folder by default")
+    parser.add_argument('--output', default="SCT_benchmark_results.json")
+    parser.add_argument('--baseline', help="results file to compare with")
+    parser.add_argument('--time-threshold', type=float, default=benchmark_time_threshold)
+    parser.add_argument('--memory-threshold', type=float, default=benchmark_memory_threshold)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.dtypes, args.workers, args.folder, args.batch_tile_size,
+                             args.batch_tile_count, args.repeat)
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=1)
+    print_results(results)
+    print("Results written to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.time_threshold,
+                                                args.memory_threshold)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            return 1
+        print("No regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
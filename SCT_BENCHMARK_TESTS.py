@@ -0,0 +1,81 @@
+# Automated test module for the benchmark suite of the Stand Condition Tool Raster Converter project script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_BENCHMARK
+import SCT_GEOTIFF
+
+
+# test that a small run of the suite writes valid tiles and gives a result for every stage, size and worker count
+def test_run_benchmarks():
+    test_folder = tempfile.mkdtemp()
+    try:
+        tile_path = SCT_BENCHMARK.write_benchmark_tile(os.path.join(test_folder, "MDB_P75_test.tif"), 150,
+                                                       'float64', seed=3)
+        with SCT_GEOTIFF.GeoTiffRaster(tile_path) as raster:
+            pixels = raster.read_window(0, 150, 0, 150)
+        assert pixels.shape == (6, 150, 150) and pixels.dtype == np.float64
+        assert np.isnan(pixels[:, 0]).all() and not np.isnan(pixels[:, 1:]).any()
+        assert pixels[:, 1:].min() >= 0 and pixels[:, 1:].max() <= 10000
+
+        results = SCT_BENCHMARK.run_benchmarks(sizes=(64, 96), dtypes=('float32',), workers=(1, 2),
+                                               benchmark_folder=test_folder, batch_tile_size=48, batch_tile_count=3)
+        json.loads(json.dumps(results))
+        stages = [(result['stage'], result['size'], result.get('workers')) for result in results['results']]
+        assert stages == [('metadata', 64, None), ('conversion', 64, None), ('header', 64, None),
+                          ('statistics', 64, None), ('metadata', 96, None), ('conversion', 96, None),
+                          ('header', 96, None), ('statistics', 96, None), ('batch', 48, 1), ('batch', 48, 2)]
+        for result in results['results']:
+            assert result['seconds'] >= 0
+        conversion = results['results'][1]
+        assert conversion['bytes'] == 64 * 64 * 6 * 4 and 'mb_per_second' in conversion
+        assert sorted(os.listdir(test_folder)) == ["MDB_P75_test.tif"]
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that only stages slower, or using more memory, than the baseline by more than the thresholds are regressions
+def test_compare_with_baseline():
+    baseline = {'results': [{'stage': 'conversion', 'size': 512, 'dtype': 'float32', 'seconds': 1.0,
+                             'peak_rss_mb': 100.0},
+                            {'stage': 'batch', 'size': 1024, 'dtype': 'float32', 'workers': 2, 'seconds': 4.0,
+                             'peak_rss_mb': 200.0}]}
+    results = {'results': [{'stage': 'conversion', 'size': 512, 'dtype': 'float32', 'seconds': 1.2,
+                            'peak_rss_mb': 150.0},
+                           {'stage': 'batch', 'size': 1024, 'dtype': 'float32', 'workers': 2, 'seconds': 5.5,
+                            'peak_rss_mb': None},
+                           {'stage': 'batch', 'size': 1024, 'dtype': 'float32', 'workers': 4, 'seconds': 9.0,
+                            'peak_rss_mb': 900.0}]}
+    regressions = SCT_BENCHMARK.compare_with_baseline(results, baseline, time_threshold=0.25, memory_threshold=0.25)
+    assert regressions == ["conversion float32 512x512 used 150.0MB, baseline 100.0MB",
+                           "batch float32 1024x1024 2 workers took 5.5000s, baseline 4.0000s"]
+    assert SCT_BENCHMARK.compare_with_baseline(results, baseline, time_threshold=0.5, memory_threshold=0.5) == []
+
+
+# benchmark stage whose process dies without sending a result
+def exit_stage(exit_code):
+    os._exit(exit_code)
+
+
+# test that a stage process that dies is reported with its exit code instead of waiting for its result for ever
+def test_run_stage_process_exit():
+    try:
+        SCT_BENCHMARK.run_stage(exit_stage, (3,), repeat=1)
+        assert False, "stage process exit not reported"
+    except RuntimeError as err:
+        assert "exit_stage" in str(err) and "code 3" in str(err)
+
+
+if __name__ == "__main__":
+    test_run_benchmarks()
+    test_compare_with_baseline()
+    test_run_stage_process_exit()
+    print("Everything passed")
@@ -0,0 +1,404 @@
+# Module to convert 32 or 64 bit floating point 6 band GeoTIFFs into 16 bit signed BIL files for the
+# MDBA Stand Condition Tool without arcpy
+# The input is read in blocks of whole rows, each block is rounded, clamped to the 16 bit range and NODATA mapped,
+# then written band interleaved by line straight to disk, so memory use depends on the block size and not on the
+# size of the tile
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+import threading
+
+import numpy as np
+
+import SCT_BAND_STATISTICS
+import SCT_ENVI_HEADER
+import SCT_GEOTIFF
+import SCT_INSTRUMENTATION
+import SCT_OVERVIEWS
+import SCT_REPROJECT
+
+# 16 bit signed output range, the lowest value is reserved for NODATA
+bil_nodata_value = -32768
+bil_min_value = -32767
+bil_max_value = 32767
+
+# ESRI and GDAL fill floating point backgrounds with the most negative float32 or float64 value,
+# input values below this are treated as NODATA even when the file has no NODATA tag
+bil_input_nodata_threshold = -3.4e38
+
+# default memory allowed for one block of input rows and the working copies made while converting it
+bil_default_block_memory_bytes = 64 * 1024 * 1024
+
+# how often the pipeline threads check if the conversion has stopped while waiting for a buffer, in seconds
+bil_pipeline_poll_seconds = 0.1
+
+
+###############################################################################################################
+# function to work out how many rows to convert at a time
+# inputs are an open SCT_GEOTIFF.GeoTiffRaster and a memory budget in bytes
+# output is a number of rows, rounded to whole compressed strips or tiles so no chunk is decoded twice (at least one
+# strip or tile row is always read), uncompressed strips are read in part so they do not need to fit
+# raises ValueError for a compressed tile stored as a single strip that is more than the budget, as it can only be
+# decoded whole
+
+def get_block_rows(raster, block_memory_bytes=bil_default_block_memory_bytes):
+    # input block, float working copy, validity mask and 16 bit output for one row of all bands
+    row_bytes = raster.width * raster.bands * (raster.dtype.itemsize + 8 + 1 + 2)
+    block_rows = max(1, int(block_memory_bytes // row_bytes))
+    row_step = min(raster.row_step, raster.height)
+    SCT_GEOTIFF.check_single_strip_memory(raster, row_bytes, block_memory_bytes)
+    block_rows = max(row_step, block_rows - block_rows % row_step)
+    return min(block_rows, raster.height)
+
+
+###############################################################################################################
+# function to get the most block memory one convert_geotiff_to_bil call holds, so several conversions run at once can
+# be fitted into a memory budget
+# inputs are the block memory budget, pipeline depth, skip_empty and reproject settings of the conversion
+# output is the peak in bytes: the blocks of the conversion (one block, or the pipeline buffers, which share the
+# budget), the first valid block kept from the scan (the size of one block or pipeline buffer) and the source window
+# read for a reprojected block (up to the whole budget)
+
+def get_peak_memory_bytes(block_memory_bytes, pipeline_depth=0, skip_empty=False, reproject=False):
+    peak_bytes = block_memory_bytes
+    if skip_empty:
+        peak_bytes += block_memory_bytes // max(1, pipeline_depth)
+    if reproject:
+        peak_bytes += block_memory_bytes
+    return peak_bytes
+
+
+###############################################################################################################
+# function to get the mask of the pixels of a block that are not NaN, infinite or NODATA
+
+def get_valid_pixels(block, nodata_value):
+    valid = np.isfinite(block)
+    valid &= block > bil_input_nodata_threshold
+    if nodata_value is not None:
+        valid &= block != nodata_value
+    return valid
+
+
+###############################################################################################################
+# function to find where the valid pixels of a raster start, to skip tiles and blocks that are all NODATA
+# GeoTIFF strips and tiles that were never written (sparse files) are known to be NODATA without reading them, the
+# other blocks are read in turn until one has a valid pixel
+# inputs are the raster and the number of rows in a block
+# output is a tuple of the first row of the first block with a valid pixel and the block (None and None if the raster
+# is all NODATA), and the number of bytes read before it
+
+def find_first_valid_block(raster, block_rows):
+    bytes_read = 0
+    for row_start in range(0, raster.height, block_rows):
+        row_count = min(block_rows, raster.height - row_start)
+        if getattr(raster, 'is_sparse', None) is not None and raster.is_sparse(row_start, row_count):
+            continue
+        block = raster.read_rows(row_start, row_count)
+        if get_valid_pixels(block, raster.nodata).any():
+            return row_start, block, bytes_read
+        bytes_read += block.nbytes
+    return None, None, bytes_read
+
+
+###############################################################################################################
+# Class wrapping a raster whose first valid block has been read by find_first_valid_block, so the conversion takes
+# the rows of that block from memory instead of reading them again
+# the block is dropped once the conversion has gone past it, other attributes are those of the raster
+
+class ScannedRaster(object):
+
+    def __init__(self, raster, row_start, block):
+        self.raster = raster
+        self.row_start = row_start
+        self.block = block
+
+    def __getattr__(self, name):
+        return getattr(self.raster, name)
+
+    def read_rows(self, row_start, row_count, out=None):
+        block = self.block
+        if block is not None:
+            block_end = self.row_start + block.shape[1]
+            if row_start + row_count >= block_end:
+                self.block = None
+            if self.row_start <= row_start and row_start + row_count <= block_end:
+                window = block[:, row_start - self.row_start:row_start - self.row_start + row_count]
+                if out is None:
+                    return window
+                out[...] = window
+                return out
+        return self.raster.read_rows(row_start, row_count, out)
+
+
+###############################################################################################################
+# function to get the blocks of a raster that are known to be all NODATA, before the first valid row or sparse
+# output is the set of the first rows of those blocks
+
+def get_empty_blocks(raster, block_rows, first_valid_row=0):
+    empty_blocks = set()
+    for row_start in range(0, raster.height, block_rows):
+        row_count = min(block_rows, raster.height - row_start)
+        if row_start + row_count <= first_valid_row or \
+                (getattr(raster, 'is_sparse', None) is not None and raster.is_sparse(row_start, row_count)):
+            empty_blocks.add(row_start)
+    return empty_blocks
+
+
+###############################################################################################################
+# function to convert one block of input pixels to 16 bit signed values
+# inputs are a block shaped (bands, rows, columns), the input NODATA value (or None) and the output array shaped
+# (rows, bands, columns) ie. in BIL order
+# values are rounded to the nearest integer and saturate at -32767 and 32767, NaN, infinite and NODATA pixels are
+# written as -32768, blocks with no valid pixels are filled with -32768 without converting them
+# output is a tuple of the number of NODATA pixels and the number of saturated pixels in the block
+
+def convert_block_to_int16(block, nodata_value, out):
+    valid = get_valid_pixels(block, nodata_value)
+    if not valid.any():
+        out.fill(bil_nodata_value)
+        return block.size, 0
+
+    scaled = np.rint(block)
+    saturated_count = int(np.count_nonzero(valid & ((scaled < bil_min_value) | (scaled > bil_max_value))))
+    np.clip(scaled, bil_min_value, bil_max_value, out=scaled)
+    scaled[~valid] = bil_nodata_value
+
+    out[...] = scaled.transpose(1, 0, 2)
+    return block.size - int(np.count_nonzero(valid)), saturated_count
+
+
+###############################################################################################################
+# function to convert a floating point GeoTIFF to a 16 bit signed BIL file
+# inputs are the GeoTIFF path, the output bil path and the memory budget for one block of rows
+# output is a dictionary of the conversion metadata (samples, lines, bands, ulxmap, ulymap, xdim, ydim, data_type,
+# nodata_count, saturated_count, bytes_read, bytes_written, and the read_seconds and write_seconds spent reading the
+# input and writing the output), which has everything SCT_ENVI_HEADER needs to write the header
+# if compute_statistics is set the metadata also has the per band statistics of the output (an
+# SCT_BAND_STATISTICS.BandStatistics), built from each block as it is written
+# if an overview_folder is given the overview levels are built from each block as it is written (see SCT_OVERVIEWS)
+# and the metadata has the list of overview files
+# if reproject is set, inputs that are not in EPSG:4326 are reprojected onto the EPSG:4326 grid (nearest neighbour,
+# see SCT_REPROJECT) in the same pass and the metadata has the EPSG code they were reprojected from
+# if pipeline_depth is 2 or more, blocks are read ahead and written behind by separate threads with that many
+# buffers for each (2 is double buffering, 3 triple buffering) so reading, converting and writing overlap, the
+# block memory budget is shared between the buffers so the memory used is the same
+# blocks known to be all NODATA (see get_empty_blocks) are written as NODATA without reading them, and the metadata
+# has the number of these blocks and of blocks read that had no valid pixels (empty_blocks) out of the block_count
+# if skip_empty is set the raster is first checked for valid pixels (see find_first_valid_block), in blocks the size of
+# one pipeline buffer as the first valid block is kept while the buffers are in use, if there are none no bil file is
+# written and the metadata has empty set, otherwise the blocks before the first valid pixel are not read again
+# raises ValueError for files that can not be converted
+
+def convert_geotiff_to_bil(input_raster, output_bil, block_memory_bytes=bil_default_block_memory_bytes,
+                           compute_statistics=False, overview_folder=None, overview_resampling='nearest',
+                           reproject=False, pipeline_depth=0, skip_empty=False):
+    with SCT_GEOTIFF.GeoTiffRaster(input_raster) as raster:
+        source_epsg = raster.epsg
+        if reproject and source_epsg != SCT_REPROJECT.reproject_target_epsg:
+            raster = SCT_REPROJECT.ReprojectedRaster(raster, block_memory_bytes=block_memory_bytes)
+        if raster.geotransform is None:
+            raise ValueError("%s has no georeferencing" % input_raster)
+        if raster.geotransform[2] != 0.0 or raster.geotransform[4] != 0.0:
+            raise ValueError("%s is rotated, only north up rasters can be converted" % input_raster)
+
+        xdim = raster.geotransform[1]
+        ydim = -raster.geotransform[5]
+        # ESRI headers give the centre of the upper left pixel
+        metadata = {'samples': raster.width,
+                    'lines': raster.height,
+                    'bands': raster.bands,
+                    'ulxmap': raster.geotransform[0] + xdim / 2.0,
+                    'ulymap': raster.geotransform[3] - ydim / 2.0,
+                    'xdim': xdim,
+                    'ydim': ydim,
+                    'data_type': SCT_ENVI_HEADER.envi_data_type_int16,
+                    'nodata_count': 0,
+                    'saturated_count': 0,
+                    'bytes_read': 0,
+                    'bytes_written': 0,
+                    'read_seconds': 0.0,
+                    'write_seconds': 0.0,
+                    'block_count': 0,
+                    'empty_blocks': 0}
+        if raster.epsg != source_epsg:
+            metadata['reprojected_from'] = source_epsg
+
+        first_valid_row = 0
+        if skip_empty:
+            read_start = SCT_INSTRUMENTATION.timer()
+            first_valid_row, first_valid_block, metadata['bytes_read'] = \
+                find_first_valid_block(raster, get_block_rows(raster, block_memory_bytes // max(1, pipeline_depth)))
+            metadata['read_seconds'] += SCT_INSTRUMENTATION.timer() - read_start
+            if first_valid_row is None:
+                metadata['empty'] = True
+                metadata['nodata_count'] = raster.width * raster.height * raster.bands
+                return metadata
+            raster = ScannedRaster(raster, first_valid_row, first_valid_block)
+
+        statistics = None
+        if compute_statistics:
+            statistics = SCT_BAND_STATISTICS.BandStatistics(raster.bands)
+            metadata['statistics'] = statistics
+
+        overview_builder = None
+        if overview_folder is not None:
+            overview_builder = SCT_OVERVIEWS.OverviewBuilder(output_bil, metadata, overview_folder,
+                                                             overview_resampling)
+
+        # each block, as it is converted, also goes to the statistics and overviews, block is None for blocks that
+        # were known to be empty and not read
+        def update_block(block, out, nodata_count, saturated_count):
+            if statistics is not None:
+                if nodata_count == out.size:
+                    statistics.add_nodata(out.shape[0] * out.shape[2])
+                else:
+                    statistics.update(out, bil_nodata_value)
+            if overview_builder is not None:
+                overview_builder.update(out, bil_nodata_value)
+            metadata['nodata_count'] += nodata_count
+            metadata['saturated_count'] += saturated_count
+            metadata['block_count'] += 1
+            if nodata_count == out.size:
+                metadata['empty_blocks'] += 1
+            if block is not None:
+                metadata['bytes_read'] += block.nbytes
+            metadata['bytes_written'] += out.nbytes
+
+        try:
+            with open(output_bil, 'wb') as bil_file:
+                if pipeline_depth >= 2:
+                    block_rows = get_block_rows(raster, block_memory_bytes // pipeline_depth)
+                    convert_blocks_pipelined(raster, block_rows, bil_file, pipeline_depth, update_block, metadata,
+                                             get_empty_blocks(raster, block_rows, first_valid_row))
+                else:
+                    block_rows = get_block_rows(raster, block_memory_bytes)
+                    empty_blocks = get_empty_blocks(raster, block_rows, first_valid_row)
+                    out_buffer = np.empty((block_rows, raster.bands, raster.width), dtype='<i2')
+                    for row_start in range(0, raster.height, block_rows):
+                        row_count = min(block_rows, raster.height - row_start)
+                        out = out_buffer[:row_count]
+                        if row_start in empty_blocks:
+                            block = None
+                            out.fill(bil_nodata_value)
+                            nodata_count, saturated_count = out.size, 0
+                        else:
+                            read_start = SCT_INSTRUMENTATION.timer()
+                            block = raster.read_rows(row_start, row_count)
+                            metadata['read_seconds'] += SCT_INSTRUMENTATION.timer() - read_start
+                            nodata_count, saturated_count = convert_block_to_int16(block, raster.nodata, out)
+                        write_start = SCT_INSTRUMENTATION.timer()
+                        out.tofile(bil_file)
+                        metadata['write_seconds'] += SCT_INSTRUMENTATION.timer() - write_start
+                        update_block(block, out, nodata_count, saturated_count)
+        except Exception:
+            if overview_builder is not None:
+                overview_builder.close()
+            raise
+        if overview_builder is not None:
+            metadata['overviews'] = overview_builder.finish(bil_nodata_value)
+
+    return metadata
+
+
+###############################################################################################################
+# function to convert the blocks of a raster with reading, converting and writing overlapped
+# a read ahead thread reads blocks into a pool of input buffers, the calling thread converts each block into a pool
+# of output buffers (and passes it to update_block) and a writer thread writes them to bil_file in order, buffers
+# are handed back to their pool when they have been used so at most depth blocks of each are in memory
+# blocks in empty_blocks (the first rows of blocks known to be all NODATA) are not read, and written as NODATA
+# the time the threads spend reading and writing is added to the read_seconds and write_seconds of the metadata
+# an error in any stage stops the other two and is raised in the calling thread
+
+def convert_blocks_pipelined(raster, block_rows, bil_file, depth, update_block, metadata, empty_blocks=()):
+    free_inputs = queue.Queue()
+    free_outputs = queue.Queue()
+    for _ in range(depth):
+        free_inputs.put(np.empty((raster.bands, block_rows, raster.width), dtype=raster.dtype))
+        free_outputs.put(np.empty((block_rows, raster.bands, raster.width), dtype='<i2'))
+    read_blocks = queue.Queue()  # bounded by the number of input buffers
+    write_blocks = queue.Queue()  # bounded by the number of output buffers
+    stop = threading.Event()
+    errors = []
+    seconds = {'read': 0.0, 'write': 0.0}
+
+    def get_buffer(buffers):
+        while not stop.is_set():
+            try:
+                return buffers.get(timeout=bil_pipeline_poll_seconds)
+            except queue.Empty:
+                pass
+        return None
+
+    def read_ahead():
+        try:
+            for row_start in range(0, raster.height, block_rows):
+                in_buffer = get_buffer(free_inputs)
+                if in_buffer is None:
+                    return
+                row_count = min(block_rows, raster.height - row_start)
+                block = None
+                if row_start not in empty_blocks:
+                    read_start = SCT_INSTRUMENTATION.timer()
+                    block = raster.read_rows(row_start, row_count, in_buffer[:, :row_count])
+                    seconds['read'] += SCT_INSTRUMENTATION.timer() - read_start
+                read_blocks.put((in_buffer, row_count, block))
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            read_blocks.put(None)
+
+    def write_behind():
+        try:
+            while True:
+                item = write_blocks.get()
+                if item is None:
+                    return
+                out_buffer, out = item
+                if not stop.is_set():
+                    write_start = SCT_INSTRUMENTATION.timer()
+                    out.tofile(bil_file)
+                    seconds['write'] += SCT_INSTRUMENTATION.timer() - write_start
+                free_outputs.put(out_buffer)
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+
+    reader = threading.Thread(target=read_ahead, name="SCT block reader")
+    writer = threading.Thread(target=write_behind, name="SCT block writer")
+    reader.daemon = writer.daemon = True
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            item = read_blocks.get()
+            if item is None:
+                break
+            in_buffer, row_count, block = item
+            out_buffer = get_buffer(free_outputs)
+            if out_buffer is None:
+                break
+            out = out_buffer[:row_count]
+            if block is None:
+                out.fill(bil_nodata_value)
+                nodata_count, saturated_count = out.size, 0
+            else:
+                nodata_count, saturated_count = convert_block_to_int16(block, raster.nodata, out)
+            update_block(block, out, nodata_count, saturated_count)
+            free_inputs.put(in_buffer)
+            write_blocks.put((out_buffer, out))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        write_blocks.put(None)
+        reader.join()
+        writer.join()
+        metadata['read_seconds'] += seconds['read']
+        metadata['write_seconds'] += seconds['write']
+    if errors:
+        raise errors[0]
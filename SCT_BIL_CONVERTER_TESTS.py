@@ -0,0 +1,255 @@
+# Automated test module for the numpy GeoTIFF reader and BIL converter used by the Stand Condition Tool
+# Raster Converter project script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+import SCT_BIL_CONVERTER
+import SCT_GEOTIFF
+import SCT_TEST_DATA
+
+
+# function to make a 6 band floating point test image with some NODATA and out of range values
+def make_test_bands(rows, cols, dtype):
+    bands = np.arange(6 * rows * cols, dtype=np.float64).reshape(6, rows, cols) * 0.75 - 400.0
+    bands[0, 0, 0] = np.nan
+    bands[1, 1, 1] = 50000.0
+    bands[2, 2, 2] = -50000.0
+    return bands.astype(dtype)
+
+
+# function to read back a converted bil file as an array shaped (lines, bands, samples)
+def read_test_bil(bil_path, lines, bands, samples):
+    return np.fromfile(bil_path, dtype='<i2').reshape(lines, bands, samples)
+
+
+# test that block conversion rounds, clamps and maps NODATA to -32768
+def test_convert_block_to_int16():
+    block = np.array([[[1.4, 1.6, np.nan, 40000.0, -40000.0, -9999.0, -3.4028235e38, np.inf]]])
+    out = np.empty((1, 1, 8), dtype='<i2')
+    nodata_count, saturated_count = SCT_BIL_CONVERTER.convert_block_to_int16(block, -9999.0, out)
+    assert list(out[0, 0]) == [1, 2, -32768, 32767, -32767, -32768, -32768, -32768]
+    assert nodata_count == 4 and saturated_count == 2
+
+
+# test that the reader returns the same pixels for stripped, tiled, planar and compressed layouts
+def test_read_window_layouts():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bands = make_test_bands(37, 29, np.float32)
+        layouts = [{}, {'rows_per_strip': 5}, {'tile_size': 16}, {'tile_size': 16, 'planar': 2, 'compress': True},
+                   {'rows_per_strip': 3, 'planar': 2}, {'rows_per_strip': 4, 'compress': True}]
+        for layout_index, layout in enumerate(layouts):
+            tiff_path = os.path.join(test_folder, "layout%d.tif" % layout_index)
+            SCT_TEST_DATA.write_test_geotiff(tiff_path, bands, **layout)
+            with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+                assert (raster.bands, raster.height, raster.width) == bands.shape
+                assert np.array_equal(raster.read_window(0, 37), bands, equal_nan=True)
+                assert np.array_equal(raster.read_window(7, 20, 3, 17), bands[:, 7:27, 3:20], equal_nan=True)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a float32 and a float64 tile convert to the expected 16 bit bil file and metadata when the memory
+# budget forces the tile to be converted in several blocks
+def test_convert_geotiff_to_bil():
+    test_folder = tempfile.mkdtemp()
+    try:
+        for dtype, layout in [(np.float32, {'rows_per_strip': 2}), (np.float64, {'tile_size': 16, 'compress': True})]:
+            bands = make_test_bands(40, 33, dtype)
+            tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"), bands,
+                                                         origin=(140.5, -27.5), pixel_size=0.00025, **layout)
+            bil_path = os.path.join(test_folder, "MDB_P75_test.BIL")
+            metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, block_memory_bytes=4096)
+
+            expected = np.empty((40, 6, 33), dtype='<i2')
+            SCT_BIL_CONVERTER.convert_block_to_int16(bands, None, expected)
+            assert np.array_equal(read_test_bil(bil_path, 40, 6, 33), expected)
+            assert expected[0, 0, 0] == -32768 and expected[1, 1, 1] == 32767 and expected[2, 2, 2] == -32767
+            assert metadata['nodata_count'] == 1 and metadata['saturated_count'] == 2
+            assert metadata['bytes_written'] == os.path.getsize(bil_path)
+            assert (metadata['lines'], metadata['samples'], metadata['bands']) == (40, 33, 6)
+            assert abs(metadata['ulxmap'] - 140.500125) < 1e-9 and abs(metadata['ulymap'] + 27.500125) < 1e-9
+            assert metadata['xdim'] == 0.00025 and metadata['ydim'] == 0.00025
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a tile stored as one uncompressed strip is converted in blocks within the memory budget, and that a tile
+# stored as one compressed strip larger than the budget is refused instead of being decoded whole
+def test_single_strip_block_rows():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bands = make_test_bands(40, 33, np.float32)
+        bil_path = os.path.join(test_folder, "MDB_P75_test.BIL")
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"), bands)
+        with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+            assert raster.chunk_rows == 40 and raster.row_step == 1
+            assert SCT_BIL_CONVERTER.get_block_rows(raster, 4096) == 1
+            assert np.array_equal(raster.read_rows(17, 3), bands[:, 17:20])
+        metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, block_memory_bytes=4096)
+        expected = np.empty((40, 6, 33), dtype='<i2')
+        SCT_BIL_CONVERTER.convert_block_to_int16(bands, None, expected)
+        assert np.array_equal(read_test_bil(bil_path, 40, 6, 33), expected) and metadata['block_count'] == 40
+
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"), bands,
+                                                     compress=True)
+        with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+            assert SCT_BIL_CONVERTER.get_block_rows(raster, 40 * 33 * 6 * 15) == 40
+            try:
+                SCT_BIL_CONVERTER.get_block_rows(raster, 4096)
+                assert False, "single compressed strip larger than the budget not refused"
+            except ValueError as err:
+                assert "single compressed strip" in str(err)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that the pipelined conversion, with double and triple buffering and many small blocks, writes the same bil
+# file, statistics and overviews as converting each block in turn
+def test_pipelined_conversion():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bands = make_test_bands(530, 520, np.float32)
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"), bands,
+                                                     rows_per_strip=3)
+        outputs = {}
+        for depth in (0, 2, 3):
+            output_folder = os.path.join(test_folder, str(depth))
+            os.mkdir(output_folder)
+            bil_path = os.path.join(output_folder, "MDB_P75_test.BIL")
+            metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, 256 * 1024 * max(1, depth), True,
+                                                                output_folder, pipeline_depth=depth)
+            assert len(metadata['overviews']) == 1
+            assert metadata['bytes_read'] == bands.nbytes and metadata['bytes_written'] == bands.nbytes // 2
+            with open(bil_path, 'rb') as bil_file, open(metadata['overviews'][0], 'rb') as overview_file:
+                outputs[depth] = (bil_file.read(), overview_file.read(), metadata['statistics'].to_dict(),
+                                  metadata['nodata_count'], metadata['saturated_count'])
+        assert outputs[2] == outputs[0] and outputs[3] == outputs[0]
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# raster that fails part way through, to test that an error in the read ahead thread reaches the caller
+class FailingRaster(object):
+
+    def __init__(self, raster, fail_row):
+        self.raster = raster
+        self.fail_row = fail_row
+        self.bands, self.width, self.height, self.dtype = raster.bands, raster.width, raster.height, raster.dtype
+        self.nodata = raster.nodata
+
+    def read_rows(self, row_start, row_count, out=None):
+        if row_start >= self.fail_row:
+            raise IOError("read error at row %d" % row_start)
+        return self.raster.read_rows(row_start, row_count, out)
+
+
+# test that an error while reading or converting stops the pipeline threads and is raised by the conversion
+def test_pipelined_conversion_errors():
+    test_folder = tempfile.mkdtemp()
+    try:
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"),
+                                                     make_test_bands(40, 33, np.float32), rows_per_strip=2)
+        thread_count = threading.active_count()
+        with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+            metadata = {'read_seconds': 0.0, 'write_seconds': 0.0}
+            for fail_row in (0, 20):
+                converted_rows = []
+                with open(os.path.join(test_folder, "MDB_P75_test.BIL"), 'wb') as bil_file:
+                    try:
+                        SCT_BIL_CONVERTER.convert_blocks_pipelined(FailingRaster(raster, fail_row), 4, bil_file, 2,
+                                                                   lambda block, out, *counts: converted_rows.append(
+                                                                       len(out)), metadata)
+                    except IOError as error:
+                        assert str(error) == "read error at row %d" % fail_row
+                    else:
+                        raise AssertionError("read error was not raised")
+                assert sum(converted_rows) <= fail_row
+                assert threading.active_count() == thread_count
+
+            def fail_update(block, out, *counts):
+                raise ValueError("update failed")
+            with open(os.path.join(test_folder, "MDB_P75_test.BIL"), 'wb') as bil_file:
+                try:
+                    SCT_BIL_CONVERTER.convert_blocks_pipelined(raster, 4, bil_file, 3, fail_update, metadata)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError("update error was not raised")
+            assert threading.active_count() == thread_count
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that tiles that are all NODATA are not written when skip_empty is set, and that blocks known to be all NODATA
+# (sparse strips, or before the first valid row) are written as NODATA without being read
+def test_skip_empty():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bil_path = os.path.join(test_folder, "MDB_P75_test.BIL")
+        bands = np.full((6, 40, 33), -9999.0, dtype=np.float32)
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"), bands,
+                                                     nodata=-9999.0, rows_per_strip=4, compress=True, sparse=True)
+        with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+            assert raster.is_sparse(0, 40) and SCT_BIL_CONVERTER.find_first_valid_block(raster, 8) == (None, None, 0)
+        metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, 4096, True, skip_empty=True)
+        assert metadata['empty'] and metadata['nodata_count'] == bands.size and metadata['bytes_read'] == 0
+        assert 'statistics' not in metadata and not os.path.exists(bil_path)
+
+        bands[:, 30:, 10:] = 100.0  # an edge tile, valid pixels in the last rows only
+        # the first valid pixels are in the block at row 28, the blocks before it are read only by the check and only
+        # if they are not sparse, every other block is read once
+        for sparse, expected_bytes_read in ((True, 6 * 12 * 33 * 4), (False, 6 * 40 * 33 * 4)):
+            tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"), bands,
+                                                         nodata=-9999.0, rows_per_strip=4, compress=True,
+                                                         sparse=sparse)
+            with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+                assert raster.is_sparse(0, 28) == sparse and not raster.is_sparse(24, 8)
+                assert SCT_BIL_CONVERTER.get_block_rows(raster, 4096) == 4
+            expected = np.empty((40, 6, 33), dtype='<i2')
+            SCT_BIL_CONVERTER.convert_block_to_int16(bands, -9999.0, expected)
+            outputs = []
+            scan_block_rows = []
+            find_first_valid_block = SCT_BIL_CONVERTER.find_first_valid_block
+
+            def record_scan(raster, block_rows):
+                scan_block_rows.append(block_rows)
+                return find_first_valid_block(raster, block_rows)
+
+            # 4 row blocks, for the pipeline 2 buffers of 4 rows of 33 columns of 6 bands at 15 bytes a pixel
+            for depth, block_memory_bytes in ((0, 4096), (2, 2 * 4 * 33 * 6 * 15)):
+                SCT_BIL_CONVERTER.find_first_valid_block = record_scan
+                try:
+                    metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, block_memory_bytes, True,
+                                                                        pipeline_depth=depth, skip_empty=True)
+                finally:
+                    SCT_BIL_CONVERTER.find_first_valid_block = find_first_valid_block
+                assert np.array_equal(read_test_bil(bil_path, 40, 6, 33), expected)
+                assert metadata['nodata_count'] == bands.size - 6 * 10 * 23
+                assert (metadata['block_count'], metadata['empty_blocks']) == (10, 7)
+                assert metadata['statistics'].to_dict()['bands'][0]['nodata_count'] == 40 * 33 - 10 * 23
+                assert metadata['bytes_read'] == expected_bytes_read and 'empty' not in metadata
+                outputs.append(metadata['statistics'].to_dict())
+            assert outputs[0] == outputs[1]
+            assert scan_block_rows == [4, 4]  # the scan block is one pipeline buffer, not the whole budget
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_convert_block_to_int16()
+    test_read_window_layouts()
+    test_convert_geotiff_to_bil()
+    test_single_strip_block_rows()
+    test_pipelined_conversion()
+    test_pipelined_conversion_errors()
+    test_skip_empty()
+    print("Everything passed")
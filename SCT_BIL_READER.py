@@ -0,0 +1,117 @@
+# Module to read back the BIL files made for the MDBA Stand Condition Tool without arcpy
+# The ENVI header (or the ESRI header of a CopyRaster output) is parsed and the bil file is memory mapped as a numpy
+# array shaped (lines, bands, samples), so windows, single bands and strided (every nth row and column) views of a
+# tile are numpy views of the file and only the pages that are touched are read from disk
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import os
+
+import numpy as np
+
+import SCT_ENVI_HEADER
+
+# numpy data types of the ENVI data type codes
+envi_data_types = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8', 12: 'u2', 13: 'u4', 14: 'i8', 15: 'u8'}
+
+# numpy data types of the ESRI PIXELTYPE and NBITS values
+esri_data_types = {('UNSIGNEDINT', '8'): 'u1', ('SIGNEDINT', '8'): 'i1', ('UNSIGNEDINT', '16'): 'u2',
+                   ('SIGNEDINT', '16'): 'i2', ('UNSIGNEDINT', '32'): 'u4', ('SIGNEDINT', '32'): 'i4',
+                   ('FLOAT', '32'): 'f4', ('FLOAT', '64'): 'f8'}
+
+
+###############################################################################################################
+# function to read the header of a bil file, in ENVI or ESRI format
+# output is the metadata dictionary of SCT_ENVI_HEADER.read_bil_header_metadata with the numpy data type (dtype,
+# including the byte order), the header offset in bytes and the NODATA value (None if the header has none) added
+# raises ValueError for files that are not band interleaved by line
+
+def read_bil_header(bil_path):
+    metadata = SCT_ENVI_HEADER.read_bil_header_metadata(bil_path)
+    header_path = SCT_ENVI_HEADER.get_bil_header_path(bil_path)
+    try:
+        envi_values = SCT_ENVI_HEADER.read_envi_header(header_path)
+    except ValueError:
+        esri_values = SCT_ENVI_HEADER.read_esri_header(header_path)
+        interleave = esri_values.get('LAYOUT', 'BIL').lower()
+        byte_order = '>' if esri_values.get('BYTEORDER', 'I').upper() == 'M' else '<'
+        dtype = esri_data_types[(esri_values.get('PIXELTYPE', 'SIGNEDINT').upper(), esri_values.get('NBITS', '16'))]
+        metadata['header_offset'] = int(esri_values.get('SKIPBYTES', 0))
+        metadata['nodata'] = float(esri_values['NODATA']) if 'NODATA' in esri_values else None
+    else:
+        interleave = envi_values.get('interleave', 'bil').lower()
+        byte_order = '>' if envi_values.get('byte order', '0') == '1' else '<'
+        dtype = envi_data_types[int(envi_values.get('data type', SCT_ENVI_HEADER.envi_data_type_int16))]
+        metadata['header_offset'] = int(envi_values.get('header offset', 0))
+        metadata['nodata'] = float(envi_values['data ignore value']) if 'data ignore value' in envi_values else None
+    if interleave != 'bil':
+        raise ValueError("%s is %s interleaved, only bil files can be read" % (bil_path, interleave))
+    metadata['dtype'] = np.dtype(dtype).newbyteorder(byte_order)
+    return metadata
+
+
+###############################################################################################################
+# Class giving memory mapped access to a bil file
+# input is the bil file path, the header must be next to it with a .hdr (or .hdrold) extension
+# data is the whole file as a read only numpy array shaped (lines, bands, samples), every method returns a view of it
+# so nothing is copied or read until the values are used
+# the file is unmapped when the BilRaster and every view taken from it have been released
+
+class BilRaster(object):
+
+    def __init__(self, bil_path):
+        self.path = bil_path
+        self.metadata = read_bil_header(bil_path)
+        self.samples = self.metadata['samples']
+        self.lines = self.metadata['lines']
+        self.bands = self.metadata['bands']
+        self.dtype = self.metadata['dtype']
+        self.nodata = self.metadata['nodata']
+        expected_size = self.metadata['header_offset'] + self.lines * self.bands * self.samples * self.dtype.itemsize
+        if os.path.getsize(bil_path) < expected_size:
+            raise ValueError("%s is %d bytes, its header needs %d" % (bil_path, os.path.getsize(bil_path),
+                                                                      expected_size))
+        self.data = np.memmap(bil_path, dtype=self.dtype, mode='r', offset=self.metadata['header_offset'],
+                              shape=(self.lines, self.bands, self.samples))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # release the memory map held by the BilRaster (views already taken keep the file mapped until they are released)
+    def close(self):
+        self.data = None
+
+    # get the GDAL style geotransform (origin x, pixel width, 0, origin y, 0, -pixel height) of the outer corner of
+    # the upper left pixel, the header gives its centre
+    @property
+    def geotransform(self):
+        metadata = self.metadata
+        return (metadata['ulxmap'] - metadata['xdim'] / 2.0, metadata['xdim'], 0.0,
+                metadata['ulymap'] + metadata['ydim'] / 2.0, 0.0, -metadata['ydim'])
+
+    # get a window shaped (rows, bands, columns) in BIL order
+    # bands is None for every band, a band number (from 0) or a slice, step takes every nth row and column
+    def read_window(self, row_start, row_count, col_start=0, col_count=None, bands=None, step=1):
+        if col_count is None:
+            col_count = self.samples - col_start
+        if row_start < 0 or col_start < 0 or row_start + row_count > self.lines or \
+                col_start + col_count > self.samples:
+            raise ValueError("window rows %d:%d, columns %d:%d is outside %s (%d x %d)"
+                             % (row_start, row_start + row_count, col_start, col_start + col_count, self.path,
+                                self.lines, self.samples))
+        if bands is None:
+            bands = slice(None)
+        elif not isinstance(bands, slice):
+            bands = slice(bands, bands + 1)
+        return self.data[row_start:row_start + row_count:step, bands, col_start:col_start + col_count:step]
+
+    # get one band (from 0) shaped (lines, samples)
+    def read_band(self, band):
+        return self.data[:, band, :]
+
+    # get a window shaped (bands, rows, columns), the order SCT_GEOTIFF.GeoTiffRaster returns
+    def read_window_band_first(self, row_start, row_count, col_start=0, col_count=None):
+        return self.read_window(row_start, row_count, col_start, col_count).transpose(1, 0, 2)
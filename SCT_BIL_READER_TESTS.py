@@ -0,0 +1,92 @@
+# Automated test module for the memory mapped BIL reader used by the Stand Condition Tool Raster Converter project
+# script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_BIL_READER
+import SCT_ENVI_HEADER
+
+test_metadata = {'samples': 29, 'lines': 37, 'bands': 6, 'ulxmap': 143.000125, 'ulymap': -34.000125,
+                 'xdim': 0.00025, 'ydim': 0.00025}
+
+
+# test that windows, bands and strided windows of a bil file with an ENVI header are views of the memory map
+def test_bil_raster_views():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bil_path = os.path.join(test_folder, "MDB_P75_test.BIL")
+        pixels = np.arange(37 * 6 * 29, dtype='<i2').reshape(37, 6, 29)
+        pixels.tofile(bil_path)
+        SCT_ENVI_HEADER.write_envi_header(bil_path, test_metadata)
+
+        with SCT_BIL_READER.BilRaster(bil_path) as raster:
+            assert (raster.lines, raster.bands, raster.samples) == (37, 6, 29)
+            assert raster.dtype == np.dtype('<i2') and raster.nodata is None
+            assert raster.geotransform == (143.0, 0.00025, 0.0, -34.0, 0.0, -0.00025)
+            window = raster.read_window(5, 10, 3, 7)
+            assert np.array_equal(window, pixels[5:15, :, 3:10])
+            band = raster.read_band(4)
+            assert np.array_equal(band, pixels[:, 4, :])
+            strided = raster.read_window(0, 37, bands=slice(0, 3), step=4)
+            assert np.array_equal(strided, pixels[::4, 0:3, ::4])
+            assert np.array_equal(raster.read_window(0, 2, bands=5), pixels[0:2, 5:6, :])
+            assert np.array_equal(raster.read_window_band_first(1, 2), pixels[1:3].transpose(1, 0, 2))
+            for view in (window, band, strided):
+                assert np.shares_memory(view, raster.data)
+            try:
+                raster.read_window(30, 10)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("window outside the raster was read")
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test a big endian float bil file with an ESRI header and a header offset, and that short and band sequential files
+# are rejected
+def test_bil_raster_esri_header():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bil_path = os.path.join(test_folder, "esri.bil")
+        pixels = np.linspace(-1, 1, 4 * 2 * 5).astype('>f4').reshape(4, 2, 5)
+        with open(bil_path, 'wb') as bil_file:
+            bil_file.write(b'\0' * 16)
+            pixels.tofile(bil_file)
+        with open(os.path.join(test_folder, "esri.hdr"), 'w') as header_file:
+            header_file.write("BYTEORDER M\nLAYOUT BIL\nNROWS 4\nNCOLS 5\nNBANDS 2\nNBITS 32\nPIXELTYPE FLOAT\n"
+                              "SKIPBYTES 16\nULXMAP 143.5\nULYMAP -34.5\nXDIM 1.0\nYDIM 1.0\nNODATA -9999\n")
+        with SCT_BIL_READER.BilRaster(bil_path) as raster:
+            assert raster.dtype == np.dtype('>f4') and raster.nodata == -9999.0
+            assert np.array_equal(raster.read_window(0, 4), pixels)
+            assert raster.geotransform == (143.0, 1.0, 0.0, -34.0, 0.0, -1.0)
+
+        with open(bil_path, 'wb') as bil_file:
+            bil_file.write(b'\0' * 40)
+        for header_text in ["BYTEORDER M\nLAYOUT BIL\nNROWS 4\nNCOLS 5\nNBANDS 2\nNBITS 32\nPIXELTYPE FLOAT\n"
+                            "ULXMAP 143.5\nULYMAP -34.5\nXDIM 1.0\nYDIM 1.0\n",
+                            "BYTEORDER I\nLAYOUT BSQ\nNROWS 4\nNCOLS 5\nNBANDS 1\nNBITS 16\nPIXELTYPE SIGNEDINT\n"
+                            "ULXMAP 143.5\nULYMAP -34.5\nXDIM 1.0\nYDIM 1.0\n"]:
+            with open(os.path.join(test_folder, "esri.hdr"), 'w') as header_file:
+                header_file.write(header_text)
+            try:
+                SCT_BIL_READER.BilRaster(bil_path)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("bil file that does not match its header was opened")
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_bil_raster_views()
+    test_bil_raster_esri_header()
+    print("Everything passed")
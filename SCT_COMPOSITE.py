@@ -0,0 +1,313 @@
+# Module to build the cloud masked percentile composites used as Stand Condition Tool inputs locally, as done in
+# Earth Engine by Code_to_create_SCT_inputs
+# Landsat 5, 7 and 8 surface reflectance scenes (with their pixel_qa band) are cloud masked with the same QA bits as
+# cloudMaskL457 and maskL8sr, their bands mapped to blue, green, red, nir, swir1 and swir2 and the chosen percentile
+# of the clear observations of each pixel written as a 6 band floating point GeoTIFF, ready for the converter
+# Composites are written on the EPSG:4326 grid of the converter, scenes in other coordinate systems (eg. the WGS84 UTM
+# zones Landsat is delivered in) are sampled onto it with SCT_REPROJECT, so scenes from neighbouring zones can be
+# composited together
+# The output is built a block of rows at a time across all the scenes, the block size shrinks as the number of scenes
+# grows so memory use is set by the block memory budget and not by the number of scenes, each scene is opened once
+# for the whole composite and blocks are whole strips or tiles of the scenes so no chunk is decoded twice
+# Percentiles use a partial selection (numpy partition) of the 16 bit reflectance of each pixel, not a full sort
+
+# Created by MDBA for the Stand Condition Tool
+
+import datetime
+import math
+import os
+import re
+
+import numpy as np
+
+import SCT_GEOTIFF
+import SCT_REPROJECT
+import SCT_TILE_INDEX
+
+composite_band_names = ('blue', 'green', 'red', 'nir', 'swir1', 'swir2')
+
+# sensor of each Landsat collection 1 scene id prefix
+composite_scene_sensors = {'LT05': 'L5', 'LE07': 'L7', 'LC08': 'L8'}
+
+# band numbers (from 0) of blue, green, red, nir, swir1 and swir2 and of pixel_qa in the surface reflectance scenes
+# exported with all their bands (renameBands57 and renameBands8), scenes with 7 bands are taken to have been exported
+# with just these bands in order
+composite_sensor_bands = {'L5': (0, 1, 2, 3, 4, 6), 'L7': (0, 1, 2, 3, 4, 6), 'L8': (1, 2, 3, 4, 5, 6)}
+composite_sensor_qa_bands = {'L5': 9, 'L7': 9, 'L8': 10}
+
+# dates of the scenes used for each sensor, as filtered in the Earth Engine script
+composite_sensor_dates = {'L5': (datetime.date(1986, 9, 1), datetime.date(2012, 5, 5)),
+                          'L7': (datetime.date(1999, 1, 1), datetime.date(2003, 5, 31))}
+
+# pixel_qa bits
+qa_cloud_shadow_bit = 1 << 3
+qa_cloud_bit = 1 << 5
+qa_cloud_confidence_high_bit = 1 << 7
+
+# surface reflectance fill value, and the value clouds and fill are replaced with so they sort after every
+# observation
+surface_reflectance_nodata = -9999
+composite_masked_value = np.iinfo(np.int16).max
+
+# yearly composite windows, the first starts 1986-09-01 and ends 1988-01-01 and each following window is a year later
+composite_first_window = (datetime.date(1986, 9, 1), datetime.date(1988, 1, 1))
+composite_window_count = 34
+
+composite_default_percentile = 75
+
+# default memory allowed for the scene stack of one block of output rows and its working copies
+composite_default_block_memory_bytes = 256 * 1024 * 1024
+
+
+###############################################################################################################
+# functions to get the sensor (L5, L7 or L8) and acquisition date of a scene from its Landsat scene id file name,
+# eg. LC08_093084_20180101.tif
+# raise ValueError for file names that are not scene ids
+
+def get_scene_sensor(scene_path):
+    prefix = os.path.basename(scene_path)[:4].upper()
+    if prefix not in composite_scene_sensors:
+        raise ValueError("%s is not a Landsat 5, 7 or 8 scene" % scene_path)
+    return composite_scene_sensors[prefix]
+
+
+def get_scene_date(scene_path):
+    match = re.search(r'_(\d{4})(\d{2})(\d{2})(?:\D|$)', os.path.basename(scene_path))
+    if match is None:
+        raise ValueError("%s has no acquisition date" % scene_path)
+    return datetime.date(*[int(part) for part in match.groups()])
+
+
+###############################################################################################################
+# function to get the yearly composite windows of the Earth Engine script
+# output is a list of (start date, end date) tuples, the end date is not included in the window
+
+def get_composite_windows(window_count=composite_window_count):
+    first_start, first_end = composite_first_window
+    return [(first_start.replace(year=first_start.year + year), first_end.replace(year=first_end.year + year))
+            for year in range(window_count)]
+
+
+###############################################################################################################
+# function to select the scenes of a composite window, acquired from the start date up to (not including) the end
+# date and within the dates used for their sensor
+
+def select_window_scenes(scene_paths, start_date, end_date):
+    selected_scenes = []
+    for scene_path in scene_paths:
+        scene_date = get_scene_date(scene_path)
+        sensor_start, sensor_end = composite_sensor_dates.get(get_scene_sensor(scene_path),
+                                                              (datetime.date.min, datetime.date.max))
+        if start_date <= scene_date < end_date and sensor_start <= scene_date <= sensor_end:
+            selected_scenes.append(scene_path)
+    return selected_scenes
+
+
+###############################################################################################################
+# function to get the composite file name of a window, as exported by the Earth Engine script
+
+def get_composite_path(output_folder, start_date, end_date, percentile=composite_default_percentile):
+    return os.path.join(output_folder, "MDB_P%d_%s_%s_.tif" % (percentile, start_date.isoformat(),
+                                                               end_date.isoformat()))
+
+
+###############################################################################################################
+# function to get the clear pixels of a scene from its pixel_qa band
+# Landsat 5 and 7 (cloudMaskL457): cloud with high confidence, or cloud shadow, is masked
+# Landsat 8 (maskL8sr): cloud or cloud shadow is masked
+
+def get_clear_mask(qa, sensor):
+    if sensor == 'L8':
+        return (qa & (qa_cloud_shadow_bit | qa_cloud_bit)) == 0
+    cloud = ((qa & qa_cloud_bit) != 0) & ((qa & qa_cloud_confidence_high_bit) != 0)
+    cloud |= (qa & qa_cloud_shadow_bit) != 0
+    return ~cloud
+
+
+###############################################################################################################
+# function to get a percentile of each pixel of a stack of observations
+# input is a 16 bit stack shaped (observations, pixels) with masked observations set to composite_masked_value, the
+# number of clear observations of each pixel and the percentile (0 to 100)
+# pixels with the same number of clear observations are selected together, their clear values are always first so
+# only the two order statistics either side of the percentile are found, and the percentile is interpolated
+# linearly between them
+# output is a float32 array of the pixel percentiles, NaN for pixels with no clear observations
+
+def get_stack_percentile(stack, clear_counts, percentile):
+    result = np.full(stack.shape[1], np.nan, dtype=np.float32)
+    for clear_count in np.unique(clear_counts):
+        if clear_count == 0:
+            continue
+        pixels = np.nonzero(clear_counts == clear_count)[0]
+        position = percentile / 100.0 * (clear_count - 1)
+        lower = int(math.floor(position))
+        upper = min(lower + 1, clear_count - 1)
+        selected = np.partition(stack[:, pixels], (lower, upper), axis=0)
+        lower_values = selected[lower].astype(np.float64)
+        result[pixels] = lower_values + (selected[upper] - lower_values) * (position - lower)
+    return result
+
+
+###############################################################################################################
+# function to get the EPSG:4326 grid of a scene, from its SCT_TILE_INDEX tile description
+# scenes in EPSG:4326 keep their own grid, other scenes are given the grid SCT_REPROJECT samples them onto
+# output is a tuple of the GDAL style geotransform, width and height
+# raises ValueError if the scene is in a coordinate system that can not be reprojected
+
+def get_scene_grid(tile):
+    if tile['epsg'] == SCT_REPROJECT.reproject_target_epsg:
+        return (tile['left'], tile['xdim'], 0.0, tile['top'], 0.0, -tile['ydim']), tile['samples'], tile['lines']
+    if not SCT_REPROJECT.is_supported_epsg(tile['epsg']):
+        raise ValueError("%s is in EPSG %s, which can not be reprojected for a composite" % (tile['path'],
+                                                                                             tile['epsg']))
+    geotransform = (tile['left'], tile['xdim'], 0.0, tile['top'], 0.0, -tile['ydim'])
+    return SCT_REPROJECT.get_output_grid(tile['epsg'], geotransform, tile['samples'], tile['lines'])
+
+
+###############################################################################################################
+# function to get the EPSG:4326 output grid covering a list of scenes, on the pixel grid of the first scene
+# output is a tuple of the GDAL style geotransform, width and height
+# raises ValueError if a scene is in a coordinate system that can not be reprojected
+
+def get_scenes_grid(scene_paths):
+    grids = [get_scene_grid(SCT_TILE_INDEX.describe_tile(scene_path)) for scene_path in scene_paths]
+    (first_left, xdim, _, first_top, _, ydim), _, _ = grids[0]
+    ydim = -ydim
+    # edges of the scenes in pixels from the upper left corner of the first scene, snapped outwards
+    first_column = min(int(math.floor(round((grid[0][0] - first_left) / xdim, 6))) for grid in grids)
+    last_column = max(int(math.ceil(round((grid[0][0] + grid[1] * grid[0][1] - first_left) / xdim, 6)))
+                      for grid in grids)
+    first_row = min(int(math.floor(round((first_top - grid[0][3]) / ydim, 6))) for grid in grids)
+    last_row = max(int(math.ceil(round((first_top - grid[0][3] - grid[2] * grid[0][5]) / ydim, 6)))
+                   for grid in grids)
+    geotransform = (first_left + first_column * xdim, xdim, 0.0, first_top - first_row * ydim, 0.0, -ydim)
+    return geotransform, last_column - first_column, last_row - first_row
+
+
+###############################################################################################################
+# function to get where an open scene is in the output grid
+# output is a tuple of the row and column of the upper left pixel of the scene in the output grid
+# raises ValueError if the scene is not on the output pixel grid
+
+def get_scene_offset(raster, geotransform):
+    left, xdim, _, top, _, ydim = geotransform
+    column = (raster.geotransform[0] - left) / xdim
+    row = (raster.geotransform[3] - top) / ydim
+    tolerance = SCT_TILE_INDEX.tile_index_pixel_tolerance
+    if abs(raster.geotransform[1] - xdim) > abs(xdim) * tolerance or \
+            abs(raster.geotransform[5] - ydim) > abs(ydim) * tolerance or \
+            abs(column - round(column)) > tolerance or abs(row - round(row)) > tolerance:
+        raise ValueError("%s is not on the pixel grid of the composite" % raster.path)
+    return int(round(row)), int(round(column))
+
+
+###############################################################################################################
+# function to read the reflectance and clear mask of a window of an open scene
+# output is a tuple of the reflectance shaped (6, rows, columns) as int16 with masked pixels set to
+# composite_masked_value and the number of clear pixels
+
+def read_scene_block(raster, sensor, row_start, row_count, col_start, col_count):
+    window = raster.read_window(row_start, row_count, col_start, col_count)
+    if window.dtype.kind == 'f':
+        window[np.isnan(window)] = surface_reflectance_nodata  # outside a reprojected scene
+    if window.shape[0] == len(composite_band_names) + 1:
+        band_numbers, qa_band = tuple(range(len(composite_band_names))), len(composite_band_names)
+    else:
+        band_numbers, qa_band = composite_sensor_bands[sensor], composite_sensor_qa_bands[sensor]
+    reflectance = window[list(band_numbers)].astype(np.int16)
+    valid = reflectance != surface_reflectance_nodata
+    if sensor != 'L8':
+        valid &= valid.all(axis=0)  # edge pixels that are not in every band are removed, as in cloudMaskL457
+    valid &= get_clear_mask(window[qa_band].astype(np.int64), sensor)
+    reflectance[~valid] = composite_masked_value
+    return reflectance, int(np.count_nonzero(valid))
+
+
+###############################################################################################################
+# function to build the percentile composite of a list of scenes
+# inputs are the scene GeoTIFFs (Landsat scene id file names, in EPSG:4326 on a common pixel grid or in a coordinate
+# system SCT_REPROJECT supports), the output GeoTIFF path, the percentile, the output grid (by default the grid
+# covering all the scenes) and the block memory budget, of which each reprojected scene is allowed an equal share for
+# the source pixels it reads
+# the composite is written in EPSG:4326
+# output is a dictionary of the number of scenes, the output size, the number of clear observations and the number
+# of output pixels with no clear observation in any band
+# raises ValueError if a scene can not be reprojected or is not on the output pixel grid
+
+def composite_scenes(scene_paths, output_path, percentile=composite_default_percentile, grid=None,
+                     block_memory_bytes=composite_default_block_memory_bytes):
+    if not scene_paths:
+        raise ValueError("no scenes to composite for %s" % output_path)
+    geotransform, width, height = grid or get_scenes_grid(scene_paths)
+
+    rasters = []
+    try:
+        for scene_path in scene_paths:
+            raster = SCT_GEOTIFF.GeoTiffRaster(scene_path)
+            if raster.epsg != SCT_REPROJECT.reproject_target_epsg:
+                try:
+                    raster = SCT_REPROJECT.ReprojectedRaster(
+                        raster, block_memory_bytes=block_memory_bytes // len(scene_paths))
+                except BaseException:
+                    raster.close()
+                    raise
+            rasters.append(raster)
+        scenes = [(raster, get_scene_sensor(raster.path)) + get_scene_offset(raster, geotransform)
+                  for raster in rasters]
+        return _composite_scene_blocks(scenes, output_path, percentile, geotransform, width, height,
+                                       block_memory_bytes)
+    finally:
+        for raster in rasters:
+            raster.close()
+
+
+# build the composite from the open scenes, a tuple of (raster, sensor, row offset, column offset) for each
+def _composite_scene_blocks(scenes, output_path, percentile, geotransform, width, height, block_memory_bytes):
+    bands = len(composite_band_names)
+    # the scene stack and its partitioned copy for one row, plus the output row
+    row_bytes = width * (len(scenes) * bands * 2 * 2 + bands * 4)
+    block_rows = int(max(1, block_memory_bytes // row_bytes))
+    row_step = max(min(scene[0].row_step, scene[0].height) for scene in scenes)
+    block_rows = min(height, max(row_step, block_rows - block_rows % row_step))
+    summary = {'scenes': len(scenes), 'samples': width, 'lines': height, 'clear_observations': 0, 'empty_pixels': 0}
+    with SCT_GEOTIFF.GeoTiffWriter(output_path, width, height, bands, np.float32, geotransform,
+                                   SCT_REPROJECT.reproject_target_epsg) as writer:
+        for row_start in range(0, height, block_rows):
+            row_count = min(block_rows, height - row_start)
+            # the rows and columns of the block each scene covers
+            block_scenes = []
+            for raster, sensor, row_offset, column_offset in scenes:
+                first_row = max(row_start, row_offset)
+                last_row = min(row_start + row_count, row_offset + raster.height)
+                first_column = max(0, column_offset)
+                last_column = min(width, column_offset + raster.width)
+                if first_row < last_row and first_column < last_column:
+                    block_scenes.append((raster, sensor, first_row, last_row, first_column, last_column,
+                                         row_offset, column_offset))
+            stack = np.full((bands, len(block_scenes), row_count, width), composite_masked_value, dtype=np.int16)
+            for scene_number, (raster, sensor, first_row, last_row, first_column, last_column, row_offset,
+                               column_offset) in enumerate(block_scenes):
+                reflectance, clear_count = read_scene_block(raster, sensor, first_row - row_offset,
+                                                            last_row - first_row, first_column - column_offset,
+                                                            last_column - first_column)
+                stack[:, scene_number, first_row - row_start:last_row - row_start, first_column:last_column] = \
+                    reflectance
+                summary['clear_observations'] += clear_count
+            stack = stack.reshape(bands, len(block_scenes), row_count * width)
+            composite = np.empty((bands, row_count * width), dtype=np.float32)
+            for band in range(bands):
+                clear_counts = np.count_nonzero(stack[band] != composite_masked_value, axis=0)
+                composite[band] = get_stack_percentile(stack[band], clear_counts, percentile)
+            summary['empty_pixels'] += int(np.count_nonzero(np.isnan(composite).all(axis=0)))
+            writer.write_rows(composite.reshape(bands, row_count, width))
+    return summary
+
+
+###############################################################################################################
+# function to build the composite of one window, for running in a multiprocessing worker
+# input is a tuple of (scene paths, output path, percentile, grid, block memory budget)
+# output is a tuple of the output path and the summary from composite_scenes
+
+def composite_scenes_task(task):
+    scene_paths, output_path, percentile, grid, block_memory_bytes = task
+    return output_path, composite_scenes(scene_paths, output_path, percentile, grid, block_memory_bytes)
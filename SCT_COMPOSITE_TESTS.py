@@ -0,0 +1,199 @@
+# Automated test module for the local percentile compositing used to create the Stand Condition Tool inputs
+# Test data is synthetic and written to a temporary folder, no Earth Engine login is needed
+
+# Required imports
+
+import datetime
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_COMPOSITE
+import SCT_CONVERT_RASTER_TO_ENVI
+import SCT_GEOTIFF
+import SCT_REPROJECT
+import SCT_TEST_DATA
+
+
+# test the QA bit masks of cloudMaskL457 and maskL8sr
+def test_get_clear_mask():
+    qa = np.array([66, 66 | 8, 66 | 32, 66 | 128, 66 | 32 | 128])
+    assert list(SCT_COMPOSITE.get_clear_mask(qa, 'L5')) == [True, False, True, True, False]
+    assert list(SCT_COMPOSITE.get_clear_mask(qa, 'L8')) == [True, False, False, True, False]
+
+
+# test the composite windows and scene selection by sensor dates
+def test_select_window_scenes():
+    windows = SCT_COMPOSITE.get_composite_windows()
+    assert windows[0] == (datetime.date(1986, 9, 1), datetime.date(1988, 1, 1))
+    assert windows[-1] == (datetime.date(2019, 9, 1), datetime.date(2021, 1, 1))
+    scenes = ["LT05_093084_20020105.tif", "LE07_093084_20020601.tif", "LE07_093084_20040101.tif",
+              "LC08_093084_20201231.tif", "LT05_093084_20031231.tif"]
+    assert SCT_COMPOSITE.select_window_scenes(scenes, datetime.date(2001, 9, 1), datetime.date(2003, 1, 1)) == \
+        scenes[:2]
+    assert SCT_COMPOSITE.select_window_scenes(scenes, *windows[-1]) == [scenes[3]]
+    assert os.path.basename(SCT_COMPOSITE.get_composite_path("out", *windows[0])) == \
+        "MDB_P75_1986-09-01_1988-01-01_.tif"
+
+
+# test that the grouped partial selection gives the same percentiles as a full sort
+def test_get_stack_percentile():
+    random_state = np.random.RandomState(5)
+    stack = random_state.randint(0, 10000, size=(9, 500)).astype(np.int16)
+    clear = random_state.rand(9, 500) < 0.6
+    stack[~clear] = SCT_COMPOSITE.composite_masked_value
+    clear_counts = clear.sum(axis=0)
+    for percentile in (0, 50, 75, 100):
+        result = SCT_COMPOSITE.get_stack_percentile(stack, clear_counts, percentile)
+        for pixel in range(500):
+            if clear_counts[pixel]:
+                assert np.isclose(result[pixel], np.percentile(stack[clear[:, pixel], pixel], percentile), rtol=1e-6)
+            else:
+                assert np.isnan(result[pixel])
+
+
+# test a composite of Landsat 5 and 8 scenes that only partly overlap, built in small blocks, against the percentile
+# of the clear observations of each pixel
+def test_composite_scenes():
+    test_folder = tempfile.mkdtemp()
+    try:
+        random_state = np.random.RandomState(7)
+        rows, cols = 23, 19
+        scene_layouts = [("LC08_093084_20180105.tif", 12, (0, 0)), ("LC08_093084_20180121.tif", 12, (3, 2)),
+                         ("LT05_093084_20100101.tif", 7, (0, 4)), ("LT05_093084_20100117.tif", 7, (5, 0))]
+        expected_observations = [[[[] for col in range(cols + 4)] for row in range(rows + 5)] for band in range(6)]
+        scene_paths = []
+        for scene_name, band_count, (row_offset, col_offset) in scene_layouts:
+            sensor = SCT_COMPOSITE.get_scene_sensor(scene_name)
+            scene = random_state.randint(0, 10000, size=(band_count, rows, cols)).astype(np.int16)
+            qa = random_state.choice([66, 66 | 8, 66 | 32, 66 | 128, 66 | 32 | 128], size=(rows, cols))
+            if band_count == 7:
+                band_numbers, qa_band = list(range(6)), 6
+            else:
+                band_numbers, qa_band = list(SCT_COMPOSITE.composite_sensor_bands[sensor]), 10
+            scene[qa_band] = qa
+            scene[band_numbers[2], 0, :5] = SCT_COMPOSITE.surface_reflectance_nodata
+            clear = SCT_COMPOSITE.get_clear_mask(qa, sensor)
+            for band in range(6):
+                band_clear = clear & (scene[band_numbers[band]] != SCT_COMPOSITE.surface_reflectance_nodata)
+                if sensor == 'L5':
+                    band_clear &= (scene[band_numbers] != SCT_COMPOSITE.surface_reflectance_nodata).all(axis=0)
+                for row, col in zip(*np.nonzero(band_clear)):
+                    expected_observations[band][row + row_offset][col + col_offset].append(
+                        scene[band_numbers[band], row, col])
+            scene_paths.append(SCT_TEST_DATA.write_test_geotiff(
+                os.path.join(test_folder, scene_name), scene, origin=(143.0 + col_offset * 0.01,
+                                                                      -34.0 - row_offset * 0.01),
+                pixel_size=0.01, rows_per_strip=4))
+
+        output_path = os.path.join(test_folder, "MDB_P75_test.tif")
+        summary = SCT_COMPOSITE.composite_scenes(scene_paths, output_path, 75, block_memory_bytes=4000)
+        assert (summary['scenes'], summary['lines'], summary['samples']) == (4, rows + 5, cols + 4)
+        with SCT_GEOTIFF.GeoTiffRaster(output_path) as raster:
+            assert raster.dtype == np.float32 and raster.bands == 6
+            assert raster.geotransform == (143.0, 0.01, 0.0, -34.0, 0.0, -0.01)
+            composite = raster.read_rows(0, raster.height)
+        for band in range(6):
+            for row in range(rows + 5):
+                for col in range(cols + 4):
+                    observations = expected_observations[band][row][col]
+                    if observations:
+                        assert np.isclose(composite[band, row, col], np.percentile(observations, 75), rtol=1e-6)
+                    else:
+                        assert np.isnan(composite[band, row, col])
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that scenes stored as compressed strips are composited in blocks of whole strips, so each strip is decoded
+# once, with the same result as uncompressed scenes
+def test_composite_scenes_blocks():
+    test_folder = tempfile.mkdtemp()
+    decode_chunk = SCT_GEOTIFF.GeoTiffRaster._decode_chunk
+    decoded = []
+
+    def counting_decode_chunk(raster, index, *args, **kwargs):
+        decoded.append((raster.path, index))
+        return decode_chunk(raster, index, *args, **kwargs)
+
+    try:
+        random_state = np.random.RandomState(11)
+        compressed_paths = []
+        uncompressed_paths = []
+        os.mkdir(os.path.join(test_folder, "plain"))
+        for scene_name in ("LC08_093084_20180105.tif", "LC08_093084_20180121.tif", "LC08_093084_20180206.tif"):
+            scene = random_state.randint(0, 10000, size=(7, 30, 9)).astype(np.int16)
+            scene[6] = random_state.choice([66, 66 | 8, 66 | 32], size=(30, 9))
+            compressed_paths.append(SCT_TEST_DATA.write_test_geotiff(
+                os.path.join(test_folder, scene_name), scene, pixel_size=0.01, rows_per_strip=4, compress=True))
+            uncompressed_paths.append(SCT_TEST_DATA.write_test_geotiff(
+                os.path.join(test_folder, "plain", scene_name), scene, pixel_size=0.01))
+
+        # a budget of 3 rows, rounded up to whole strips of 4 rows
+        SCT_GEOTIFF.GeoTiffRaster._decode_chunk = counting_decode_chunk
+        SCT_COMPOSITE.composite_scenes(compressed_paths, os.path.join(test_folder, "MDB_P75_strips.tif"),
+                                       block_memory_bytes=3 * 9 * (3 * 6 * 2 * 2 + 6 * 4))
+        SCT_GEOTIFF.GeoTiffRaster._decode_chunk = decode_chunk
+        assert len(decoded) == len(set(decoded)) == 3 * 8
+        SCT_COMPOSITE.composite_scenes(uncompressed_paths, os.path.join(test_folder, "MDB_P75_plain.tif"),
+                                       block_memory_bytes=3 * 9 * (3 * 6 * 2 * 2 + 6 * 4))
+        with SCT_GEOTIFF.GeoTiffRaster(os.path.join(test_folder, "MDB_P75_strips.tif")) as strips:
+            with SCT_GEOTIFF.GeoTiffRaster(os.path.join(test_folder, "MDB_P75_plain.tif")) as plain:
+                assert np.array_equal(strips.read_rows(0, 30), plain.read_rows(0, 30), equal_nan=True)
+    finally:
+        SCT_GEOTIFF.GeoTiffRaster._decode_chunk = decode_chunk
+        shutil.rmtree(test_folder)
+
+
+# test that scenes in neighbouring WGS84 UTM zones are composited together on the EPSG:4326 grid of the converter,
+# that the composite is converted without reprojection and that scenes in other coordinate systems are rejected
+def test_composite_scenes_epsg():
+    test_folder = tempfile.mkdtemp()
+    try:
+        scene_paths = []
+        # scenes of one value each, either side of the zone 54/55 boundary at 144 degrees east and overlapping
+        for scene_name, epsg, lon, value in (("LC08_093084_20180105.tif", 32754, 143.996, 1000),
+                                             ("LC08_093084_20180121.tif", 32755, 143.999, 3000)):
+            scene = np.full((7, 20, 20), value, dtype=np.int16)
+            scene[6] = 66
+            origin = SCT_REPROJECT.geographic_to_projected(epsg, lon, -34.0)
+            scene_paths.append(SCT_TEST_DATA.write_test_geotiff(
+                os.path.join(test_folder, scene_name), scene, origin=(float(origin[0]), float(origin[1])),
+                pixel_size=30.0, nodata=SCT_COMPOSITE.surface_reflectance_nodata, epsg=epsg, rows_per_strip=4,
+                compress=True))
+
+        output_path = os.path.join(test_folder, "MDB_P75_2018-01-01_2019-01-01_.tif")
+        summary = SCT_COMPOSITE.composite_scenes(scene_paths, output_path, 75, block_memory_bytes=64 * 1024)
+        with SCT_GEOTIFF.GeoTiffRaster(output_path) as raster:
+            assert raster.epsg == 4326
+            assert raster.geotransform[1] == SCT_REPROJECT.reproject_pixel_size
+            assert (raster.width, raster.height) == (summary['samples'], summary['lines'])
+            composite = raster.read_rows(0, raster.height)
+        assert set(np.unique(composite[~np.isnan(composite)])) == {1000.0, 2500.0, 3000.0}
+
+        output_folder = os.path.join(test_folder, "output")
+        os.mkdir(output_folder)
+        result = SCT_CONVERT_RASTER_TO_ENVI.process_input_raster(output_path, output_folder)
+        assert result['status'] == 'converted', result['message']
+
+        unsupported_path = SCT_TEST_DATA.write_test_geotiff(
+            os.path.join(test_folder, "LC08_093084_20180206.tif"), np.zeros((7, 6, 5), dtype=np.int16),
+            origin=(1500000.0, 5100000.0), pixel_size=30.0, epsg=2193)
+        try:
+            SCT_COMPOSITE.composite_scenes(scene_paths + [unsupported_path], output_path)
+            assert False, "a scene that can not be reprojected not rejected"
+        except ValueError as err:
+            assert "2193" in str(err)
+    finally:
+        shutil.rmtree(test_folder)
+
+if __name__ == "__main__":
+    test_get_clear_mask()
+    test_select_window_scenes()
+    test_get_stack_percentile()
+    test_composite_scenes()
+    test_composite_scenes_blocks()
+    test_composite_scenes_epsg()
+    print("Everything passed")
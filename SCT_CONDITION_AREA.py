@@ -0,0 +1,276 @@
+# Module to calculate the area of each condition bin for each tree species and BWS region from the Stand Condition
+# Tool condition rasters locally, as done in Earth Engine by Code_to_calculate_area_of_condition
+# Condition (0 to 100) is binned into the same five classes as binCondition, masked by species (MDBVTmap1 values 1, 2
+# and 3 for River Red Gum, Black Box and Coolabah) and the pixel area is summed per BWS region
+# BWS regions are read from a raster of region codes on the same pixel grid as the condition rasters (the regions
+# rasterised once), with a csv file giving the BWS_Region name of each code
+# Pixel areas are worked out for lon/lat pixels, so every raster must be in EPSG:4326
+# Condition rasters are read in blocks of rows, only the forest pixels of a block are binned and the areas are summed
+# with a single bincount over region x species x bin, so the run time follows the number of forest pixels
+
+# Created by MDBA for the Stand Condition Tool
+
+import csv
+import math
+import os
+import sys
+
+import numpy as np
+
+import SCT_GEOTIFF
+import SCT_TILE_INDEX
+
+# condition bin upper limits and codes, as in binCondition: (0, 20] is 102, (20, 40] is 24, (40, 60] is 46,
+# (60, 80] is 68 and (80, 100] is 810, everything else (0, NODATA or over 100) is group 0
+condition_bin_edges = np.array([0, 20, 40, 60, 80, 100])
+condition_bin_codes = (0, 102, 24, 46, 68, 810)
+
+# MDBVTmap1 species codes, in the order the Earth Engine script exports them
+condition_area_species = ((1, 'River Red Gum'), (3, 'Coolabah'), (2, 'Black Box'))
+condition_area_species_count = 3
+
+# WGS84 ellipsoid, for the area of EPSG:4326 pixels
+condition_area_epsg = 4326
+wgs84_semi_major_axis = 6378137.0
+wgs84_flattening = 1 / 298.257223563
+
+# default memory allowed for one block of condition rows and its species, region and working arrays
+condition_area_default_block_memory_bytes = 64 * 1024 * 1024
+
+# rows of a condition raster in one task, so a single large raster is spread over all the workers
+condition_area_task_rows = 4096
+
+# per row pixel area tables, by (top, ydim, xdim, lines) of a raster, and tile indexes by tile paths, kept for the
+# life of each (worker) process
+_pixel_area_tables = {}
+_tile_indexes = {}
+
+
+###############################################################################################################
+# function to get the area in square metres of the pixels of each row of an EPSG:4326 raster
+# inputs are the latitude of the top edge, the pixel height and width in degrees and the number of rows
+# output is an array of one pixel area per row, from the exact area of the WGS84 ellipsoid between the latitudes of
+# the top and bottom of each row
+# the table is cached, so it is only worked out once for each raster grid
+
+def get_pixel_area_table(top, ydim, xdim, lines):
+    table_key = (top, ydim, xdim, lines)
+    if table_key not in _pixel_area_tables:
+        eccentricity_squared = wgs84_flattening * (2 - wgs84_flattening)
+        eccentricity = math.sqrt(eccentricity_squared)
+        sin_latitude = np.sin(np.radians(top - np.arange(lines + 1) * ydim))
+        # area from the equator to each latitude, per radian of longitude
+        zone_area = (wgs84_semi_major_axis ** 2 * (1 - eccentricity_squared) / 2.0 *
+                     (sin_latitude / (1 - eccentricity_squared * sin_latitude ** 2) +
+                      np.log((1 + eccentricity * sin_latitude) / (1 - eccentricity * sin_latitude)) /
+                      (2 * eccentricity)))
+        _pixel_area_tables[table_key] = np.abs(np.diff(zone_area)) * math.radians(xdim)
+    return _pixel_area_tables[table_key]
+
+
+###############################################################################################################
+# function to get the condition bin (0 to 5, the index into condition_bin_codes) of an array of condition values
+# NODATA, NaN, 0 and values over 100 are bin 0
+
+def get_condition_bins(condition, nodata_value=None):
+    bins = np.searchsorted(condition_bin_edges, condition, side='left')
+    bins[bins >= len(condition_bin_codes)] = 0
+    if nodata_value is not None:
+        bins[condition == nodata_value] = 0
+    return bins
+
+
+###############################################################################################################
+# function to sum the pixel area of a block by region, species and condition bin
+# inputs are the condition, species and region code blocks shaped (rows, columns), the condition NODATA value, the
+# sorted array of region codes and the pixel area of each row
+# condition is only read from the forest pixels (species 1, 2 or 3 in a known region), a callable taking the
+# (rows, columns) of those pixels can be passed instead of the condition block so it is only read when needed
+# output is a tuple of the areas shaped (regions, species, bins), species in MDBVTmap1 order (1, 2, 3), and the
+# number of forest pixels summed
+
+def sum_condition_area_block(condition, species, zones, nodata_value, zone_codes, row_areas):
+    areas = np.zeros(len(zone_codes) * condition_area_species_count * len(condition_bin_codes))
+    rows, cols = np.nonzero((species >= 1) & (species <= condition_area_species_count))
+    if rows.size:
+        zone_values = zones[rows, cols]
+        zone_index = np.minimum(np.searchsorted(zone_codes, zone_values), len(zone_codes) - 1)
+        in_zone = zone_codes[zone_index] == zone_values
+        rows, cols, zone_index = rows[in_zone], cols[in_zone], zone_index[in_zone]
+    if rows.size:
+        condition_values = condition(rows, cols) if callable(condition) else condition[rows, cols]
+        group = (zone_index * condition_area_species_count + species[rows, cols].astype(np.int64) - 1) * \
+            len(condition_bin_codes) + get_condition_bins(condition_values, nodata_value)
+        areas += np.bincount(group, weights=row_areas[rows], minlength=areas.size)
+    return areas.reshape(len(zone_codes), condition_area_species_count, len(condition_bin_codes)), rows.size
+
+
+###############################################################################################################
+# function to get the si (Earth Engine system:index) of a condition raster, the file name without its extension
+
+def get_condition_si(condition_raster):
+    return os.path.splitext(os.path.basename(condition_raster))[0]
+
+
+###############################################################################################################
+# function to get an index of species or region tiles, built once per process
+
+def get_tile_index(tile_paths):
+    tile_paths = tuple(tile_paths)
+    if tile_paths not in _tile_indexes:
+        tile_index = SCT_TILE_INDEX.TileIndex()
+        for tile_path in tile_paths:
+            tile_index.add_tile(tile_path)
+        _tile_indexes[tile_paths] = tile_index
+    return _tile_indexes[tile_paths]
+
+
+###############################################################################################################
+# function to check that the condition, species or region rasters are in EPSG:4326
+# input is the path and EPSG code of each raster, bil tiles (EPSG code None) are SCT bil files, which are EPSG:4326
+# raises ValueError for rasters in another coordinate system
+
+def check_condition_area_epsg(rasters):
+    for raster_path, epsg in rasters:
+        if epsg is not None and epsg != condition_area_epsg:
+            raise ValueError("%s is in EPSG %s, condition areas need rasters in EPSG:%d" %
+                             (raster_path, epsg, condition_area_epsg))
+
+
+###############################################################################################################
+# function to read the block of a species or region mosaic on the pixel grid of a condition block
+# pixels outside the mosaic are 0 (no species or region)
+# raises ValueError if the mosaic is not on the same pixel grid as the condition raster
+
+def read_mosaic_block(tile_index, bounds, shape):
+    if not tile_index.find_tiles(bounds):
+        return np.zeros(shape, dtype=np.uint8)
+    block, geotransform = tile_index.read_window(bounds, 0)
+    xdim = (bounds[2] - bounds[0]) / shape[1]
+    if block.shape[1:] != shape or \
+            abs(geotransform[0] - bounds[0]) > xdim * SCT_TILE_INDEX.tile_index_pixel_tolerance:
+        raise ValueError("species and region rasters must be on the pixel grid of the condition rasters")
+    return block[0]
+
+
+###############################################################################################################
+# function to split the condition rasters into tasks of whole blocks of rows
+# inputs are the condition GeoTIFF paths, the species and region raster paths (GeoTIFF or bil tiles), the region
+# codes and the memory budget for one block
+# output is a list of tasks for condition_area_task
+# raises ValueError if any of the rasters is not in EPSG:4326
+
+def get_condition_area_tasks(condition_rasters, species_rasters, zone_rasters, zone_codes,
+                             block_memory_bytes=condition_area_default_block_memory_bytes,
+                             task_rows=condition_area_task_rows):
+    for tile_paths in (species_rasters, zone_rasters):
+        check_condition_area_epsg([(tile['path'], tile['epsg']) for tile in get_tile_index(tile_paths).tiles])
+    tasks = []
+    for condition_raster in condition_rasters:
+        with SCT_GEOTIFF.GeoTiffRaster(condition_raster) as raster:
+            check_condition_area_epsg([(condition_raster, raster.epsg)])
+            height = raster.height
+            # condition, species, region, bins, areas and masks for one row
+            row_bytes = raster.width * (raster.dtype.itemsize + 8 + 8 + 8 + 8 + 2)
+            block_rows = max(1, int(block_memory_bytes // row_bytes))
+            block_rows = max(raster.row_step, block_rows - block_rows % raster.row_step)
+        rows_per_task = max(block_rows, task_rows - task_rows % block_rows)
+        for row_start in range(0, height, rows_per_task):
+            tasks.append((condition_raster, tuple(species_rasters), tuple(zone_rasters), tuple(zone_codes),
+                          row_start, min(rows_per_task, height - row_start), block_rows))
+    return tasks
+
+
+###############################################################################################################
+# function to sum the condition areas of one task, a range of rows of one condition raster
+# output is a tuple of the si, the areas shaped (regions, species, bins) and the number of forest pixels
+
+def condition_area_task(task):
+    condition_raster, species_rasters, zone_rasters, zone_codes, task_row_start, task_row_count, block_rows = task
+    zone_codes = np.array(zone_codes)
+    species_index = get_tile_index(species_rasters)
+    zone_index = get_tile_index(zone_rasters)
+    areas = np.zeros((len(zone_codes), condition_area_species_count, len(condition_bin_codes)))
+    forest_pixels = 0
+    with SCT_GEOTIFF.GeoTiffRaster(condition_raster) as raster:
+        left, xdim, _, top, _, ydim = raster.geotransform
+        ydim = -ydim
+        area_table = get_pixel_area_table(top, ydim, xdim, raster.height)
+        for row_start in range(task_row_start, task_row_start + task_row_count, block_rows):
+            row_count = min(block_rows, task_row_start + task_row_count - row_start)
+            bounds = (left, top - (row_start + row_count) * ydim, left + raster.width * xdim, top - row_start * ydim)
+            species = read_mosaic_block(species_index, bounds, (row_count, raster.width))
+            if not species.any():
+                continue
+            zones = read_mosaic_block(zone_index, bounds, (row_count, raster.width))
+
+            # only read the condition columns that have forest pixels
+            def read_condition(rows, cols):
+                col_start = cols.min()
+                window = raster.read_window(row_start, row_count, col_start, cols.max() + 1 - col_start)
+                return window[0][rows, cols - col_start]
+
+            block_areas, block_forest_pixels = sum_condition_area_block(read_condition, species, zones,
+                                                                        raster.nodata, zone_codes,
+                                                                        area_table[row_start:row_start + row_count])
+            areas += block_areas
+            forest_pixels += block_forest_pixels
+    return get_condition_si(condition_raster), areas, forest_pixels
+
+
+###############################################################################################################
+# function to calculate the condition areas for a list of condition rasters
+# the tasks are run with map_function, which can be the imap_unordered of a multiprocessing Pool to use several cores
+# output is a tuple of a dictionary of areas shaped (regions, species, bins) by si and the number of forest pixels
+
+def calculate_condition_area(condition_rasters, species_rasters, zone_rasters, zone_codes,
+                             block_memory_bytes=condition_area_default_block_memory_bytes, map_function=map):
+    zone_codes = sorted(zone_codes)
+    if not zone_codes:
+        raise ValueError("no BWS region codes given")
+    tasks = get_condition_area_tasks(condition_rasters, species_rasters, zone_rasters, zone_codes,
+                                     block_memory_bytes)
+    areas = {}
+    forest_pixels = 0
+    for si, task_areas, task_forest_pixels in map_function(condition_area_task, tasks):
+        if si in areas:
+            areas[si] += task_areas
+        else:
+            areas[si] = task_areas
+        forest_pixels += task_forest_pixels
+    return areas, forest_pixels
+
+
+###############################################################################################################
+# function to read the BWS region names of the region raster codes
+# input is a csv file with a zone column (the raster code) and a BWS_Region column
+# output is a dictionary of region names by code
+
+def read_zone_names(zone_names_csv):
+    with open(zone_names_csv) as zone_names_file:
+        return dict((int(row['zone']), row['BWS_Region']) for row in csv.DictReader(zone_names_file))
+
+
+###############################################################################################################
+# function to write the condition areas as the wide csv exported by the Earth Engine script
+# one row per species, si and BWS region, with the area in square metres of each condition bin (blank when the
+# region has no pixels in the bin, as in the Earth Engine export)
+# inputs are the csv path, the areas by si, the region codes (in the order of the area arrays) and the region names
+# output is the csv path
+
+def write_condition_area_csv(csv_path, areas, zone_codes, zone_names):
+    bin_fields = ['%d' % bin_code for bin_code in condition_bin_codes]
+    if sys.version_info[0] < 3:
+        csv_file = open(csv_path, 'wb')
+    else:
+        csv_file = open(csv_path, 'w', newline='')
+    with csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['BWS_Region', 'species', 'si'] + bin_fields)
+        for species_code, species_name in condition_area_species:
+            for si in sorted(areas):
+                for zone_number, zone_code in enumerate(sorted(zone_codes)):
+                    bin_areas = areas[si][zone_number, species_code - 1]
+                    writer.writerow([zone_names.get(zone_code, zone_code), species_name, si] +
+                                    [repr(float(area)) if area > 0 else '' for area in bin_areas])
+    return csv_path
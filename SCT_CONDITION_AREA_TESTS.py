@@ -0,0 +1,114 @@
+# Automated test module for the local condition area engine used by the Stand Condition Tool
+# Test data is synthetic and written to a temporary folder, no Earth Engine login is needed
+
+# Required imports
+
+import csv
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_CONDITION_AREA
+import SCT_TEST_DATA
+
+
+# test that condition values are binned as binCondition does, with NODATA in group 0
+def test_get_condition_bins():
+    condition = np.array([0, 1, 20, 21, 40, 41, 60, 61, 80, 81, 100, 101, 255], dtype=np.uint8)
+    bins = SCT_CONDITION_AREA.get_condition_bins(condition, 255)
+    assert [SCT_CONDITION_AREA.condition_bin_codes[bin_index] for bin_index in bins] == \
+        [0, 102, 102, 24, 24, 46, 46, 68, 68, 810, 810, 0, 0]
+    assert list(SCT_CONDITION_AREA.get_condition_bins(np.array([np.nan, 50.5]))) == [0, 3]
+
+
+# test that the per row pixel areas add up to the area of the WGS84 ellipsoid
+def test_get_pixel_area_table():
+    row_areas = SCT_CONDITION_AREA.get_pixel_area_table(90.0, 1.0, 360.0, 180)
+    assert abs(row_areas.sum() / 5.10065621724e14 - 1) < 1e-9
+    assert np.isclose(row_areas[89], row_areas[90]) and row_areas[0] < row_areas[45] < row_areas[89]
+    assert SCT_CONDITION_AREA.get_pixel_area_table(90.0, 1.0, 360.0, 180) is row_areas
+
+
+# test that the areas summed in blocks match a pixel by pixel sum, and the wide csv file
+def test_calculate_condition_area():
+    test_folder = tempfile.mkdtemp()
+    try:
+        random_state = np.random.RandomState(3)
+        rows, cols = 37, 29
+        species = random_state.randint(0, 5, size=(rows, cols)).astype(np.uint8)
+        zones = random_state.choice([0, 4, 9], size=(rows, cols)).astype(np.int16)
+        species_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDBVTmap1.tif"), species,
+                                                        pixel_size=0.01)
+        # the region raster covers only the top rows, the rest of the condition rasters are outside any region
+        zone_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "BWSRegions.tif"), zones[:30],
+                                                     pixel_size=0.01)
+        zones[30:] = 0
+        conditions = {}
+        for year in (2017, 2018):
+            conditions['condition_%d' % year] = random_state.randint(0, 256, size=(rows, cols)).astype(np.uint8)
+        condition_paths = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, si + ".tif"), condition,
+                                                            pixel_size=0.01, nodata=255, rows_per_strip=4)
+                           for si, condition in sorted(conditions.items())]
+
+        areas, forest_pixels = SCT_CONDITION_AREA.calculate_condition_area(condition_paths, [species_path],
+                                                                           [zone_path], [9, 4],
+                                                                           block_memory_bytes=cols * 50 * 8)
+        row_areas = SCT_CONDITION_AREA.get_pixel_area_table(-34.0, 0.01, 0.01, rows)
+        forest = (species >= 1) & (species <= 3) & (zones > 0)
+        assert forest_pixels == 2 * np.count_nonzero(forest)
+        for si, condition in conditions.items():
+            expected = np.zeros((2, 3, 6))
+            for row, col in zip(*np.nonzero(forest)):
+                bin_index = SCT_CONDITION_AREA.get_condition_bins(condition[row:row + 1, col], 255)[0]
+                expected[[4, 9].index(zones[row, col]), species[row, col] - 1, bin_index] += row_areas[row]
+            assert np.allclose(areas[si], expected, rtol=1e-12)
+
+        csv_path = SCT_CONDITION_AREA.write_condition_area_csv(os.path.join(test_folder, "area.csv"), areas, [4, 9],
+                                                               {4: 'Barwon-Darling', 9: 'Murray'})
+        with open(csv_path) as csv_file:
+            csv_rows = list(csv.reader(csv_file))
+        assert csv_rows[0] == ['BWS_Region', 'species', 'si', '0', '102', '24', '46', '68', '810']
+        assert len(csv_rows) == 1 + 3 * 2 * 2
+        assert csv_rows[1][:3] == ['Barwon-Darling', 'River Red Gum', 'condition_2017']
+        assert csv_rows[-1][:3] == ['Murray', 'Black Box', 'condition_2018']
+        assert float(csv_rows[-1][4]) == areas['condition_2018'][1, 1, 1]
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that condition, species and region rasters that are not in EPSG:4326 are rejected
+def test_condition_area_epsg():
+    test_folder = tempfile.mkdtemp()
+    try:
+        values = np.ones((4, 5), dtype=np.uint8)
+        rasters = {}
+        for name in ("condition", "species", "zones"):
+            rasters[name] = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, name + ".tif"), values,
+                                                             pixel_size=0.01)
+            rasters[name + "_utm"] = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, name + "_utm.tif"),
+                                                                      values, origin=(500000.0, 6200000.0),
+                                                                      pixel_size=30.0, epsg=32755)
+        areas, forest_pixels = SCT_CONDITION_AREA.calculate_condition_area([rasters["condition"]],
+                                                                           [rasters["species"]], [rasters["zones"]],
+                                                                           [1])
+        assert forest_pixels == 20
+        for names in (("condition_utm", "species", "zones"), ("condition", "species_utm", "zones"),
+                      ("condition", "species", "zones_utm")):
+            try:
+                SCT_CONDITION_AREA.calculate_condition_area([rasters[names[0]]], [rasters[names[1]]],
+                                                            [rasters[names[2]]], [1])
+                assert False, "raster not in EPSG:4326 not rejected"
+            except ValueError as err:
+                assert "32755" in str(err)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_get_condition_bins()
+    test_get_pixel_area_table()
+    test_calculate_condition_area()
+    test_condition_area_epsg()
+    print("Everything passed")
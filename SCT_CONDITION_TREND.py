@@ -0,0 +1,293 @@
+# Module to reduce the yearly Stand Condition Tool condition rasters (Condition_8bit, one raster per year) to per
+# pixel trend maps locally
+# For every pixel the years with a valid condition (1 to 100, the values binCondition puts in a class) give the
+# least squares trend slope, the year of the lowest condition, the number of years in each binCondition class and the
+# change in mean condition between epochs (eg. before, during and after the Millennium Drought)
+# The years are walked a block of rows at a time and each year of a block is added to running sums as it is read, so
+# memory use is set by the block size and not by the number of years or the size of the rasters
+# Outputs are compact GeoTIFFs: the slope in hundredths of condition per year and the epoch changes as 16 bit
+# integers, the year of the lowest condition as a 16 bit year and the years per class as 8 bit counts
+
+# Created by MDBA for the Stand Condition Tool
+
+import collections
+import os
+import re
+
+import numpy as np
+
+import SCT_CONDITION_AREA
+import SCT_GEOTIFF
+
+# epochs (first year, last year) compared by the change rasters, each epoch is compared with the one before it
+trend_default_epochs = ((1986, 1996), (1997, 2009), (2010, 2020))
+
+# fewest valid years for a trend slope
+trend_default_min_years = 3
+
+# the slope is written in hundredths of condition per year
+trend_slope_scale = 100.0
+
+trend_int16_nodata = -32768
+trend_uint8_nodata = 255
+
+# output file suffixes, after the name of the condition rasters with the year replaced by "trend"
+trend_outputs = ('slope', 'min_year', 'bin_years', 'epoch_change')
+
+# default memory allowed for one block of rows of one year and the running sums of the block
+trend_default_block_memory_bytes = 64 * 1024 * 1024
+
+# rows of a series in one task, so a basin wide series is spread over all the workers
+trend_task_rows = 1024
+
+# a year in a condition raster file name
+trend_year_pattern = re.compile(r'(?<!\d)(19\d\d|20\d\d)(?!\d)')
+
+
+###############################################################################################################
+# function to group the yearly condition rasters into series, the rasters of the same tile for every year
+# the year is taken from the file name, rasters that differ only by the year, in their file name and folder (so
+# yearly folders are allowed), are in the same series
+# output is a dictionary of the list of (year, path) in year order by series name (the file name with the year
+# replaced by "trend", with the name of the folder in front when the same file names are in more than one folder)
+# raises ValueError for a file name with no year, two rasters of one series for the same year or series in folders
+# with the same name
+
+def get_condition_series(condition_rasters):
+    folder_series = {}
+    for condition_raster in condition_rasters:
+        folder, file_name = os.path.split(os.path.abspath(condition_raster))
+        name = os.path.splitext(file_name)[0]
+        year_match = trend_year_pattern.search(name)
+        if year_match is None:
+            raise ValueError("%s has no year in its file name" % condition_raster)
+        series_name = name[:year_match.start()] + "trend" + name[year_match.end():]
+        folder_series.setdefault((trend_year_pattern.sub("trend", folder), series_name), []).append(
+            (int(year_match.group(1)), condition_raster))
+    name_counts = collections.Counter(series_name for _, series_name in folder_series)
+    series = {}
+    for (folder, series_name), yearly_rasters in folder_series.items():
+        if name_counts[series_name] > 1:
+            series_name = os.path.basename(folder) + "_" + series_name
+        if series_name in series:
+            raise ValueError("condition rasters in more than one folder named %s make the series %s, the folders "
+                             "must have different names" % (os.path.basename(folder), series_name))
+        yearly_rasters.sort()
+        years = [year for year, _ in yearly_rasters]
+        if len(set(years)) != len(years):
+            raise ValueError("%s has more than one condition raster for a year" % series_name)
+        series[series_name] = yearly_rasters
+    return series
+
+
+###############################################################################################################
+# function to get the pixel grid shared by the rasters of a series
+# output is a tuple of the geotransform, width and height
+# raises ValueError if the rasters are not on the same grid
+
+def get_series_grid(condition_rasters):
+    grid = None
+    for condition_raster in condition_rasters:
+        with SCT_GEOTIFF.GeoTiffRaster(condition_raster) as raster:
+            raster_grid = (raster.geotransform, raster.width, raster.height)
+        if grid is None:
+            grid = raster_grid
+        elif raster_grid[1:] != grid[1:] or not np.allclose(raster_grid[0], grid[0], rtol=0.0,
+                                                             atol=abs(grid[0][1]) * 1e-6):
+            raise ValueError("%s is not on the pixel grid of %s" % (condition_raster, condition_rasters[0]))
+    return grid
+
+
+###############################################################################################################
+# Class holding the running sums of the years of one block of rows
+# add_year() adds the condition of one year, the output rasters are made from the sums by the get_ functions
+
+class TrendSums(object):
+
+    def __init__(self, shape, epochs=trend_default_epochs):
+        self.epochs = epochs
+        self.count = np.zeros(shape, dtype=np.int16)
+        # years are counted from the first year added, so the sums of squares stay small
+        self.first_year = None
+        self.sum_x = np.zeros(shape)
+        self.sum_y = np.zeros(shape)
+        self.sum_xx = np.zeros(shape)
+        self.sum_xy = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf, dtype=np.float32)
+        self.min_year = np.full(shape, trend_int16_nodata, dtype=np.int16)
+        self.bin_years = np.zeros((len(SCT_CONDITION_AREA.condition_bin_codes) - 1,) + shape, dtype=np.uint8)
+        self.epoch_sum = np.zeros((len(epochs),) + shape)
+        self.epoch_count = np.zeros((len(epochs),) + shape, dtype=np.int16)
+
+    # add the condition block of one year, years must be added in order
+    def add_year(self, year, condition, nodata_value=None):
+        bins = SCT_CONDITION_AREA.get_condition_bins(condition, nodata_value)
+        valid = bins > 0
+        if self.first_year is None:
+            self.first_year = year
+        x = float(year - self.first_year)
+        y = np.where(valid, condition, 0).astype(np.float64)
+        self.count += valid
+        self.sum_x += valid * x
+        self.sum_y += y
+        self.sum_xx += valid * x * x
+        self.sum_xy += y * x
+        lower = valid & (condition < self.minimum)  # the first year of the lowest condition is kept
+        self.minimum[lower] = condition[lower]
+        self.min_year[lower] = year
+        for bin_index in range(1, len(SCT_CONDITION_AREA.condition_bin_codes)):
+            self.bin_years[bin_index - 1] += bins == bin_index
+        for epoch_number, (first_year, last_year) in enumerate(self.epochs):
+            if first_year <= year <= last_year:
+                self.epoch_sum[epoch_number] += y
+                self.epoch_count[epoch_number] += valid
+
+    # least squares slope in hundredths of condition per year, NODATA where there are fewer than min_years
+    def get_slope(self, min_years=trend_default_min_years):
+        count = self.count.astype(np.float64)
+        denominator = count * self.sum_xx - self.sum_x ** 2
+        has_trend = (self.count >= max(2, min_years)) & (denominator > 0)
+        slope = np.full(self.count.shape, trend_int16_nodata, dtype=np.int16)
+        slope[has_trend] = np.clip(np.rint((count * self.sum_xy - self.sum_x * self.sum_y)[has_trend] /
+                                           denominator[has_trend] * trend_slope_scale),
+                                   trend_int16_nodata + 1, np.iinfo(np.int16).max)
+        return slope
+
+    def get_min_year(self):
+        return self.min_year
+
+    # years in each binCondition class, shaped (classes, rows, columns), NODATA where no year is valid
+    def get_bin_years(self):
+        bin_years = self.bin_years.copy()
+        bin_years[:, self.count == 0] = trend_uint8_nodata
+        return bin_years
+
+    # change in mean condition from each epoch to the next, shaped (epochs - 1, rows, columns), NODATA where either
+    # epoch has no valid year
+    def get_epoch_change(self):
+        change = np.full((len(self.epochs) - 1,) + self.count.shape, trend_int16_nodata, dtype=np.int16)
+        for epoch_number in range(1, len(self.epochs)):
+            before_count = self.epoch_count[epoch_number - 1]
+            after_count = self.epoch_count[epoch_number]
+            has_change = (before_count > 0) & (after_count > 0)
+            change[epoch_number - 1][has_change] = np.rint(
+                self.epoch_sum[epoch_number][has_change] / after_count[has_change] -
+                self.epoch_sum[epoch_number - 1][has_change] / before_count[has_change])
+        return change
+
+
+###############################################################################################################
+# function to get the number of rows in a block of a series, from the memory budget
+# the condition of one year as read and as float64, the class of each pixel and its masks, and the running sums
+
+def get_trend_block_rows(width, height, epoch_count, itemsize=1, block_memory_bytes=trend_default_block_memory_bytes):
+    row_bytes = width * (itemsize + 8 + 8 + 4 + 4 * 8 + 4 + 2 + 2 + 5 + epoch_count * 10)
+    return int(max(1, min(height, block_memory_bytes // row_bytes)))
+
+
+###############################################################################################################
+# function to split the series into tasks of whole blocks of rows
+# inputs are the series from get_condition_series, the epochs, the fewest years for a slope and the memory budget
+# output is a list of tasks for condition_trend_task, in series and row order
+
+def get_condition_trend_tasks(series, epochs=trend_default_epochs, min_years=trend_default_min_years,
+                              block_memory_bytes=trend_default_block_memory_bytes, task_rows=trend_task_rows):
+    tasks = []
+    for series_name in sorted(series):
+        years = tuple(year for year, _ in series[series_name])
+        condition_rasters = tuple(condition_raster for _, condition_raster in series[series_name])
+        _, width, height = get_series_grid(condition_rasters)
+        with SCT_GEOTIFF.GeoTiffRaster(condition_rasters[0]) as raster:
+            block_rows = get_trend_block_rows(width, height, len(epochs), raster.dtype.itemsize, block_memory_bytes)
+            block_rows = max(raster.row_step, block_rows - block_rows % raster.row_step)
+        rows_per_task = max(block_rows, task_rows - task_rows % block_rows)
+        for row_start in range(0, height, rows_per_task):
+            tasks.append((series_name, years, condition_rasters, row_start, min(rows_per_task, height - row_start),
+                          block_rows, tuple(epochs), min_years))
+    return tasks
+
+
+###############################################################################################################
+# function to reduce one task, a range of rows of one series
+# output is a tuple of the series name, the first row and a dictionary of the output blocks by output name, each
+# shaped (bands, rows, columns)
+
+def condition_trend_task(task):
+    series_name, years, condition_rasters, task_row_start, task_row_count, block_rows, epochs, min_years = task
+    rasters = [SCT_GEOTIFF.GeoTiffRaster(condition_raster) for condition_raster in condition_rasters]
+    try:
+        width = rasters[0].width
+        outputs = {'slope': np.empty((1, task_row_count, width), dtype=np.int16),
+                   'min_year': np.empty((1, task_row_count, width), dtype=np.int16),
+                   'bin_years': np.empty((len(SCT_CONDITION_AREA.condition_bin_codes) - 1, task_row_count, width),
+                                         dtype=np.uint8),
+                   'epoch_change': np.empty((max(1, len(epochs) - 1), task_row_count, width), dtype=np.int16)}
+        for row_start in range(task_row_start, task_row_start + task_row_count, block_rows):
+            row_count = min(block_rows, task_row_start + task_row_count - row_start)
+            sums = TrendSums((row_count, width), epochs)
+            for year, raster in zip(years, rasters):
+                sums.add_year(year, raster.read_rows(row_start, row_count)[0], raster.nodata)
+            rows = slice(row_start - task_row_start, row_start - task_row_start + row_count)
+            outputs['slope'][0, rows] = sums.get_slope(min_years)
+            outputs['min_year'][0, rows] = sums.get_min_year()
+            outputs['bin_years'][:, rows] = sums.get_bin_years()
+            if len(epochs) > 1:
+                outputs['epoch_change'][:, rows] = sums.get_epoch_change()
+    finally:
+        for raster in rasters:
+            raster.close()
+    if len(epochs) < 2:
+        del outputs['epoch_change']
+    return series_name, task_row_start, outputs
+
+
+###############################################################################################################
+# function to get the path of one output raster of a series
+
+def get_trend_output_path(output_folder, series_name, output_name):
+    return os.path.join(output_folder, "%s_%s.tif" % (series_name, output_name))
+
+
+###############################################################################################################
+# function to reduce the yearly condition rasters to trend rasters
+# inputs are the condition GeoTIFFs (one per year, for one or more tiles), the output folder, the epochs, the fewest
+# years for a slope, the block memory budget, map_function to run the tasks, which must return the results in the
+# order of the tasks (eg. the imap of a multiprocessing Pool to use several cores), and the rows of a task
+# the output blocks are written as they arrive, so only the blocks of the tasks in flight are in memory
+# output is a dictionary by series name of the years and the output paths by output name
+
+def calculate_condition_trends(condition_rasters, output_folder, epochs=trend_default_epochs,
+                               min_years=trend_default_min_years,
+                               block_memory_bytes=trend_default_block_memory_bytes, map_function=map,
+                               task_rows=trend_task_rows):
+    series = get_condition_series(condition_rasters)
+    tasks = get_condition_trend_tasks(series, epochs, min_years, block_memory_bytes, task_rows)
+    summaries = {}
+    writers = {}
+    try:
+        for series_name, row_start, outputs in map_function(condition_trend_task, tasks):
+            if series_name not in summaries:
+                for writer in writers.values():  # the previous series is finished
+                    writer.close()
+                writers = {}
+                geotransform, width, height = get_series_grid([path for _, path in series[series_name]])
+                epsg = SCT_GEOTIFF.read_geotiff_metadata(series[series_name][0][1])['epsg']
+                summaries[series_name] = {'years': [year for year, _ in series[series_name]], 'outputs': {}}
+                for output_name in trend_outputs:
+                    if output_name not in outputs:
+                        continue
+                    output_path = get_trend_output_path(output_folder, series_name, output_name)
+                    block = outputs[output_name]
+                    writers[output_name] = SCT_GEOTIFF.GeoTiffWriter(
+                        output_path, width, height, block.shape[0], block.dtype, geotransform, epsg,
+                        trend_uint8_nodata if block.dtype == np.uint8 else trend_int16_nodata, compress=True)
+                    summaries[series_name]['outputs'][output_name] = output_path
+            for output_name, block in outputs.items():
+                writers[output_name].write_rows(block)
+        for writer in writers.values():
+            writer.close()
+    except BaseException:
+        for writer in writers.values():  # no truncated outputs are left behind
+            writer.abort()
+        raise
+    return summaries
@@ -0,0 +1,219 @@
+# Automated test module for the per pixel condition trend reducer used by the Stand Condition Tool
+# Test data is synthetic and written to a temporary folder
+
+# Required imports
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_CONDITION_TREND
+import SCT_GEOTIFF
+import SCT_TEST_DATA
+
+
+# function to write a synthetic yearly condition series, with NODATA (255) and condition over 100 (not in a class)
+# output is a tuple of the raster paths and the condition of each year shaped (years, rows, columns)
+def write_test_series(test_folder, name, years, rows, cols, seed):
+    random_state = np.random.RandomState(seed)
+    trend = random_state.uniform(-3, 3, size=(rows, cols))
+    condition = np.clip(50 + trend * (np.array(years)[:, np.newaxis, np.newaxis] - years[0]) +
+                        random_state.normal(0, 5, size=(len(years), rows, cols)), 1, 100).astype(np.uint8)
+    condition[random_state.uniform(size=condition.shape) < 0.2] = 255
+    condition[random_state.uniform(size=condition.shape) < 0.05] = 101
+    condition[:, 0, 0] = 255  # never valid
+    condition[:, 0, 1] = [50] + [255] * (len(years) - 1)  # valid in the first year only
+    paths = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, name % year), condition[index], nodata=255,
+                                              rows_per_strip=4)
+             for index, year in enumerate(years)]
+    return paths, condition
+
+
+# function to work out the expected trend outputs pixel by pixel
+def get_expected_trend(years, condition, epochs, min_years):
+    bands, rows, cols = condition.shape
+    slope = np.full((rows, cols), -32768)
+    min_year = np.full((rows, cols), -32768)
+    bin_years = np.full((5, rows, cols), 255)
+    epoch_change = np.full((len(epochs) - 1, rows, cols), -32768)
+    for row in range(rows):
+        for col in range(cols):
+            values = condition[:, row, col]
+            valid = (values > 0) & (values <= 100)
+            if not valid.any():
+                continue
+            valid_years = np.array(years)[valid]
+            valid_values = values[valid].astype(np.float64)
+            if valid.sum() >= min_years:
+                slope[row, col] = np.rint(np.polyfit(valid_years, valid_values, 1)[0] * 100)
+            min_year[row, col] = valid_years[np.argmin(valid_values)]
+            bin_years[:, row, col] = np.bincount(np.ceil(valid_values / 20).astype(int) - 1, minlength=5)
+            for epoch_number in range(1, len(epochs)):
+                means = []
+                for first_year, last_year in epochs[epoch_number - 1:epoch_number + 1]:
+                    in_epoch = (valid_years >= first_year) & (valid_years <= last_year)
+                    means.append(valid_values[in_epoch].mean() if in_epoch.any() else None)
+                if None not in means:
+                    epoch_change[epoch_number - 1, row, col] = np.rint(means[1] - means[0])
+    return slope, min_year, bin_years, epoch_change
+
+
+# test that series are grouped by the file name without the year, and bad names and grids are rejected
+def test_get_condition_series():
+    series = SCT_CONDITION_TREND.get_condition_series(
+        [os.path.join("2001", "Condition_8bit_2001_0"), os.path.join("1999", "Condition_8bit_1999_0.tif"),
+         "Condition_8bit_1999_1.tif"])
+    assert series == {'Condition_8bit_trend_0': [(1999, os.path.join("1999", "Condition_8bit_1999_0.tif")),
+                                                 (2001, os.path.join("2001", "Condition_8bit_2001_0"))],
+                      'Condition_8bit_trend_1': [(1999, "Condition_8bit_1999_1.tif")]}
+    # the same tile names in different folders are different series
+    series = SCT_CONDITION_TREND.get_condition_series([os.path.join("a", "Condition_1999.tif"),
+                                                       os.path.join("b", "Condition_1999.tif"),
+                                                       os.path.join("b", "Condition_2000.tif")])
+    assert series == {'a_Condition_trend': [(1999, os.path.join("a", "Condition_1999.tif"))],
+                      'b_Condition_trend': [(1999, os.path.join("b", "Condition_1999.tif")),
+                                            (2000, os.path.join("b", "Condition_2000.tif"))]}
+    for condition_rasters in (["Condition_8bit_0.tif"], ["Condition_8bit_120199.tif"],
+                              ["a/Condition_1999.tif", "a/Condition_1999.tif"],
+                              [os.path.join("x", "a", "Condition_1999.tif"),
+                               os.path.join("y", "a", "Condition_1999.tif")]):
+        try:
+            SCT_CONDITION_TREND.get_condition_series(condition_rasters)
+            assert False, "bad series not rejected"
+        except ValueError:
+            pass
+
+    test_folder = tempfile.mkdtemp()
+    try:
+        paths = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "Condition_%d.tif" % year),
+                                                  np.ones((4, cols), dtype=np.uint8))
+                 for year, cols in ((2000, 5), (2001, 6))]
+        try:
+            SCT_CONDITION_TREND.calculate_condition_trends(paths, test_folder)
+            assert False, "grid mismatch not rejected"
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that the trend rasters reduced in small blocks match a pixel by pixel calculation, for two tiles
+def test_calculate_condition_trends():
+    test_folder = tempfile.mkdtemp()
+    try:
+        years = list(range(1986, 2021, 2))
+        epochs = ((1986, 1996), (1997, 2009), (2010, 2020))
+        input_rasters = []
+        expected = {}
+        for tile in range(2):
+            paths, condition = write_test_series(test_folder, "Condition_8bit_%%d_%d.tif" % tile, years, 19, 13,
+                                                 tile)
+            input_rasters += paths
+            expected['Condition_8bit_trend_%d' % tile] = get_expected_trend(years, condition, epochs, 3)
+
+        # a block budget of a few rows, so each task is reduced in several blocks
+        summaries = SCT_CONDITION_TREND.calculate_condition_trends(input_rasters[::-1], test_folder, epochs, 3,
+                                                                    block_memory_bytes=13 * 4 * 300)
+        assert sorted(summaries) == sorted(expected)
+        for series_name, (slope, min_year, bin_years, epoch_change) in expected.items():
+            assert summaries[series_name]['years'] == years
+            outputs = summaries[series_name]['outputs']
+            assert sorted(outputs) == sorted(SCT_CONDITION_TREND.trend_outputs)
+            for output_name, expected_values, dtype in (('slope', slope, np.int16), ('min_year', min_year, np.int16),
+                                                        ('bin_years', bin_years, np.uint8),
+                                                        ('epoch_change', epoch_change, np.int16)):
+                with SCT_GEOTIFF.GeoTiffRaster(outputs[output_name]) as raster:
+                    assert raster.dtype == dtype and raster.epsg == 4326
+                    assert raster.nodata == (255 if dtype == np.uint8 else -32768)
+                    values = raster.read_rows(0, raster.height)
+                assert np.array_equal(values.reshape(expected_values.shape), expected_values), output_name
+            assert slope[0, 0] == slope[0, 1] == -32768 and min_year[0, 1] == 1986 and bin_years[:, 0, 0].max() == 255
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that tiles with the same file names in two folders are reduced as two series, written under the folder names
+def test_condition_trends_folders():
+    test_folder = tempfile.mkdtemp()
+    try:
+        years = list(range(2000, 2008))
+        epochs = ((2000, 2003), (2004, 2007))
+        input_rasters = []
+        expected = {}
+        for seed, folder in enumerate(("north", "south")):
+            os.mkdir(os.path.join(test_folder, folder))
+            paths, condition = write_test_series(os.path.join(test_folder, folder), "Condition_8bit_%d.tif", years,
+                                                 7, 6, seed)
+            input_rasters += paths
+            expected[folder + '_Condition_8bit_trend'] = get_expected_trend(years, condition, epochs, 3)
+        output_folder = os.path.join(test_folder, "trends")
+        os.mkdir(output_folder)
+        summaries = SCT_CONDITION_TREND.calculate_condition_trends(input_rasters, output_folder, epochs, 3)
+        assert sorted(summaries) == sorted(expected)
+        for series_name, expected_outputs in expected.items():
+            assert summaries[series_name]['years'] == years
+            for output_name, expected_values in zip(('slope', 'min_year', 'bin_years', 'epoch_change'),
+                                                    expected_outputs):
+                output_path = summaries[series_name]['outputs'][output_name]
+                assert os.path.basename(output_path).startswith(series_name)
+                with SCT_GEOTIFF.GeoTiffRaster(output_path) as raster:
+                    values = raster.read_rows(0, raster.height)
+                assert np.array_equal(values.reshape(expected_values.shape), expected_values), output_name
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that the tasks of a series run by a pool of worker processes give the same rasters as one process
+def test_condition_trends_pool():
+    test_folder = tempfile.mkdtemp()
+    try:
+        years = list(range(2000, 2010))
+        input_rasters, _ = write_test_series(test_folder, "Condition_8bit_%d.tif", years, 40, 9, 5)
+        serial_folder = os.path.join(test_folder, "serial")
+        pool_folder = os.path.join(test_folder, "pool")
+        os.mkdir(serial_folder)
+        os.mkdir(pool_folder)
+        epochs = ((2000, 2004), (2005, 2009))
+        serial = SCT_CONDITION_TREND.calculate_condition_trends(input_rasters, serial_folder, epochs, 4)
+        pool = multiprocessing.Pool(2)
+        try:
+            pooled = SCT_CONDITION_TREND.calculate_condition_trends(input_rasters, pool_folder, epochs, 4,
+                                                                     block_memory_bytes=9 * 200,
+                                                                     map_function=pool.imap, task_rows=8)
+        finally:
+            pool.close()
+            pool.join()
+        for output_name, serial_path in serial['Condition_8bit_trend']['outputs'].items():
+            with SCT_GEOTIFF.GeoTiffRaster(serial_path) as serial_raster:
+                with SCT_GEOTIFF.GeoTiffRaster(pooled['Condition_8bit_trend']['outputs'][output_name]) as raster:
+                    assert np.array_equal(raster.read_rows(0, raster.height),
+                                          serial_raster.read_rows(0, serial_raster.height))
+
+        # a task that fails part way through the series leaves no truncated outputs
+        def fail_after_first_task(function, tasks):
+            yield function(tasks[0])
+            raise RuntimeError("worker stopped")
+
+        failed_folder = os.path.join(test_folder, "failed")
+        os.mkdir(failed_folder)
+        try:
+            SCT_CONDITION_TREND.calculate_condition_trends(input_rasters, failed_folder, epochs, 4,
+                                                           block_memory_bytes=9 * 200,
+                                                           map_function=fail_after_first_task, task_rows=8)
+            assert False, "task error not raised"
+        except RuntimeError:
+            pass
+        assert os.listdir(failed_folder) == []
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_get_condition_series()
+    test_calculate_condition_trends()
+    test_condition_trends_folders()
+    test_condition_trends_pool()
+    print("Everything passed")
@@ -5,15 +5,36 @@
 
 # Created by MDBA, S Sunderland, G Hunt, 23/05/19
 
-# Requires ESRI ArcMap 10.x Arcpy and python 2.7
+# Requires ESRI ArcMap 10.x Arcpy and python 2.7 for the arcpy converter
+# The numpy converter (SCT_BIL_CONVERTER) only requires numpy
 
 
-import arcpy
+try:
+    import arcpy
+except ImportError:  # arcpy is optional when using the numpy converter
+    arcpy = None
 import collections
+import csv
+import multiprocessing
 import sys
+import time
 import traceback
 import os
 
+import SCT_BAND_STATISTICS
+import SCT_BIL_CONVERTER
+import SCT_COMPOSITE
+import SCT_CONDITION_AREA
+import SCT_CONDITION_TREND
+import SCT_ENVI_HEADER
+import SCT_GEOTIFF
+import SCT_INSTRUMENTATION
+import SCT_OVERVIEWS
+import SCT_REPROJECT
+import SCT_TILE_CACHE
+import SCT_TILE_INDEX
+import SCT_WORK_QUEUE
+
 ###############################################################################################################
 # function to get module inputs, either from manual (ide or command line) input or from an ESRI python script
 #  tool interface
@@ -93,37 +114,7 @@ def create_envi_header_template(input_bil_raster):
     # Band 5,
     # Band 6}
 
-    # Constant strings used for the output ENVI header for spatial coordinate system EPSG 4326
-    mapinfostringlist = ['{Geographic Lat/Lon, 1, 1,', '143', '-34', '0.00025', '0.00025', 'WGS-84}']
-    coordinatesystemstring = 'coordinate system string = {GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",' \
-                             'SPHEROID["WGS_1984",6378137,298.257223563]],PRIMEM["Greenwich",0],' \
-                             'UNIT["Degree",0.017453292519943295]]}'
-
-    # ENVI header key list
-    envi_hdr_dict_keys = [('ENVI', 'ENVI'),
-                          ('description', ''),
-                          ('samples', ''),
-                          ('lines', ''),
-                          ('bands', 'bands   = 6'),
-                          ('header offset', 'header offset = 0'),
-                          ('file type', 'file type = ENVI Standard'),
-                          ('data type', 'data type = 2'),
-                          ('interleave', 'interleave = bil'),
-                          ('byte order', "byte order = 0"),
-                          ('map info', ''),
-                          ('coordinate system string', coordinatesystemstring),
-                          ('band names', 'band names = {'),
-                          ('Band 1', 'Band 1,'),
-                          ('Band 2', 'Band 2,'),
-                          ('Band 3', 'Band 3,'),
-                          ('Band 4', 'Band 4,'),
-                          ('Band 5', 'Band 5,'),
-                          ('Band 6', 'Band 6}')]
-
-    envi_hdr_dict = collections.OrderedDict(envi_hdr_dict_keys)
-
-    for akey in envi_hdr_dict.keys():
-        printmsg(akey, envi_hdr_dict[akey])
+    # The ENVI header lines (for spatial coordinate system EPSG 4326) are built by SCT_ENVI_HEADER
 
     try:
         # derive esri header file path from bil filename
@@ -132,71 +123,18 @@ def create_envi_header_template(input_bil_raster):
         newesrihdrpath = os.path.join(bil_fn_parts[0], bil_base_fn + ".hdr")
 
         printmsg("processing esri header file", newesrihdrpath)
-        if os.path.exists(
-                newesrihdrpath):  # if header file exists open for reading as text file and populate a
-            # dictionary with the key values
-
-            newesrihdrdict = collections.OrderedDict()  # new empty dictionary for ESRI value
-            with open(newesrihdrpath) as ESRIHeaderfile:
-                for textline in ESRIHeaderfile:
-                    linelist = textline.split(" ")  # split current line by spaces, first element is the key(ie ULXMAP)
-                    valuelist = []
-                    for valstring in linelist:  # remove all the empty values form the input string
-                        if not valstring == "":
-                            valuelist.append(valstring)
-
-                    # vallist will have the key and value as elements 0 and 1"
-                    # printmsg(valuelist)
-                    try:
-                        newesrihdrdict.update([(valuelist[0], valuelist[
-                            1].rstrip())])  # add the key value and the data value with \n stripped
-                    except Exception as err:
-                        printerrormsg("read ESRI header file error", str(err.args[0]),
-                                      str(traceback.format_exc()))  # error with keys
-
-            ESRIHeaderfile.close()  # close the header file
-            # display ESRI values from header
-
-            printmsg("ESRI values dictionary:")
-            for keys in newesrihdrdict.keys():
-                printmsg(keys, newesrihdrdict[keys])
-
-            envi_hdr_dict['samples'] = "samples = " + str(newesrihdrdict['NCOLS'])
-            envi_hdr_dict['lines'] = "lines = " + str(newesrihdrdict['NROWS'])
-
-            # assign esri header values to build  mapinfostring part of header
-            mapinfostringlist[1] = str(newesrihdrdict['ULXMAP'])
-            mapinfostringlist[2] = str(newesrihdrdict['ULYMAP'])
-            mapinfostringlist[3] = str(newesrihdrdict['XDIM'])
-            mapinfostringlist[4] = str(newesrihdrdict['YDIM'])
-
-            mapinfostr = "map info = {" + mapinfostringlist[0] + mapinfostringlist[1] + "," + mapinfostringlist[2] + \
-                         "," + mapinfostringlist[3] + "," + mapinfostringlist[4] + "," + mapinfostringlist[5] + "}"
-
-            envi_hdr_dict['map info'] = mapinfostr
-            envi_hdr_dict['description'] = 'description = {' + str(input_bil_raster) + "}"
-            printmsg("Writing new ENVI format header file")
-            # write out the new header
-            try:
+        if os.path.exists(newesrihdrpath):  # if header file exists read the key values into a dictionary
+            newesrihdrdict = SCT_ENVI_HEADER.read_esri_header(newesrihdrpath)
 
-                try:
-                    #  rename the old esri header
-                    renamednewesrihdrpath = newesrihdrpath + "old"
-                    os.rename(newesrihdrpath, renamednewesrihdrpath)
-                except Exception as err:
-                    printerrormsg("rename old ENVI header file error", str(err.args[0]),
-                                  str(traceback.format_exc()))
-                if not os.path.exists(newesrihdrpath):  # old header file renamed succesfully
-                    newenvihdrpath = newesrihdrpath  # write out new header with original name
-                    with open(newenvihdrpath, 'w') as newhdrfile:
-                        for akey in envi_hdr_dict.keys():
-                            newhdrfile.write(envi_hdr_dict[akey] + '\n')
-                    newhdrfile.close()
-                else:
-                    printerrormsg("Unable to delete old header file", newesrihdrpath)
-            except Exception as err:
-                printerrormsg("write ENVI header file error", str(err.args[0]),
-                              str(traceback.format_exc()))  # error with keys
+            if stand_condition_tool_verbose:  # display ESRI values from header
+                printmsg("ESRI values dictionary:")
+                for keys in newesrihdrdict.keys():
+                    printmsg(keys, newesrihdrdict[keys])
+
+            printmsg("Writing new ENVI format header file")
+            # the ESRI values are held in memory so the new header is written straight over the old one,
+            # without renaming it to .hdrold first
+            SCT_ENVI_HEADER.write_envi_header(input_bil_raster, SCT_ENVI_HEADER.esri_header_metadata(newesrihdrdict))
             printmsg("New ENVI Header file succesfully created for ", input_bil_raster)
             return True  # on success return true
 
@@ -210,9 +148,18 @@ def create_envi_header_template(input_bil_raster):
 # inputs are a file name to a valid raster file
 # (6 band floating point tif, with spatial reference EPSG: 4326
 # output is a 16 bit signed integer bil file
+# uses the numpy converter or arcpy CopyRaster depending on stand_condition_tool_conversion_backend, inputs that are
+# not GeoTIFFs (eg. .img or grids) are always converted by CopyRaster as the numpy converter only reads GeoTIFFs
+# returns the numpy conversion metadata or True for CopyRaster on success, False on error
 
 
 def convert_rasterinput_to_esri_bil(input_raster, output_raster):  # module to take input file and output to tif
+    if stand_condition_tool_conversion_backend == "numpy" and SCT_GEOTIFF.is_geotiff_path(input_raster):
+        return convert_rasterinput_to_esri_bil_numpy(input_raster, output_raster)
+    if arcpy is None:
+        printerrormsg("convert raster function error", input_raster,
+                      "is not a GeoTIFF, arcpy is needed to convert it")
+        return False
     # Set arcpy overwrite environment variable
     arcpy.env.overwriteOutput = True
     try:
@@ -220,7 +167,10 @@ def convert_rasterinput_to_esri_bil(input_raster, output_raster):  # module to t
         # generate statistics and pyramids for the raster
         # on export for easy inspection
         arcpy.env.rasterStatistics = 'STATISTICS 10 10'
-        arcpy.env.pyramid = "PYRAMIDS -1 NEAREST DEFAULT NO_SKIP"
+        if stand_condition_tool_overviews == "inline":
+            arcpy.env.pyramid = "PYRAMIDS -1 NEAREST DEFAULT NO_SKIP"
+        else:  # no pyramids, or native overviews built later as a separate stage
+            arcpy.env.pyramid = "NONE"
         arcpy.env.compression = "LZ77"
         # set the ouput pixel type to 16 bit signed as required by the SCT
         outputpixeltype = "16_BIT_SIGNED"
@@ -244,6 +194,91 @@ def convert_rasterinput_to_esri_bil(input_raster, output_raster):  # module to t
     return False  # on error return false
 
 
+###################################################################################################################
+# function to convert from an input GeoTIFF to ESRI bil format without arcpy
+# the input is streamed in blocks of rows so memory use is bounded by stand_condition_tool_block_memory_bytes
+# no matter how big the tile is
+# output is a 16 bit signed integer bil file (no header, see create_envi_header) and, if
+# stand_condition_tool_write_statistics is set, a .stats.json file of band statistics
+# if stand_condition_tool_skip_empty is set, nothing is written for inputs that are all NODATA
+# returns the conversion metadata dictionary (size, upper left pixel position and pixel counts, empty set for inputs
+# that are all NODATA) or False on error
+
+
+def convert_rasterinput_to_esri_bil_numpy(input_raster, output_raster):
+    try:
+        printmsg("Saving", input_raster, " to ", output_raster, "with the numpy converter")
+        overview_folder = None
+        if stand_condition_tool_overviews == "inline":  # overviews built from the blocks as they are written
+            overview_folder = get_overview_folder(output_raster)
+        conversion = SCT_BIL_CONVERTER.convert_geotiff_to_bil(input_raster, output_raster,
+                                                              stand_condition_tool_block_memory_bytes,
+                                                              stand_condition_tool_write_statistics,
+                                                              overview_folder,
+                                                              stand_condition_tool_overview_resampling,
+                                                              stand_condition_tool_reproject,
+                                                              stand_condition_tool_pipeline_depth,
+                                                              stand_condition_tool_skip_empty)
+        if conversion.get('empty'):
+            printmsg(input_raster, "is all NODATA, no bil file written")
+            return conversion
+        if conversion['empty_blocks'] > 0:
+            printmsg(conversion['empty_blocks'], "of", conversion['block_count'], "blocks of", input_raster,
+                     "were all NODATA and written without converting them")
+        if 'reprojected_from' in conversion:
+            printmsg(input_raster, "reprojected from EPSG", conversion['reprojected_from'], "to EPSG",
+                     stand_condition_tool_data_spatial_reference_code)
+        if conversion['saturated_count'] > 0:
+            printwarningmsg(conversion['saturated_count'], "values in", input_raster,
+                            "were outside the 16 bit range and have been clamped")
+        if 'statistics' in conversion:  # statistics built in the same pass, no second read of the output
+            SCT_BAND_STATISTICS.write_statistics_file(output_raster, conversion.pop('statistics'))
+        return conversion  # on success return the conversion metadata
+
+    except Exception as err:
+        printerrormsg("convert raster function error", str(err.args[0]), str(traceback.format_exc()))
+    return False  # on error return false
+
+
+###################################################################################################################
+# function to create the ENVI header for a converted bil file
+# inputs are the bil file and the value returned by convert_rasterinput_to_esri_bil
+# the numpy converter returns its metadata, so the header is written directly from the values in memory,
+# CopyRaster writes an ESRI header which is converted by create_envi_header_template
+# output is True on success, False on error
+
+
+def create_envi_header(output_bil_raster, conversion):
+    if not isinstance(conversion, dict):
+        return create_envi_header_template(output_bil_raster)
+    try:
+        SCT_ENVI_HEADER.write_envi_header(output_bil_raster, conversion)
+        printmsg("New ENVI Header file succesfully created for ", output_bil_raster)
+        return True  # on success return true
+    except Exception as err:
+        printerrormsg("write ENVI header file error", str(err.args[0]), str(traceback.format_exc()))
+    return False  # on error return false
+
+
+###################################################################################################################
+# function to regenerate the ENVI headers for all the bil files in a folder in one pass, from their existing ESRI or
+# ENVI headers, without the .hdrold rename round trip (leftover .hdrold files are removed)
+# output is True if every header was written
+
+
+def reheader_bil_folder(bil_folder):
+    try:
+        printmsg("Regenerating ENVI headers for bil files in", bil_folder)
+        written_headers, failures = SCT_ENVI_HEADER.reheader_bil_folder(bil_folder)
+        for bil_path, message in failures:
+            printerrormsg("ENVI header for", bil_path, "could not be created:", message)
+        printmsg(len(written_headers), "ENVI headers written,", len(failures), "failed")
+        return not failures
+    except Exception as err:
+        printerrormsg("reheader folder error", str(err.args[0]), str(traceback.format_exc()))
+    return False
+
+
 ###################################################################################################################
 # Function to get the spatial reference code for the input dataset
 # input is a raster dataset
@@ -273,6 +308,38 @@ def read_raster_bands(input_raster):
     except Exception as err:
         printerrormsg("get raster bands function error", str(err.args[0]), str(traceback.format_exc()))
     return bands
+
+#######################################################################################################################
+# Function to describe an input raster, GeoTIFFs are described by reading their tags with SCT_GEOTIFF (no arcpy),
+# other rasters with a single arcpy Describe call
+#
+# inputs are a raster filename
+# output is a dictionary of the band count, spatial reference epsg code (None if it canot be read) and the
+# number of samples (columns) and lines (rows), as stored in the tile cache
+
+
+def describe_input_raster(input_raster):
+    description = {'bands': 0, 'epsg': None, 'samples': None, 'lines': None}
+    if stand_condition_tool_native_describe and SCT_GEOTIFF.is_geotiff_path(input_raster):
+        try:
+            geotiff_metadata = SCT_GEOTIFF.read_geotiff_metadata(input_raster)
+            for key in description.keys():
+                description[key] = geotiff_metadata[key]
+            return description
+        except Exception as err:
+            if arcpy is None:
+                printerrormsg("describe input raster function error", str(err.args[0]), str(traceback.format_exc()))
+                return description
+            printwarningmsg("GeoTIFF tags could not be read, using arcpy Describe", input_raster, str(err.args[0]))
+    try:
+        describe_object = arcpy.Describe(input_raster)
+        description['bands'] = len(describe_object.children)
+        description['epsg'] = describe_object.spatialReference.factoryCode
+        description['samples'] = getattr(describe_object, 'width', None)
+        description['lines'] = getattr(describe_object, 'height', None)
+    except Exception as err:
+        printerrormsg("describe input raster function error", str(err.args[0]), str(traceback.format_exc()))
+    return description
 # -----------------------------------------------------------------------------------------------------------------------
 # Generic helper message output functions, so that output works in ESRI script or esri tool modes
 
@@ -297,13 +364,14 @@ def checktext(*arg):
 def printmsg(*arg):
     try:
         message = checktext(arg)  # pass string(s) to checktext for formatting
-        if len(sys.argv) > 1:  # running in esri tool so use arcpy messaging functions
+        if len(sys.argv) > 1 and arcpy is not None:  # running in esri tool so use arcpy messaging functions
             arcpy.AddMessage(str(message))
         else:  # in script mode so ues python print
             print(str(message))
     except Exception as err:
         print("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
-        arcpy.AddError("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
+        if arcpy is not None:
+            arcpy.AddError("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
 
 # function to output an error  message, using print or arcpy.AddError
 
@@ -312,13 +380,14 @@ def printerrormsg(*arg):
 
     try:
         message = checktext(arg)  # pass string(s) to checktext for formatting
-        if len(sys.argv) > 1:  # running in esri tool so use arcpy error messaging functions
+        if len(sys.argv) > 1 and arcpy is not None:  # running in esri tool so use arcpy error messaging functions
             arcpy.AddError(str(message))
         else:
             print("Error:" + str(message))
     except Exception as err:
         print("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
-        arcpy.AddError("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
+        if arcpy is not None:
+            arcpy.AddError("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
 
 # function to output a warning  message, using print or arcpy.AddError
 
@@ -326,14 +395,681 @@ def printerrormsg(*arg):
 def printwarningmsg(*arg):
     try:
         message = checktext(arg)
-        if len(sys.argv) > 1:  # running in esri tool so use arcpy warning messaging functions
+        if len(sys.argv) > 1 and arcpy is not None:  # running in esri tool so use arcpy warning messaging functions
             arcpy.AddWarning(str(message))
         else:
             print("Warning:" + str(message))
     except Exception as err:
         print("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
-        arcpy.AddError("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
+        if arcpy is not None:
+            arcpy.AddError("print output function error" + str(err.args[0]) + str(traceback.format_exc()))
+
+
+######################################################################################################################
+# Function to build the output bil file name and path for an input raster
+
 
+def get_output_raster_path(input_raster, output_raster_folder):
+    return os.path.join(output_raster_folder, os.path.splitext(os.path.split(input_raster)[1])[0] + ".BIL")
+
+######################################################################################################################
+# Function to check that the band count and projection of an input raster are correct for use by the sct tool
+# inputs are the input raster path, its description (see describe_input_raster) and the result dictionary, which has
+# its message set when the check fails
+# output is True if the raster can be converted, rasters in another projection that can_reproject() are accepted
+
+
+def check_input_description(input_raster, description, result):
+    # check number of bands is correct
+    printmsg("raster bands count", description['bands'])
+    if description['bands'] != stand_condition_tool_raster_bands_count:
+        printwarningmsg("input raster ", input_raster, " has ", description['bands'], "bands",
+                        stand_condition_tool_raster_bands_count, "Landsat 7/8 bands required")
+        result['message'] = "%d bands, %d required" % (description['bands'], stand_condition_tool_raster_bands_count)
+        return False
+    # check that the projection of the input raster is correct for use by the sct tool
+    factory_code = description['epsg']
+    printmsg("factory code", factory_code)
+    if factory_code != stand_condition_tool_data_spatial_reference_code and can_reproject(input_raster, factory_code):
+        printmsg("input raster", input_raster, "will be reprojected from EPSG", factory_code, "to EPSG",
+                 stand_condition_tool_data_spatial_reference_code)
+    elif factory_code != stand_condition_tool_data_spatial_reference_code:
+        printwarningmsg("input raster ", input_raster, " has spatial reference EPSG code", factory_code,
+                        stand_condition_tool_data_spatial_reference_code, "projection required")
+        result['message'] = "EPSG %s, %d required" % (factory_code, stand_condition_tool_data_spatial_reference_code)
+        return False
+    return True
+
+######################################################################################################################
+# Function to check if an input raster that is not in the SCT projection can be reprojected while it is converted,
+# GeoTIFFs in the supported GDA94/GDA2020 and WGS84 UTM coordinate systems (see SCT_REPROJECT) with the numpy converter
+
+
+def can_reproject(input_raster, factory_code):
+    return stand_condition_tool_reproject and stand_condition_tool_conversion_backend == "numpy" and \
+        SCT_GEOTIFF.is_geotiff_path(input_raster) and SCT_REPROJECT.is_supported_epsg(factory_code)
+
+######################################################################################################################
+# Function to run the pre-flight validation (band check, EPSG check) over a list of input rasters without
+# converting them
+# output is a list of result dictionaries with a status of valid or skipped
+
+
+def validate_input_rasters(inputfilelist, output_raster_folder):
+    results = []
+    for input_raster in inputfilelist:
+        start_time = time.time()
+        result = {'input_raster': input_raster,
+                  'output_raster': get_output_raster_path(input_raster, output_raster_folder),
+                  'status': 'skipped', 'message': '', 'seconds': 0.0, 'stages': {}}
+        with SCT_INSTRUMENTATION.span('describe', input_raster, result['stages']):
+            description = describe_input_raster(input_raster)
+        with SCT_INSTRUMENTATION.span('validate', input_raster, result['stages']):
+            if check_input_description(input_raster, description, result):
+                result['status'] = 'valid'
+        result['seconds'] = time.time() - start_time
+        SCT_INSTRUMENTATION.record_file(result)
+        results.append(result)
+    return results
+
+######################################################################################################################
+# Function to expand any folders in the input list into the GeoTIFF files they contain
+# output is the list of input rasters
+
+
+def expand_input_folders(inputfilelist):
+    expanded_list = []
+    for input_raster in inputfilelist:
+        if os.path.isdir(input_raster):
+            expanded_list += [os.path.join(input_raster, filename) for filename in sorted(os.listdir(input_raster))
+                              if SCT_GEOTIFF.is_geotiff_path(filename)]
+        else:
+            expanded_list.append(input_raster)
+    return expanded_list
+
+######################################################################################################################
+# Function to run the conversion pipeline (band check, EPSG check, conversion, header) for one input raster
+# inputs are the input raster path, the output folder and optionally the description of the input raster from the
+# tile cache (see describe_input_raster), the raster is described if no description is given
+# output is a result dictionary with the input and output paths, a status of converted, skipped, empty (all NODATA, no
+# bil file written) or failed, a message, the input raster description, the time taken in seconds, the seconds taken
+# by each stage (describe, validate, convert and header) and, for the numpy converter, the bytes read and written, the
+# seconds spent reading the input and writing the output and the number of blocks and of all NODATA blocks
+# module level so it can be run in a multiprocessing worker
+
+
+def process_input_raster(input_raster, output_raster_folder, description=None):
+    start_time = time.time()
+    output_raster = get_output_raster_path(input_raster, output_raster_folder)
+    result = {'input_raster': input_raster, 'output_raster': output_raster, 'status': 'failed', 'message': '',
+              'description': description, 'seconds': 0.0, 'stages': {}}
+    stages = result['stages']
+    try:
+        printmsg(type(input_raster), input_raster)
+        if description is None:
+            with SCT_INSTRUMENTATION.span('describe', input_raster, stages):
+                description = describe_input_raster(input_raster)
+            if description['bands']:  # only keep successful descriptions for the tile cache
+                result['description'] = description
+
+        with SCT_INSTRUMENTATION.span('validate', input_raster, stages):
+            valid = check_input_description(input_raster, description, result)
+        if not valid:
+            result['status'] = 'skipped'
+            return result
+
+        printmsg("Converting raster", input_raster, " into an SCT format bil file", output_raster)
+
+        with SCT_INSTRUMENTATION.span('convert', input_raster, stages):
+            conversion = convert_rasterinput_to_esri_bil(input_raster, output_raster)
+        if not conversion:  # if error on convert then skip to next raster
+            printerrormsg("input raster ", input_raster, "could not be converted")
+            result['message'] = "raster could not be converted"
+            return result
+        if isinstance(conversion, dict):  # the numpy converter counts its bytes, input/output time and empty blocks
+            for counter in ('bytes_read', 'bytes_written', 'read_seconds', 'write_seconds', 'block_count',
+                            'empty_blocks'):
+                result[counter] = conversion[counter]
+            if conversion.get('empty'):
+                result['status'] = 'empty'
+                result['message'] = "all NODATA, not converted"
+                return result
+        with SCT_INSTRUMENTATION.span('header', output_raster, stages):
+            header_written = create_envi_header(output_raster, conversion)
+        if not header_written:
+            printerrormsg("ENVI header for", output_raster, "could not be created")
+            result['message'] = "ENVI header could not be created"
+            return result
+        result['status'] = 'converted'
+
+    except Exception as err:
+        printerrormsg("process input raster error", input_raster, str(err.args[0]), str(traceback.format_exc()))
+        result['message'] = str(err.args[0])
+    finally:
+        result['seconds'] = time.time() - start_time
+    return result
+
+
+# multiprocessing worker wrapper, Pool.imap passes a single (input_raster, output_raster_folder, description) tuple
+# workers are profiled into their own stats file when stand_condition_tool_profiler is "cprofile"
+
+
+def process_input_raster_task(task):
+    with profile_worker(task[1]):
+        return process_input_raster(*task)
+
+
+def profile_worker(output_raster_folder):
+    return SCT_INSTRUMENTATION.profile_worker(get_run_report_path(output_raster_folder),
+                                              stand_condition_tool_profiler if stand_condition_tool_write_run_report
+                                              else None)
+
+######################################################################################################################
+# Function to work out how many worker processes to use for a batch
+# inputs are the number of input files
+# output is the requested worker count, limited by the number of cpus, the number of files and the batch memory
+# budget (each worker holds at most the peak block memory of one conversion, see get_worker_memory_bytes)
+
+
+def get_batch_worker_count(file_count):
+    worker_count = min(stand_condition_tool_worker_count, multiprocessing.cpu_count(), file_count)
+    memory_worker_count = stand_condition_tool_batch_memory_bytes // get_worker_memory_bytes()
+    return int(max(1, min(worker_count, memory_worker_count)))
+
+
+# peak block memory of one worker, the pipeline buffers, scanned first block and reprojected source window of the
+# numpy converter with the current settings, or one block for the arcpy converter
+
+
+def get_worker_memory_bytes():
+    if stand_condition_tool_conversion_backend != "numpy":
+        return stand_condition_tool_block_memory_bytes
+    return SCT_BIL_CONVERTER.get_peak_memory_bytes(stand_condition_tool_block_memory_bytes,
+                                                   stand_condition_tool_pipeline_depth,
+                                                   stand_condition_tool_skip_empty, stand_condition_tool_reproject)
+
+######################################################################################################################
+# Function to open the tile metadata cache for a batch
+# input is the output folder, the cache database is kept there so reruns into the same folder can use it
+# output is an SCT_TILE_CACHE.TileMetadataCache, or None if the cache is switched off or can not be opened
+
+
+def open_tile_cache(output_raster_folder):
+    if not stand_condition_tool_use_tile_cache:
+        return None
+    try:
+        return SCT_TILE_CACHE.TileMetadataCache(os.path.join(output_raster_folder,
+                                                             stand_condition_tool_tile_cache_filename))
+    except Exception as err:
+        printwarningmsg("tile cache could not be opened, all files will be converted", str(err.args[0]))
+    return None
+
+######################################################################################################################
+# Function to run the conversion pipeline over a list of input rasters, in parallel when more than one worker is
+# allowed
+# inputs rasters that are unchanged since they were last converted into the output folder, or found to be all NODATA,
+# are not converted again, the result of each file is stored in the tile cache as soon as it finishes so an
+# interrupted batch can be resumed
+# inputs are the input raster list and the output folder
+# output is a list of result dictionaries from process_input_raster, in completion order
+
+
+def run_batch(inputfilelist, output_raster_folder):
+    tile_cache = open_tile_cache(output_raster_folder)
+    results = []
+    tasks = []
+    try:
+        for input_raster in inputfilelist:
+            description = None
+            if tile_cache is not None:
+                if tile_cache.is_converted(input_raster,
+                                           get_output_raster_path(input_raster, output_raster_folder)):
+                    results.append({'input_raster': input_raster,
+                                    'output_raster': get_output_raster_path(input_raster, output_raster_folder),
+                                    'status': 'unchanged', 'message': 'already converted', 'seconds': 0.0})
+                    SCT_INSTRUMENTATION.record_file(results[-1])
+                    continue
+                if tile_cache.is_empty(input_raster):
+                    results.append({'input_raster': input_raster,
+                                    'output_raster': get_output_raster_path(input_raster, output_raster_folder),
+                                    'status': 'empty', 'message': 'all NODATA when last checked', 'seconds': 0.0})
+                    SCT_INSTRUMENTATION.record_file(results[-1])
+                    continue
+                description = tile_cache.get_description(input_raster)
+            tasks.append((input_raster, output_raster_folder, description))
+        if results:
+            printmsg(len(results), "rasters are unchanged since they were converted or found to be empty and will be",
+                     "skipped")
+
+        for result in run_batch_tasks(tasks):
+            if tile_cache is not None:
+                tile_cache.update_tile(result['input_raster'], result['description'], result['status'],
+                                       result['output_raster'], result['message'])
+            SCT_INSTRUMENTATION.record_file(result)
+            results.append(result)
+    finally:
+        if tile_cache is not None:
+            tile_cache.close()
+    return results
+
+######################################################################################################################
+# Function to run a list of process_input_raster tasks, in a process pool when more than one worker is allowed
+# output is a generator of result dictionaries, in completion order
+
+
+def run_batch_tasks(tasks):
+    worker_count = get_batch_worker_count(len(tasks))
+    if worker_count <= 1:
+        for task in tasks:  # process each file in the input list
+            yield process_input_raster_task(task)
+        return
+
+    printmsg("Converting", len(tasks), "rasters with", worker_count, "worker processes")
+    pool = create_process_pool(worker_count)
+    try:
+        # one task at a time per worker, so at most worker_count tiles are in flight
+        for result in pool.imap_unordered(process_input_raster_task, tasks, 1):
+            printmsg(result['status'], result['input_raster'], result['message'])
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+######################################################################################################################
+# Function to start a pool of worker processes
+
+
+def create_process_pool(worker_count):
+    if sys.platform == 'win32' and not os.path.basename(sys.executable).lower().startswith('python'):
+        # running inside ArcMap, workers must be started with the python interpreter and not ArcMap.exe
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+    return multiprocessing.Pool(worker_count)
+
+######################################################################################################################
+# Function to run the conversion pipeline over a work queue shared by several machines (see SCT_WORK_QUEUE)
+# every machine runs the script with the same input list and output folder, the input rasters are added to the queue
+# by whichever machine starts first and each machine runs stand_condition_tool_worker_count workers that claim tiles
+# until all are done, input paths must be the same on every machine (eg. UNC paths)
+# the batch statistics, deferred overviews and summary are written from the results of every machine by the machine
+# that finishes last, tasks already done are not run again if the queue is restarted
+# inputs are the input raster list and the output folder
+# output is the list of result dictionaries of the tiles converted by this machine
+
+
+def run_queue(inputfilelist, output_raster_folder):
+    queue_folder = stand_condition_tool_queue_folder or os.path.join(output_raster_folder,
+                                                                     stand_condition_tool_queue_folder_name)
+    work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder, stand_condition_tool_queue_lease_seconds)
+    added_count = work_queue.add_tasks([{'input_raster': input_raster} for input_raster in inputfilelist])
+    status = work_queue.get_status()
+    printmsg(added_count, "rasters added to the work queue", queue_folder, ":", status['done'], "done,",
+             status['leased'], "leased,", status['expired'] + status['waiting'], "waiting")
+
+    worker_count = get_batch_worker_count(max(1, status['expired'] + status['waiting']))
+    tasks = [(queue_folder, output_raster_folder, index) for index in range(worker_count)]
+    results = []
+    if worker_count <= 1:
+        results = run_queue_worker_task(tasks[0])
+    else:
+        printmsg("Converting queued rasters with", worker_count, "worker processes")
+        pool = create_process_pool(worker_count)
+        try:
+            for worker_results in pool.imap_unordered(run_queue_worker_task, tasks, 1):
+                results += worker_results
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    for result in results:
+        SCT_INSTRUMENTATION.record_file(result)
+    printmsg(len(results), "queued rasters processed by this machine")
+
+    # the summary lease stops two machines finishing at the same time writing the batch files together, it is renewed
+    # while they are written and expires if this machine stops, so a restart can write them, once they are written a
+    # marker in the done folder stops machines that finish later writing them again
+    if not work_queue.is_complete() or work_queue.is_summary_written():
+        return results
+    worker_id = SCT_WORK_QUEUE.get_worker_id()
+    summary_lease = work_queue.claim_summary(worker_id)
+    if summary_lease is None:
+        return results
+    with summary_lease:
+        if work_queue.is_summary_written():  # written by another machine while this one was claiming the lease
+            return results
+        write_batch_files(work_queue.get_results(), output_raster_folder)
+        work_queue.write_summary_marker({'worker_id': worker_id, 'written': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    return results
+
+
+# multiprocessing worker, runs one queue worker with a (queue_folder, output_raster_folder, worker index) tuple
+
+
+def run_queue_worker_task(task):
+    queue_folder, output_raster_folder, index = task
+    work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder, stand_condition_tool_queue_lease_seconds)
+    with profile_worker(output_raster_folder):
+        return SCT_WORK_QUEUE.run_worker(work_queue,
+                                         lambda queue_task: process_input_raster(queue_task['input_raster'],
+                                                                                 output_raster_folder),
+                                         SCT_WORK_QUEUE.get_worker_id(index))
+
+######################################################################################################################
+# Function to write the batch statistics, deferred overviews and summary of a converted batch, each timed as a span
+# of the run report
+
+
+def write_batch_files(results, output_raster_folder):
+    if stand_condition_tool_write_statistics:
+        with SCT_INSTRUMENTATION.span('statistics', output_raster_folder):
+            write_batch_statistics(results, output_raster_folder)
+    if stand_condition_tool_overviews == "deferred":
+        with SCT_INSTRUMENTATION.span('overviews', output_raster_folder):
+            build_overviews_for_bil_files([result['output_raster'] for result in results
+                                           if result['status'] == 'converted'])
+    with SCT_INSTRUMENTATION.span('summary', output_raster_folder):
+        write_batch_summary(results, output_raster_folder)
+
+######################################################################################################################
+# Function to write the batch summary csv file and report the totals
+# inputs are the list of result dictionaries and the output folder
+# output is the summary file path
+
+
+def write_batch_summary(results, output_raster_folder):
+    summary_path = os.path.join(output_raster_folder, stand_condition_tool_summary_filename)
+    summary_fields = ['input_raster', 'output_raster', 'status', 'message', 'seconds', 'block_count', 'empty_blocks']
+    if sys.version_info[0] < 3:
+        summary_file = open(summary_path, 'wb')
+    else:
+        summary_file = open(summary_path, 'w', newline='')
+    with summary_file:
+        writer = csv.DictWriter(summary_file, summary_fields, extrasaction='ignore')
+        writer.writeheader()
+        for result in sorted(results, key=lambda file_result: file_result['input_raster']):
+            writer.writerow(result)
+
+    status_counts = collections.Counter(result['status'] for result in results)
+    printmsg("Batch complete:", status_counts['converted'], "converted,", status_counts['unchanged'], "unchanged,",
+             status_counts['valid'], "valid,", status_counts['skipped'], "skipped,", status_counts['empty'],
+             "empty,", status_counts['failed'], "failed, summary written to", summary_path)
+    return summary_path
+
+######################################################################################################################
+# Functions to start and finish the run report (see SCT_INSTRUMENTATION), a JSON lines file of the time taken by each
+# stage, the bytes read and written and the result of each file, written to the output folder
+# in queue mode every machine writes its own report, named with its host name and process id
+# a run report that can not be started is reported as a warning and the run carries on without it
+
+
+def get_run_report_path(output_raster_folder):
+    report_path = os.path.join(output_raster_folder, stand_condition_tool_run_report_filename)
+    if stand_condition_tool_mode == "queue":
+        report_name, report_extension = os.path.splitext(report_path)
+        report_path = "%s_%s%s" % (report_name, SCT_WORK_QUEUE.get_host_id(), report_extension)
+    return report_path
+
+
+def start_run_report(output_raster_folder):
+    if not stand_condition_tool_write_run_report:
+        return
+    try:
+        SCT_INSTRUMENTATION.start_run(get_run_report_path(output_raster_folder), stand_condition_tool_profiler)
+    except Exception as err:
+        printwarningmsg("run report could not be started", str(err.args[0]))
+
+
+def finish_run_report():
+    try:
+        summary = SCT_INSTRUMENTATION.finish_run()
+        if summary is None:
+            return
+        for stage in sorted(summary['stages'], key=lambda stage_name: -summary['stages'][stage_name]['seconds']):
+            printmsg(stage, "%.3f s in %d calls" % (summary['stages'][stage]['seconds'],
+                                                   summary['stages'][stage]['count']))
+        printmsg("Run report written to", summary['report'])
+    except Exception as err:
+        printwarningmsg("run report could not be finished", str(err.args[0]))
+
+######################################################################################################################
+# Function to get the folder the overviews of a bil file are written to (a sub folder of the output folder, so the
+# overview levels are not mistaken for tiles)
+
+
+def get_overview_folder(output_raster):
+    return os.path.join(os.path.dirname(output_raster), stand_condition_tool_overview_folder_name)
+
+######################################################################################################################
+# Function to build native overviews for a list of existing bil files, as a separate stage after conversion
+# each bil file is read once and all the overview levels are built from that read
+# output is the number of bil files that failed
+
+
+def build_overviews_for_bil_files(bil_paths):
+    failed_count = 0
+    for bil_path in bil_paths:
+        try:
+            overview_paths = SCT_OVERVIEWS.build_overviews(bil_path, get_overview_folder(bil_path),
+                                                           stand_condition_tool_overview_resampling,
+                                                           SCT_BIL_CONVERTER.bil_nodata_value,
+                                                           stand_condition_tool_block_memory_bytes)
+            printmsg(len(overview_paths), "overview levels built for", bil_path)
+        except Exception as err:
+            failed_count += 1
+            printerrormsg("build overviews error", bil_path, str(err.args[0]), str(traceback.format_exc()))
+    return failed_count
+
+######################################################################################################################
+# Function to merge the band statistics of all the converted files of a batch into one statistics file
+# inputs are the list of result dictionaries and the output folder
+# output is the merged statistics file path, None if there were no statistics to merge
+
+
+def write_batch_statistics(results, output_raster_folder):
+    try:
+        bil_paths = sorted(result['output_raster'] for result in results
+                           if result['status'] in ('converted', 'unchanged'))
+        statistics_path = os.path.join(output_raster_folder, stand_condition_tool_batch_statistics_filename)
+        merged_statistics, missing_statistics = SCT_BAND_STATISTICS.merge_statistics_files(bil_paths,
+                                                                                             statistics_path)
+        if missing_statistics:
+            printwarningmsg(len(missing_statistics), "converted files have no statistics file and are not included in",
+                            statistics_path)
+        if merged_statistics is None:
+            return None
+        printmsg("Batch statistics written to", statistics_path)
+        return statistics_path
+    except Exception as err:
+        printerrormsg("batch statistics error", str(err.args[0]), str(traceback.format_exc()))
+    return None
+
+######################################################################################################################
+# Function to extract a region of interest (eg. one BWS region) from the bil files in the output folder
+# only the tiles overlapping the bounds are read, and they are stitched into a single bil file with an ENVI header
+# the extracted bil file is written to a sub folder, so later runs over the folder of tiles do not index it as a tile
+# inputs are the folder of tiles and the (west, south, east, north) lon/lat bounds
+# output is the extracted bil file path, None on error
+
+
+def extract_region_of_interest(output_raster_folder, bounds):
+    try:
+        tile_index = SCT_TILE_INDEX.TileIndex()
+        for tile_path, message in tile_index.add_folder(output_raster_folder):
+            printwarningmsg(tile_path, "could not be indexed:", message)
+        tiles = tile_index.find_tiles(bounds)
+        printmsg(len(tiles), "of", len(tile_index.tiles), "tiles overlap", bounds)
+        window, geotransform = tile_index.read_window(bounds, SCT_BIL_CONVERTER.bil_nodata_value)
+        extract_folder = os.path.join(output_raster_folder, stand_condition_tool_extract_folder_name)
+        if not os.path.isdir(extract_folder):
+            os.makedirs(extract_folder)
+        extract_path = os.path.join(extract_folder, stand_condition_tool_extract_filename)
+        window.astype('<i2').transpose(1, 0, 2).tofile(extract_path)  # bands, rows, columns to BIL order
+        # ENVI headers give the centre of the upper left pixel
+        SCT_ENVI_HEADER.write_envi_header(extract_path, {'samples': window.shape[2],
+                                                         'lines': window.shape[1],
+                                                         'bands': window.shape[0],
+                                                         'ulxmap': geotransform[0] + geotransform[1] / 2.0,
+                                                         'ulymap': geotransform[3] + geotransform[5] / 2.0,
+                                                         'xdim': geotransform[1],
+                                                         'ydim': -geotransform[5],
+                                                         'data_type': SCT_ENVI_HEADER.envi_data_type_int16})
+        printmsg("Region of interest written to", extract_path)
+        return extract_path
+    except Exception as err:
+        printerrormsg("extract region of interest error", str(err.args[0]), str(traceback.format_exc()))
+    return None
+
+######################################################################################################################
+# Function to calculate the area of each condition bin by BWS region and species from a list of condition rasters,
+# locally instead of in Earth Engine (see SCT_CONDITION_AREA), in parallel when more than one worker is allowed
+# inputs are the condition raster list and the output folder for the wide csv file
+# output is the csv file path, None on error
+
+
+def run_condition_area(condition_rasters, output_folder):
+    try:
+        zone_names = SCT_CONDITION_AREA.read_zone_names(stand_condition_tool_zone_names_csv)
+        worker_count = max(1, min(stand_condition_tool_worker_count, multiprocessing.cpu_count()))
+        printmsg("Calculating condition area for", len(condition_rasters), "condition rasters with", worker_count,
+                 "worker processes")
+        start_time = time.time()
+        pool = create_process_pool(worker_count) if worker_count > 1 else None
+        try:
+            areas, forest_pixels = SCT_CONDITION_AREA.calculate_condition_area(
+                condition_rasters, stand_condition_tool_species_rasters, stand_condition_tool_zone_rasters,
+                list(zone_names), stand_condition_tool_block_memory_bytes,
+                pool.imap_unordered if pool is not None else map)
+            if pool is not None:
+                pool.close()
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+        csv_path = SCT_CONDITION_AREA.write_condition_area_csv(
+            os.path.join(output_folder, stand_condition_tool_condition_area_filename), areas, list(zone_names),
+            zone_names)
+        printmsg(forest_pixels, "forest pixels summed in", round(time.time() - start_time, 1),
+                 "seconds, condition area written to", csv_path)
+        return csv_path
+    except Exception as err:
+        printerrormsg("condition area error", str(err.args[0]), str(traceback.format_exc()))
+    return None
+
+######################################################################################################################
+# Function to reduce the yearly condition rasters (one per year for each tile) to per pixel trend rasters: the trend
+# slope, the year of the lowest condition, the years in each condition bin and the change between epochs (see
+# SCT_CONDITION_TREND), in parallel when more than one worker is allowed
+# inputs are the condition raster list and the output folder for the trend GeoTIFFs
+# output is the dictionary of years and output paths by series, None on error
+
+
+def run_condition_trend(condition_rasters, output_folder):
+    try:
+        worker_count = max(1, min(stand_condition_tool_worker_count, multiprocessing.cpu_count()))
+        printmsg("Calculating condition trends for", len(condition_rasters), "condition rasters with", worker_count,
+                 "worker processes")
+        start_time = time.time()
+        pool = create_process_pool(worker_count) if worker_count > 1 else None
+        try:
+            summaries = SCT_CONDITION_TREND.calculate_condition_trends(
+                condition_rasters, output_folder, stand_condition_tool_trend_epochs,
+                stand_condition_tool_trend_min_years, stand_condition_tool_block_memory_bytes,
+                pool.imap if pool is not None else map)
+            if pool is not None:
+                pool.close()
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+        for series_name in sorted(summaries):
+            printmsg(series_name, "trend of", len(summaries[series_name]['years']), "years written to",
+                     ", ".join(sorted(summaries[series_name]['outputs'].values())))
+        printmsg(len(summaries), "condition series reduced in", round(time.time() - start_time, 1), "seconds")
+        return summaries
+    except Exception as err:
+        printerrormsg("condition trend error", str(err.args[0]), str(traceback.format_exc()))
+    return None
+
+######################################################################################################################
+# Function to build the cloud masked percentile composite of one yearly window (see SCT_COMPOSITE), for running in a
+# multiprocessing worker
+# input is a task tuple for SCT_COMPOSITE.composite_scenes_task
+# output is a tuple of the composite path, its summary dictionary (None on error) and a message
+
+
+def composite_window_task(task):
+    try:
+        output_path, summary = SCT_COMPOSITE.composite_scenes_task(task)
+        return output_path, summary, ''
+    except Exception as err:
+        return task[1], None, "%s %s" % (str(err.args[0]), traceback.format_exc())
+
+######################################################################################################################
+# Function to build the yearly percentile composites of a list of Landsat surface reflectance scenes locally, instead
+# of in Earth Engine, in parallel when more than one worker is allowed
+# every composite is written on the grid covering all the scenes, so the yearly tiles line up
+# inputs are the scene list (Landsat scene id file names with a pixel_qa band) and the output folder
+# output is the list of composite files written
+
+
+def run_composites(scene_paths, output_folder):
+    composite_paths = []
+    try:
+        landsat_scenes = []
+        for scene_path in scene_paths:
+            try:
+                SCT_COMPOSITE.get_scene_sensor(scene_path)
+                SCT_COMPOSITE.get_scene_date(scene_path)
+                landsat_scenes.append(scene_path)
+            except ValueError as err:
+                printwarningmsg(str(err.args[0]), "and is not used in the composites")
+        grid = SCT_COMPOSITE.get_scenes_grid(landsat_scenes)
+        tasks = []
+        for start_date, end_date in SCT_COMPOSITE.get_composite_windows():
+            window_scenes = SCT_COMPOSITE.select_window_scenes(landsat_scenes, start_date, end_date)
+            if window_scenes:
+                tasks.append((window_scenes,
+                              SCT_COMPOSITE.get_composite_path(output_folder, start_date, end_date,
+                                                               stand_condition_tool_composite_percentile),
+                              stand_condition_tool_composite_percentile, grid,
+                              stand_condition_tool_composite_block_memory_bytes))
+        worker_count = int(max(1, min(stand_condition_tool_worker_count, multiprocessing.cpu_count(), len(tasks),
+                                      stand_condition_tool_batch_memory_bytes //
+                                      stand_condition_tool_composite_block_memory_bytes)))
+        printmsg("Building", len(tasks), "composites of", len(landsat_scenes), "scenes with", worker_count,
+                 "worker processes")
+        pool = create_process_pool(worker_count) if worker_count > 1 else None
+        try:
+            for output_path, summary, message in (pool.imap_unordered(composite_window_task, tasks, 1)
+                                                  if pool is not None else map(composite_window_task, tasks)):
+                if summary is None:
+                    printerrormsg("composite error", output_path, message)
+                    continue
+                printmsg("Composite of", summary['scenes'], "scenes written to", output_path, "with",
+                         summary['empty_pixels'], "pixels that have no clear observations")
+                composite_paths.append(output_path)
+            if pool is not None:
+                pool.close()
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+    except Exception as err:
+        printerrormsg("composite error", str(err.args[0]), str(traceback.format_exc()))
+    return composite_paths
 
 ######################################################################################################################
 # Main section for module SCT Raster Tool
@@ -344,37 +1080,59 @@ def run_main():
         # set string
         (inputfilelist, output_raster_folder) = get_script_inputs(sys.argv)
 
-        for input_raster in inputfilelist:  # process each file in the input list
-            printmsg(type(input_raster), input_raster)
-
-            # check number of bands is correct
-            rasterbandslist = read_raster_bands(input_raster)
-            printmsg("raster bands count", len(rasterbandslist))
-            if len(rasterbandslist) != stand_condition_tool_raster_bands_count:
-                printwarningmsg("input raster ", input_raster, " has ", len(rasterbandslist), "bands",
-                                stand_condition_tool_raster_bands_count, "Landsat 7/8 bands required")
-                continue
-            # check that the projection of the input raster is correct for use by the sct tool
-            factory_code = get_dataset_projection_factory_code(input_raster)
-            printmsg("factory code", factory_code)
-            if factory_code != stand_condition_tool_data_spatial_reference_code:
-                printwarningmsg("input raster ", input_raster, " has spatial reference EPSG code", factory_code,
-                                stand_condition_tool_data_spatial_reference_code, "projection required")
-                continue
-            # Build output bil file name and path
-            output_raster = os.path.join(output_raster_folder, os.path.splitext(os.path.split(input_raster)[1])[0]
-                                         + ".BIL")
-
-            printmsg("Converting raster", input_raster, " into an SCT format bil file", output_raster)
-
-            if not convert_rasterinput_to_esri_bil(input_raster,
-                                                   output_raster):  # if error on convert then skip to next
-                # raster
-                printerrormsg("input raster ", input_raster, "could not be converted")
-                continue
-            if not create_envi_header_template(output_raster):
-                printerrormsg("ENVI header for", output_raster, "could not be created")
-                continue
+        start_run_report(output_raster_folder)
+        try:
+            run_mode(inputfilelist, output_raster_folder)
+        finally:
+            finish_run_report()
+
+
+######################################################################################################################
+# Function to run the stand_condition_tool_mode stage(s) for the input files and output folder, each timed as a span
+# of the run report
+#
+def run_mode(inputfilelist, output_raster_folder):
+    if stand_condition_tool_mode == "reheader":
+        with SCT_INSTRUMENTATION.span('reheader', output_raster_folder):
+            reheader_bil_folder(output_raster_folder)
+        return
+    if stand_condition_tool_mode == "overviews":
+        with SCT_INSTRUMENTATION.span('overviews', output_raster_folder):
+            build_overviews_for_bil_files([os.path.join(output_raster_folder, filename)
+                                           for filename in sorted(os.listdir(output_raster_folder))
+                                           if os.path.splitext(filename)[1].lower() == '.bil'])
+        return
+    if stand_condition_tool_mode == "extract":
+        with SCT_INSTRUMENTATION.span('extract', output_raster_folder):
+            extract_region_of_interest(output_raster_folder, stand_condition_tool_extract_bounds)
+        return
+
+    inputfilelist = expand_input_folders(inputfilelist)
+    if stand_condition_tool_mode == "composite":
+        with SCT_INSTRUMENTATION.span('composite', output_raster_folder):
+            run_composites(inputfilelist, output_raster_folder)
+        return
+    if stand_condition_tool_mode == "condition_area":
+        with SCT_INSTRUMENTATION.span('condition_area', output_raster_folder):
+            run_condition_area(inputfilelist, output_raster_folder)
+        return
+    if stand_condition_tool_mode == "condition_trend":
+        with SCT_INSTRUMENTATION.span('condition_trend', output_raster_folder):
+            run_condition_trend(inputfilelist, output_raster_folder)
+        return
+    if stand_condition_tool_mode == "queue":
+        with SCT_INSTRUMENTATION.span('batch', output_raster_folder):
+            run_queue(inputfilelist, output_raster_folder)
+        return
+    if stand_condition_tool_mode == "validate":
+        with SCT_INSTRUMENTATION.span('batch', output_raster_folder):
+            results = validate_input_rasters(inputfilelist, output_raster_folder)
+        with SCT_INSTRUMENTATION.span('summary', output_raster_folder):
+            write_batch_summary(results, output_raster_folder)
+        return
+    with SCT_INSTRUMENTATION.span('batch', output_raster_folder):
+        results = run_batch(inputfilelist, output_raster_folder)
+    write_batch_files(results, output_raster_folder)
 
 
 # Global constants
@@ -382,13 +1140,66 @@ def run_main():
 stand_condition_tool_raster_bands_count = 6  # number of landsat 7 bands required for a SCT raster
 # Red,Green,Blue,Nir, Swir1, Swire2
 stand_condition_tool_data_spatial_reference_code = 4326
+# reproject GeoTIFFs in Australian Albers, MGA or GDA94/GDA2020 geographic to 4326 while converting them (numpy
+# converter only), other projections are skipped
+stand_condition_tool_reproject = True
+stand_condition_tool_conversion_backend = "numpy"  # "numpy" streaming converter or "arcpy" CopyRaster
+stand_condition_tool_block_memory_bytes = SCT_BIL_CONVERTER.bil_default_block_memory_bytes  # numpy converter
+# buffers each for the read ahead and write behind threads of the numpy converter, 2 double buffers so reading,
+# converting and writing a tile overlap, 0 reads, converts and writes each block in turn
+stand_condition_tool_pipeline_depth = 2
+stand_condition_tool_skip_empty = True  # numpy converter, do not write bil files for tiles that are all NODATA
+stand_condition_tool_worker_count = 1  # number of tiles to convert in parallel, 1 converts one file at a time
+stand_condition_tool_batch_memory_bytes = 1024 * 1024 * 1024  # limits parallel workers to this much block memory
+stand_condition_tool_summary_filename = "SCT_conversion_summary.csv"  # per file results, in the output folder
+stand_condition_tool_write_statistics = True  # band statistics and histograms from the numpy converter
+stand_condition_tool_batch_statistics_filename = "SCT_batch_statistics.json"  # merged statistics, in the output folder
+stand_condition_tool_use_tile_cache = True  # skip unchanged, already converted tiles when rerunning a batch
+stand_condition_tool_tile_cache_filename = "SCT_tile_cache.sqlite"  # tile metadata cache, in the output folder
+stand_condition_tool_native_describe = True  # read GeoTIFF band count and EPSG code from the tags, not arcpy
+# overviews (pyramids) for the converted bil files: "inline" builds them while converting, "deferred" builds them
+# natively after the whole batch is converted and "none" does not build them
+stand_condition_tool_overviews = "inline"
+stand_condition_tool_overview_resampling = "nearest"  # native overviews, "nearest" or "average"
+stand_condition_tool_overview_folder_name = "overviews"  # sub folder of the output folder
+# "convert" the input rasters, "queue" them to be converted by workers on several machines, "validate" the input
+# rasters without converting them, "reheader" the bil files in the output folder, build "overviews" for the bil files
+# in the output folder, "extract" a region of interest from the bil files in the output folder, sum the
+# "condition_area" of the input condition rasters, reduce the yearly input condition rasters to "condition_trend"
+# rasters or build the yearly "composite" GeoTIFFs of the input Landsat scenes
+stand_condition_tool_mode = "convert"
+# "queue" work queue folder, shared by every machine, None for a folder in the output folder, and the seconds after
+# which a tile claimed by a machine that has stopped is claimed again
+stand_condition_tool_queue_folder = None
+stand_condition_tool_queue_folder_name = "SCT_work_queue"
+stand_condition_tool_queue_lease_seconds = SCT_WORK_QUEUE.work_queue_default_lease_seconds
+stand_condition_tool_extract_bounds = (145.0, -36.5, 145.5, -36.0)  # west, south, east, north for "extract"
+stand_condition_tool_extract_filename = "SCT_region_of_interest.BIL"  # extracted region, in the extract folder
+stand_condition_tool_extract_folder_name = "SCT_extract"  # sub folder of the output folder for the extracted region
+# "condition_area" inputs: MDBVTmap1 species tiles, rasterised BWS region tiles on the condition pixel grid and a csv
+# of the region codes (zone) and names (BWS_Region)
+stand_condition_tool_species_rasters = [r'C:\\STAND_CONDITION_TOOL_PROJECT\\supplementary\\MDBVTmap1.tif']
+stand_condition_tool_zone_rasters = [r'C:\\STAND_CONDITION_TOOL_PROJECT\\supplementary\\BWSRegions.tif']
+stand_condition_tool_zone_names_csv = r'C:\\STAND_CONDITION_TOOL_PROJECT\\supplementary\\BWSRegions.csv'
+stand_condition_tool_condition_area_filename = "Condition_all_species.csv"  # wide area csv, in the output folder
+# "condition_trend" epochs (first year, last year), each compared with the one before it, and the fewest valid years
+# for a trend slope
+stand_condition_tool_trend_epochs = SCT_CONDITION_TREND.trend_default_epochs
+stand_condition_tool_trend_min_years = SCT_CONDITION_TREND.trend_default_min_years
+stand_condition_tool_composite_percentile = 75  # percentile of the clear observations for "composite"
+stand_condition_tool_composite_block_memory_bytes = SCT_COMPOSITE.composite_default_block_memory_bytes
+stand_condition_tool_write_run_report = True  # time each stage and file into a JSON lines run report
+stand_condition_tool_run_report_filename = "SCT_run_report.jsonl"  # run report, in the output folder
+stand_condition_tool_profiler = None  # also profile the run with None, "cprofile" or "tracemalloc" (python 3)
+stand_condition_tool_verbose = False  # print every ESRI header value when converting CopyRaster headers
 
 # Main program module
 # program statements all run from run_main to avoid scope issues with globals
 if __name__ == "__main__":
 
     # Set environment variables ##
-    arcpy.env.overwriteOutput = True
+    if arcpy is not None:
+        arcpy.env.overwriteOutput = True
 
     try:
         run_main()
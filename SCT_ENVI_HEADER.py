@@ -0,0 +1,165 @@
+# Module to read and write the ENVI format headers required by the MDBA Stand Condition Tool for its 16 bit BIL
+# input files
+# ENVI headers are written directly from the conversion metadata (size and upper left pixel position) that is already
+# in memory, existing ESRI or ENVI headers can also be read back so headers can be regenerated in bulk
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import collections
+import os
+import re
+
+# Constant strings used for the output ENVI header for spatial coordinate system EPSG 4326
+envi_map_info_projection = 'Geographic Lat/Lon, 1, 1,'
+envi_map_info_datum = 'WGS-84'
+envi_coordinate_system_string = 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",' \
+                                'SPHEROID["WGS_1984",6378137,298.257223563]],PRIMEM["Greenwich",0],' \
+                                'UNIT["Degree",0.017453292519943295]]'
+
+# ENVI data type codes for the pixel types written by the Stand Condition Tool scripts
+envi_data_type_uint8 = 1
+envi_data_type_int16 = 2
+
+# "key = value" pairs in an ENVI header, values in braces can run over several lines
+envi_header_value_pattern = re.compile(r'^\s*([^=\n]+?)\s*=\s*(\{[^}]*\}|[^\n]*)', re.MULTILINE)
+
+
+###############################################################################################################
+# function to build the lines of an ENVI header
+# inputs are the bil file path and a metadata dictionary with samples, lines, bands, ulxmap, ulymap, xdim and ydim
+# (ulxmap and ulymap are the centre of the upper left pixel, as in ESRI headers) and optionally data_type
+# output is a list of header lines, without line endings
+
+def build_envi_header_lines(bil_path, metadata):
+    bands = int(metadata['bands'])
+    map_info = "map info = {{" + envi_map_info_projection + ",".join(
+        repr(float(metadata[key])) for key in ('ulxmap', 'ulymap', 'xdim', 'ydim')) + "," + envi_map_info_datum + "}}"
+    header_lines = ['ENVI',
+                    'description = {' + str(bil_path) + '}',
+                    'samples = ' + str(int(metadata['samples'])),
+                    'lines = ' + str(int(metadata['lines'])),
+                    'bands   = ' + str(bands),
+                    'header offset = 0',
+                    'file type = ENVI Standard',
+                    'data type = ' + str(int(metadata.get('data_type', envi_data_type_int16))),
+                    'interleave = bil',
+                    'byte order = 0',
+                    map_info,
+                    'coordinate system string = {' + envi_coordinate_system_string + '}',
+                    'band names = {']
+    header_lines += ['Band %d%s' % (band, '}' if band == bands else ',') for band in range(1, bands + 1)]
+    return header_lines
+
+
+###############################################################################################################
+# function to write the ENVI header for a bil file, replacing any existing header of the same name
+# inputs are the bil file path and the metadata dictionary (see build_envi_header_lines)
+# output is the header file path (bil file name with a .hdr extension)
+
+def write_envi_header(bil_path, metadata):
+    header_path = os.path.splitext(bil_path)[0] + ".hdr"
+    with open(header_path, 'w') as header_file:
+        header_file.write('\n'.join(build_envi_header_lines(bil_path, metadata)) + '\n')
+    return header_path
+
+
+###############################################################################################################
+# function to read an ESRI format bil header (as written by CopyRaster) into a dictionary of KEY: value strings
+
+def read_esri_header(header_path):
+    esri_values = collections.OrderedDict()
+    with open(header_path) as header_file:
+        for textline in header_file:
+            valuelist = textline.split()
+            if len(valuelist) >= 2:
+                esri_values[valuelist[0].upper()] = valuelist[1]
+    return esri_values
+
+
+###############################################################################################################
+# function to read an ENVI header into a dictionary of key: value strings, braces around values are removed
+# raises ValueError if the file is not an ENVI header
+
+def read_envi_header(header_path):
+    with open(header_path) as header_file:
+        header_text = header_file.read()
+    if header_text.lstrip()[:4] != 'ENVI':
+        raise ValueError("%s is not an ENVI header" % header_path)
+    envi_values = collections.OrderedDict()
+    for match in envi_header_value_pattern.finditer(header_text):
+        envi_values[match.group(1).strip()] = match.group(2).strip().strip('{}').strip()
+    return envi_values
+
+
+###############################################################################################################
+# functions to get the metadata dictionary used by write_envi_header from existing ESRI or ENVI header values
+
+def esri_header_metadata(esri_values):
+    return {'samples': int(esri_values['NCOLS']),
+            'lines': int(esri_values['NROWS']),
+            'bands': int(esri_values.get('NBANDS', 1)),
+            'ulxmap': float(esri_values['ULXMAP']),
+            'ulymap': float(esri_values['ULYMAP']),
+            'xdim': float(esri_values['XDIM']),
+            'ydim': float(esri_values['YDIM']),
+            'data_type': envi_data_type_uint8 if esri_values.get('NBITS') == '8' else envi_data_type_int16}
+
+
+def envi_header_metadata(envi_values):
+    # map info is projection name, reference pixel x and y, map x and y, pixel x and y size, datum
+    map_info = [value.strip() for value in envi_values['map info'].split(',')]
+    return {'samples': int(envi_values['samples']),
+            'lines': int(envi_values['lines']),
+            'bands': int(envi_values['bands']),
+            'ulxmap': float(map_info[3]),
+            'ulymap': float(map_info[4]),
+            'xdim': float(map_info[5]),
+            'ydim': float(map_info[6]),
+            'data_type': int(envi_values.get('data type', envi_data_type_int16))}
+
+
+###############################################################################################################
+# function to get the header file of a bil file, a header left over as .hdrold by earlier versions of the converter
+# is used when there is no .hdr file
+
+def get_bil_header_path(bil_path):
+    header_path = os.path.splitext(bil_path)[0] + ".hdr"
+    if not os.path.exists(header_path) and os.path.exists(header_path + "old"):
+        header_path = header_path + "old"
+    return header_path
+
+
+###############################################################################################################
+# function to read the metadata for a bil file from its header, which can be in ESRI or ENVI format
+# a header left over as .hdrold by earlier versions of the converter is used when there is no .hdr file
+# output is the metadata dictionary (see build_envi_header_lines)
+
+def read_bil_header_metadata(bil_path):
+    header_path = get_bil_header_path(bil_path)
+    with open(header_path) as header_file:
+        first_line = header_file.readline().strip()
+    if first_line == 'ENVI':
+        return envi_header_metadata(read_envi_header(header_path))
+    return esri_header_metadata(read_esri_header(header_path))
+
+
+###############################################################################################################
+# function to regenerate the ENVI headers for every bil file in a folder in one pass
+# headers are rewritten in place and leftover .hdrold files are removed
+# output is a tuple of the list of header files written and a list of (bil file, error message) failures
+
+def reheader_bil_folder(bil_folder):
+    written_headers = []
+    failures = []
+    for filename in sorted(os.listdir(bil_folder)):
+        if os.path.splitext(filename)[1].lower() != '.bil':
+            continue
+        bil_path = os.path.join(bil_folder, filename)
+        try:
+            written_headers.append(write_envi_header(bil_path, read_bil_header_metadata(bil_path)))
+            old_header_path = os.path.splitext(bil_path)[0] + ".hdrold"
+            if os.path.exists(old_header_path):
+                os.remove(old_header_path)
+        except (IOError, OSError, KeyError, IndexError, ValueError) as err:
+            failures.append((bil_path, str(err)))
+    return written_headers, failures
@@ -0,0 +1,83 @@
+# Automated test module for the ENVI header functions used by the Stand Condition Tool Raster Converter project script
+# Test headers are written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import SCT_ENVI_HEADER
+
+test_metadata = {'samples': 9472, 'lines': 9472, 'bands': 6, 'ulxmap': 140.552610225786,
+                 'ulymap': -27.5527221526361, 'xdim': 0.000269494585235856, 'ydim': 0.000269494585235856}
+
+test_esri_header = """BYTEORDER      I
+LAYOUT         BIL
+NROWS          9472
+NCOLS          9472
+NBANDS         6
+NBITS          16
+BANDROWBYTES   18944
+TOTALROWBYTES  113664
+PIXELTYPE      SIGNEDINT
+ULXMAP         140.552610225786
+ULYMAP         -27.5527221526361
+XDIM           0.000269494585235856
+YDIM           0.000269494585235856
+NODATA         -32768
+"""
+
+
+# test that the ENVI header has the layout and values the Stand Condition Tool expects
+def test_build_envi_header_lines():
+    header_lines = SCT_ENVI_HEADER.build_envi_header_lines(r'C:\output\MDB_P75_3.BIL', test_metadata)
+    assert header_lines[:4] == ['ENVI', r'description = {C:\output\MDB_P75_3.BIL}', 'samples = 9472', 'lines = 9472']
+    assert header_lines[4:10] == ['bands   = 6', 'header offset = 0', 'file type = ENVI Standard', 'data type = 2',
+                                  'interleave = bil', 'byte order = 0']
+    assert header_lines[10] == 'map info = {{Geographic Lat/Lon, 1, 1,140.552610225786,-27.5527221526361,' \
+                               '0.000269494585235856,0.000269494585235856,WGS-84}}'
+    assert header_lines[11].startswith('coordinate system string = {GEOGCS["GCS_WGS_1984"')
+    assert header_lines[12:] == ['band names = {', 'Band 1,', 'Band 2,', 'Band 3,', 'Band 4,', 'Band 5,', 'Band 6}']
+
+
+# test that an ENVI header can be read back into the metadata it was written from
+def test_read_envi_header():
+    test_folder = tempfile.mkdtemp()
+    try:
+        header_path = SCT_ENVI_HEADER.write_envi_header(os.path.join(test_folder, 'tile.BIL'), test_metadata)
+        envi_values = SCT_ENVI_HEADER.read_envi_header(header_path)
+        assert envi_values['interleave'] == 'bil' and envi_values['band names'].split(',')[5].strip() == 'Band 6'
+        assert SCT_ENVI_HEADER.envi_header_metadata(envi_values) == dict(test_metadata, data_type=2)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a folder of bil files with ESRI headers, ENVI headers and leftover .hdrold files is reheadered in one pass
+def test_reheader_bil_folder():
+    test_folder = tempfile.mkdtemp()
+    try:
+        for name in ('esri', 'old', 'envi', 'broken'):
+            open(os.path.join(test_folder, name + '.BIL'), 'wb').close()
+        with open(os.path.join(test_folder, 'esri.hdr'), 'w') as header_file:
+            header_file.write(test_esri_header)
+        with open(os.path.join(test_folder, 'old.hdrold'), 'w') as header_file:
+            header_file.write(test_esri_header)
+        SCT_ENVI_HEADER.write_envi_header(os.path.join(test_folder, 'envi.BIL'), test_metadata)
+
+        written_headers, failures = SCT_ENVI_HEADER.reheader_bil_folder(test_folder)
+        assert len(written_headers) == 3
+        assert [os.path.basename(bil_path) for bil_path, message in failures] == ['broken.BIL']
+        assert not os.path.exists(os.path.join(test_folder, 'old.hdrold'))
+        for name in ('esri', 'old', 'envi'):
+            metadata = SCT_ENVI_HEADER.read_bil_header_metadata(os.path.join(test_folder, name + '.BIL'))
+            assert metadata == dict(test_metadata, data_type=2)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_build_envi_header_lines()
+    test_read_envi_header()
+    test_reheader_bil_folder()
+    print("Everything passed")
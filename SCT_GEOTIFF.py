@@ -0,0 +1,702 @@
+# Module to read the GeoTIFF files exported by Code_to_create_SCT_inputs without arcpy
+# Reads the TIFF image file directory (IFD) and GeoKey directory and returns pixel data for windows of rows and
+# columns, so that very large tiles can be streamed a block at a time
+# Opening a file only reads the header and tags, so the metadata (bands, data type, size, geotransform, EPSG code)
+# can be checked in a few milliseconds per file
+# Supports classic and BigTIFF files, stripped or tiled layouts, chunky or planar band storage and
+# no, deflate or LZW compression with or without horizontal or floating point predictors
+# GeoTiffWriter streams blocks of rows to a new stripped GeoTIFF, so outputs never need to be held in memory
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import imagecodecs
+except ImportError:  # imagecodecs is optional, LZW is decoded with numpy without it
+    imagecodecs = None
+
+# TIFF field types: struct format character and size in bytes
+tiff_field_types = {1: ('B', 1),    # BYTE
+                    2: ('s', 1),    # ASCII
+                    3: ('H', 2),    # SHORT
+                    4: ('I', 4),    # LONG
+                    5: ('I', 8),    # RATIONAL, two LONGs
+                    6: ('b', 1),    # SBYTE
+                    7: ('B', 1),    # UNDEFINED
+                    8: ('h', 2),    # SSHORT
+                    9: ('i', 4),    # SLONG
+                    10: ('i', 8),   # SRATIONAL, two SLONGs
+                    11: ('f', 4),   # FLOAT
+                    12: ('d', 8),   # DOUBLE
+                    13: ('I', 4),   # IFD
+                    16: ('Q', 8),   # LONG8 (BigTIFF)
+                    17: ('q', 8),   # SLONG8 (BigTIFF)
+                    18: ('Q', 8)}   # IFD8 (BigTIFF)
+
+# TIFF and GeoTIFF tag codes used by the reader
+tiff_tag_image_width = 256
+tiff_tag_image_length = 257
+tiff_tag_bits_per_sample = 258
+tiff_tag_compression = 259
+tiff_tag_photometric_interpretation = 262
+tiff_tag_strip_offsets = 273
+tiff_tag_samples_per_pixel = 277
+tiff_tag_rows_per_strip = 278
+tiff_tag_strip_byte_counts = 279
+tiff_tag_planar_configuration = 284
+tiff_tag_predictor = 317
+tiff_tag_tile_width = 322
+tiff_tag_tile_length = 323
+tiff_tag_tile_offsets = 324
+tiff_tag_tile_byte_counts = 325
+tiff_tag_extra_samples = 338
+tiff_tag_sample_format = 339
+tiff_tag_model_pixel_scale = 33550
+tiff_tag_model_tiepoint = 33922
+tiff_tag_model_transformation = 34264
+tiff_tag_geokey_directory = 34735
+tiff_tag_geo_double_params = 34736
+tiff_tag_geo_ascii_params = 34737
+tiff_tag_gdal_nodata = 42113
+
+# GeoKey codes used by the reader
+geokey_model_type = 1024
+geokey_raster_type = 1025
+geokey_geographic_type = 2048
+geokey_projected_cs_type = 3072
+geokey_model_type_projected = 1
+geokey_model_type_geographic = 2
+geokey_raster_pixel_is_point = 2
+geokey_user_defined = 32767
+
+# numpy type character for the TIFF SampleFormat tag values 1 (unsigned int), 2 (signed int) and 3 (float)
+tiff_sample_format_kinds = {1: 'u', 2: 'i', 3: 'f'}
+
+# classic TIFF files are limited to 4GB, larger outputs are written as BigTIFF
+tiff_classic_max_bytes = 2 ** 32 - 2 ** 24
+
+# rows per strip written by GeoTiffWriter are chosen to give strips of about this size
+tiff_writer_strip_bytes = 256 * 1024
+
+# LZW codes between clear codes, and the decoded bytes of the code runs decoded together by the numpy LZW decoder
+lzw_max_codes = 4096
+lzw_decode_batch_bytes = 16 * 1024 * 1024
+
+
+###############################################################################################################
+# Class giving windowed read access to the first (full resolution) image in a GeoTIFF file
+# input is a path to a GeoTIFF file, the file stays open until close() is called (or the with block exits)
+# read_window returns an array shaped (bands, rows, columns) in native byte order
+
+class GeoTiffRaster(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._read_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    # read the TIFF header and the first IFD and set up the raster properties
+    def _read_header(self):
+        header = self._file.read(16)
+        if header[:2] == b'II':
+            self.byteorder = '<'
+        elif header[:2] == b'MM':
+            self.byteorder = '>'
+        else:
+            raise ValueError("%s is not a TIFF file" % self.path)
+
+        version = struct.unpack(self.byteorder + 'H', header[2:4])[0]
+        if version == 42:
+            self.bigtiff = False
+            ifd_offset = struct.unpack(self.byteorder + 'I', header[4:8])[0]
+        elif version == 43:
+            self.bigtiff = True
+            ifd_offset = struct.unpack(self.byteorder + 'Q', header[8:16])[0]
+        else:
+            raise ValueError("%s has an unknown TIFF version %d" % (self.path, version))
+
+        self.tags = self._read_ifd(ifd_offset)
+        tags = self.tags
+
+        self.width = tags[tiff_tag_image_width][0]
+        self.height = tags[tiff_tag_image_length][0]
+        self.bands = tags.get(tiff_tag_samples_per_pixel, (1,))[0]
+        self.compression = tags.get(tiff_tag_compression, (1,))[0]
+        self.predictor = tags.get(tiff_tag_predictor, (1,))[0]
+        self.planar_configuration = tags.get(tiff_tag_planar_configuration, (1,))[0]
+
+        bits_per_sample = tags.get(tiff_tag_bits_per_sample, (1,))[0]
+        sample_format = tags.get(tiff_tag_sample_format, (1,))[0]
+        if sample_format not in tiff_sample_format_kinds or bits_per_sample not in (8, 16, 32, 64):
+            raise ValueError("%s has an unsupported sample format %d with %d bits per sample"
+                             % (self.path, sample_format, bits_per_sample))
+        self.dtype = np.dtype(tiff_sample_format_kinds[sample_format] + str(bits_per_sample // 8))
+        self._file_dtype = self.dtype.newbyteorder(self.byteorder)
+
+        # strips are treated as tiles the full width of the image
+        if tiff_tag_tile_width in tags:
+            self.tiled = True
+            self.chunk_rows = tags[tiff_tag_tile_length][0]
+            self.chunk_cols = tags[tiff_tag_tile_width][0]
+            self._chunk_offsets = tags[tiff_tag_tile_offsets]
+            self._chunk_byte_counts = tags[tiff_tag_tile_byte_counts]
+        else:
+            self.tiled = False
+            self.chunk_rows = min(tags.get(tiff_tag_rows_per_strip, (self.height,))[0], self.height)
+            self.chunk_cols = self.width
+            self._chunk_offsets = tags[tiff_tag_strip_offsets]
+            self._chunk_byte_counts = tags[tiff_tag_strip_byte_counts]
+        self.chunks_across = (self.width + self.chunk_cols - 1) // self.chunk_cols
+        self.chunks_down = (self.height + self.chunk_rows - 1) // self.chunk_rows
+        # rows that are decoded together, uncompressed strips are read in part so any number of rows can be read
+        self.row_step = 1 if not self.tiled and self.compression == 1 else self.chunk_rows
+
+        # GDAL writes the NODATA value as an ASCII tag
+        self.nodata = None
+        if tiff_tag_gdal_nodata in tags:
+            try:
+                self.nodata = float(tags[tiff_tag_gdal_nodata].strip())
+            except ValueError:
+                self.nodata = None
+
+        self.geokeys = self._read_geokeys()
+        self.epsg = self._read_epsg()
+        self.geotransform = self._read_geotransform()
+
+    # read all the entries of an IFD into a dictionary of tag code: tuple of values (or a string for ASCII tags)
+    def _read_ifd(self, offset):
+        byteorder = self.byteorder
+        if self.bigtiff:
+            count_format, entry_format, entry_size, inline_size = 'Q', 'HHQ', 20, 8
+        else:
+            count_format, entry_format, entry_size, inline_size = 'H', 'HHI', 12, 4
+
+        self._file.seek(offset)
+        count = struct.unpack(byteorder + count_format, self._file.read(struct.calcsize(count_format)))[0]
+        entries = self._file.read(count * entry_size)
+
+        tags = {}
+        for entry_index in range(count):
+            entry = entries[entry_index * entry_size:(entry_index + 1) * entry_size]
+            tag, field_type, value_count = struct.unpack(byteorder + entry_format, entry[:entry_size - inline_size])
+            if field_type not in tiff_field_types:
+                continue  # unknown field types are skipped as the TIFF specification requires
+            value_format, value_size = tiff_field_types[field_type]
+            data_size = value_size * value_count
+            if data_size <= inline_size:
+                data = entry[entry_size - inline_size:entry_size - inline_size + data_size]
+            else:
+                data_offset = struct.unpack(byteorder + ('Q' if self.bigtiff else 'I'),
+                                            entry[entry_size - inline_size:])[0]
+                self._file.seek(data_offset)
+                data = self._file.read(data_size)
+
+            if field_type == 2:
+                tags[tag] = data.rstrip(b'\0').decode('latin-1')
+            elif field_type in (5, 10):
+                pairs = struct.unpack(byteorder + value_format * (2 * value_count), data)
+                tags[tag] = tuple(float(pairs[i]) / pairs[i + 1] if pairs[i + 1] else 0.0
+                                  for i in range(0, len(pairs), 2))
+            else:
+                tags[tag] = struct.unpack(byteorder + value_format * value_count, data)
+        return tags
+
+    # read the GeoKey directory into a dictionary of key code: value (a number, tuple of doubles or string)
+    def _read_geokeys(self):
+        geokeys = {}
+        directory = self.tags.get(tiff_tag_geokey_directory)
+        if not directory or len(directory) < 4:
+            return geokeys
+        double_params = self.tags.get(tiff_tag_geo_double_params, ())
+        ascii_params = self.tags.get(tiff_tag_geo_ascii_params, '')
+        for key_index in range(directory[3]):
+            key, location, count, value = directory[4 + key_index * 4:8 + key_index * 4]
+            if location == 0:
+                geokeys[key] = value
+            elif location == tiff_tag_geo_double_params:
+                geokeys[key] = double_params[value:value + count]
+            elif location == tiff_tag_geo_ascii_params:
+                geokeys[key] = ascii_params[value:value + count].rstrip('|')
+            elif location == tiff_tag_geokey_directory:
+                geokeys[key] = directory[value:value + count]
+        return geokeys
+
+    # get the EPSG code of the projected or geographic coordinate system, None if it is user defined or missing
+    def _read_epsg(self):
+        model_type = self.geokeys.get(geokey_model_type)
+        if model_type == geokey_model_type_projected or geokey_projected_cs_type in self.geokeys:
+            epsg = self.geokeys.get(geokey_projected_cs_type)
+        else:
+            epsg = self.geokeys.get(geokey_geographic_type)
+        if not isinstance(epsg, int) or epsg == geokey_user_defined:
+            return None
+        return epsg
+
+    # build a GDAL style geotransform (origin x, pixel width, 0, origin y, 0, -pixel height) from the
+    # ModelTransformation tag or the ModelTiepoint and ModelPixelScale tags, None if the file is not georeferenced
+    # the origin is the outer corner of the upper left pixel, PixelIsPoint files are shifted by half a pixel
+    def _read_geotransform(self):
+        tags = self.tags
+        if tiff_tag_model_transformation in tags:
+            matrix = tags[tiff_tag_model_transformation]
+            geotransform = [matrix[3], matrix[0], matrix[1], matrix[7], matrix[4], matrix[5]]
+        elif tiff_tag_model_tiepoint in tags and tiff_tag_model_pixel_scale in tags:
+            tiepoint = tags[tiff_tag_model_tiepoint]
+            scale = tags[tiff_tag_model_pixel_scale]
+            origin_x = tiepoint[3] - tiepoint[0] * scale[0]
+            origin_y = tiepoint[4] + tiepoint[1] * scale[1]
+            geotransform = [origin_x, scale[0], 0.0, origin_y, 0.0, -scale[1]]
+        else:
+            return None
+        if self.geokeys.get(geokey_raster_type) == geokey_raster_pixel_is_point:
+            geotransform[0] -= (geotransform[1] + geotransform[2]) / 2.0
+            geotransform[3] -= (geotransform[4] + geotransform[5]) / 2.0
+        return tuple(geotransform)
+
+    # get the raster metadata as a dictionary: bands (samples per pixel), data type name, samples (columns),
+    # lines (rows), geotransform, EPSG code, NODATA value and compression
+    def metadata(self):
+        return {'bands': self.bands,
+                'data_type': self.dtype.name,
+                'samples': self.width,
+                'lines': self.height,
+                'geotransform': self.geotransform,
+                'epsg': self.epsg,
+                'nodata': self.nodata,
+                'compression': self.compression}
+
+    # read a block of whole rows, shaped (bands, row_count, width)
+    def read_rows(self, row_start, row_count, out=None):
+        return self.read_window(row_start, row_count, 0, self.width, out)
+
+    # read a window of the raster, shaped (bands, row_count, col_count)
+    # only the strips or tiles that intersect the window are read and decoded, and only the rows of the window are
+    # read from uncompressed strips
+    # the window is read into out if an array of that shape is given, so a buffer can be reused for every block
+    def read_window(self, row_start, row_count, col_start=0, col_count=None, out=None):
+        if col_count is None:
+            col_count = self.width - col_start
+        row_end = row_start + row_count
+        col_end = col_start + col_count
+        if row_start < 0 or col_start < 0 or row_end > self.height or col_end > self.width:
+            raise ValueError("window rows %d:%d, columns %d:%d is outside %s (%d x %d)"
+                             % (row_start, row_end, col_start, col_end, self.path, self.height, self.width))
+
+        window = np.empty((self.bands, row_count, col_count), dtype=self.dtype) if out is None else out
+        for chunk_row in range(row_start // self.chunk_rows, (row_end - 1) // self.chunk_rows + 1):
+            chunk_row_start = chunk_row * self.chunk_rows
+            first_row = max(row_start - chunk_row_start, 0) if self.row_step == 1 else 0
+            last_row = min(row_end - chunk_row_start, self.chunk_rows) if self.row_step == 1 else None
+            for chunk_col in range(col_start // self.chunk_cols, (col_end - 1) // self.chunk_cols + 1):
+                chunk_col_start = chunk_col * self.chunk_cols
+                chunk = self._read_chunk(chunk_row, chunk_col, first_row, last_row)
+                # intersection of the chunk and the window, in image coordinates
+                top = max(row_start, chunk_row_start + first_row)
+                bottom = min(row_end, chunk_row_start + first_row + chunk.shape[1])
+                left = max(col_start, chunk_col_start)
+                right = min(col_end, chunk_col_start + chunk.shape[2])
+                window[:, top - row_start:bottom - row_start, left - col_start:right - col_start] = \
+                    chunk[:, top - chunk_row_start - first_row:bottom - chunk_row_start - first_row,
+                          left - chunk_col_start:right - chunk_col_start]
+        return window
+
+    # check whether rows of the raster are known to be NODATA without reading them, ie. every strip or tile of the
+    # rows (in every band plane) was never written (GDAL sparse files) and the raster has a NODATA value
+    def is_sparse(self, row_start, row_count):
+        if self.nodata is None:
+            return False
+        chunk_rows = range(row_start // self.chunk_rows, (row_start + row_count - 1) // self.chunk_rows + 1)
+        planes = self.bands if self.planar_configuration == 2 else 1
+        chunks_per_plane = self.chunks_across * self.chunks_down
+        return all(self._chunk_byte_counts[plane * chunks_per_plane + chunk_row * self.chunks_across + chunk_col] == 0
+                   for plane in range(planes) for chunk_row in chunk_rows for chunk_col in range(self.chunks_across))
+
+    # read and decode one strip or tile for all bands, shaped (bands, rows, columns)
+    # rows first_row to last_row of an uncompressed strip can be read instead of the whole strip
+    def _read_chunk(self, chunk_row, chunk_col, first_row=0, last_row=None):
+        if self.tiled:
+            rows = self.chunk_rows  # tiles are always padded to the full tile size
+        else:
+            rows = min(self.chunk_rows, self.height - chunk_row * self.chunk_rows)
+        if last_row is not None:
+            rows = min(rows, last_row)
+        rows -= first_row
+        chunk_index = chunk_row * self.chunks_across + chunk_col
+
+        if self.planar_configuration == 1:
+            pixels = self._decode_chunk(chunk_index, rows, self.chunk_cols, self.bands, first_row)
+            return pixels.transpose(2, 0, 1)
+
+        chunks_per_plane = self.chunks_across * self.chunks_down
+        chunk = np.empty((self.bands, rows, self.chunk_cols), dtype=self.dtype)
+        for band in range(self.bands):
+            chunk[band] = self._decode_chunk(band * chunks_per_plane + chunk_index, rows, self.chunk_cols, 1,
+                                             first_row)[:, :, 0]
+        return chunk
+
+    # read, decompress and undo the predictor for one stored strip or tile, shaped (rows, columns, samples)
+    # an uncompressed strip is read from first_row, the predictors work along rows so they are undone the same way
+    def _decode_chunk(self, index, rows, cols, samples, first_row=0):
+        shape = (rows, cols, samples)
+        byte_count = self._chunk_byte_counts[index]
+        if byte_count == 0:  # sparse file, chunk was never written
+            return np.full(shape, self.nodata if self.nodata is not None else 0, dtype=self.dtype)
+
+        if self.compression == 1:
+            stored_row_bytes = cols * samples * self.dtype.itemsize
+            self._file.seek(self._chunk_offsets[index] + first_row * stored_row_bytes)
+            data = self._file.read(rows * stored_row_bytes)
+        else:
+            self._file.seek(self._chunk_offsets[index])
+            data = self._file.read(byte_count)
+        if self.compression in (8, 32946):
+            data = zlib.decompress(data)
+        elif self.compression == 5:
+            data = lzw_decode(data)
+        elif self.compression != 1:
+            raise ValueError("%s uses unsupported TIFF compression %d" % (self.path, self.compression))
+
+        value_count = rows * cols * samples
+        if self.predictor == 3:
+            # floating point predictor: each row is stored as byte planes (most significant first) that have been
+            # differenced with a stride of the number of samples
+            row_bytes = np.frombuffer(data, dtype=np.uint8, count=value_count * self.dtype.itemsize)
+            row_bytes = np.cumsum(row_bytes.reshape(rows, cols * self.dtype.itemsize, samples), axis=1,
+                                  dtype=np.uint8)
+            planes = row_bytes.reshape(rows, self.dtype.itemsize, cols * samples)
+            big_endian = np.ascontiguousarray(planes.transpose(0, 2, 1))
+            pixels = big_endian.view(self.dtype.newbyteorder('>')).reshape(shape)
+        else:
+            pixels = np.frombuffer(data, dtype=self._file_dtype, count=value_count).reshape(shape)
+            if self.predictor == 2:
+                pixels = np.cumsum(pixels, axis=1, dtype=self._file_dtype)
+        return pixels.astype(self.dtype, copy=False)
+
+
+###############################################################################################################
+# function to read the metadata of a GeoTIFF without reading any pixel data
+# input is a GeoTIFF path
+# output is the metadata dictionary (see GeoTiffRaster.metadata)
+
+def read_geotiff_metadata(path):
+    with GeoTiffRaster(path) as raster:
+        return raster.metadata()
+
+
+###############################################################################################################
+# function to check that a raster stored as a single compressed strip fits in a memory budget, as reading any of its
+# rows decodes the whole image
+# inputs are the raster (a GeoTiffRaster or a raster wrapping one), the bytes needed for each of its rows and the
+# memory budget
+# raises ValueError if the strip needs more than the budget
+
+def check_single_strip_memory(raster, row_bytes, block_memory_bytes):
+    if getattr(raster, 'tiled', False) or raster.height <= 1 or min(raster.row_step, raster.height) != raster.height:
+        return
+    if raster.height * row_bytes > block_memory_bytes:
+        raise ValueError("%s is stored as a single compressed strip, which needs %.1f MB to read and the block "
+                         "memory is %.1f MB, rewrite it with tiles or smaller strips (eg. gdal_translate -co "
+                         "TILED=YES) or allow more block memory" % (raster.path, raster.height * row_bytes / 1048576.0,
+                                                                    block_memory_bytes / 1048576.0))
+
+
+###############################################################################################################
+# function to check whether a file name is a GeoTIFF, by extension
+
+def is_geotiff_path(path):
+    return os.path.splitext(path)[1].lower() in ('.tif', '.tiff')
+
+
+###############################################################################################################
+# Class writing a stripped, chunky GeoTIFF a block of rows at a time
+# inputs are the output path, the size (width, height, bands), the numpy data type, a GDAL style north up
+# geotransform, the EPSG code (4000 to 4999 are written as geographic, others as projected), an optional NODATA value,
+# the rows per strip (by default strips of about tiff_writer_strip_bytes), whether to deflate compress the strips and
+# whether to write a BigTIFF (by default only when the image is too large for a classic TIFF)
+# blocks shaped (bands, rows, columns) are passed to write_rows() from the top of the image down, the image file
+# directory is written by close() (or when the with block exits), abort() (or an error in the with block) removes the
+# unfinished file
+
+class GeoTiffWriter(object):
+
+    def __init__(self, path, width, height, bands, dtype, geotransform, epsg=4326, nodata=None,
+                 rows_per_strip=None, compress=False, bigtiff=None):
+        if geotransform[2] != 0.0 or geotransform[4] != 0.0:
+            raise ValueError("only north up GeoTIFFs can be written")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.bands = bands
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.geotransform = geotransform
+        self.epsg = epsg
+        self.nodata = nodata
+        self.compress = compress
+        row_bytes = width * bands * self.dtype.itemsize
+        self.rows_per_strip = min(height, rows_per_strip or max(1, tiff_writer_strip_bytes // row_bytes))
+        self.bigtiff = row_bytes * height > tiff_classic_max_bytes if bigtiff is None else bigtiff
+        self.rows_written = 0
+        self.finished = False
+        self._strip_offsets = []
+        self._strip_byte_counts = []
+        self._pending = np.empty((self.rows_per_strip, width, bands), dtype=self.dtype)  # chunky rows of a strip
+        self._pending_rows = 0
+        self._file = open(path, 'wb')
+        # header with a placeholder for the IFD offset
+        self._file.write(b'II\x2b\x00\x08\x00\x00\x00' + b'\0' * 8 if self.bigtiff else b'II\x2a\x00' + b'\0' * 4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    # write the next block of rows, shaped (bands, rows, columns)
+    def write_rows(self, block):
+        if block.shape[0] != self.bands or block.shape[2] != self.width:
+            raise ValueError("block of shape %s does not match %s (%d bands, %d columns)"
+                             % (block.shape, self.path, self.bands, self.width))
+        if self.rows_written + block.shape[1] > self.height:
+            raise ValueError("more than %d rows written to %s" % (self.height, self.path))
+        block_row = 0
+        while block_row < block.shape[1]:
+            row_count = min(block.shape[1] - block_row, self.rows_per_strip - self._pending_rows)
+            self._pending[self._pending_rows:self._pending_rows + row_count] = \
+                block[:, block_row:block_row + row_count].transpose(1, 2, 0)
+            self._pending_rows += row_count
+            block_row += row_count
+            self.rows_written += row_count
+            if self._pending_rows == self.rows_per_strip or self.rows_written == self.height:
+                self._write_strip()
+
+    # write the rows waiting for a full strip
+    def _write_strip(self):
+        data = self._pending[:self._pending_rows].tobytes()
+        if self.compress:
+            data = zlib.compress(data)
+        self._strip_offsets.append(self._file.tell())
+        self._strip_byte_counts.append(len(data))
+        self._file.write(data)
+        self._pending_rows = 0
+
+    # write the image file directory and close the file
+    # raises ValueError if fewer rows than the height of the image were written
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError("%d of %d rows written to %s" % (self.rows_written, self.height, self.path))
+            self._write_ifd()
+            self.finished = True
+        finally:
+            self._file.close()
+
+    # stop writing and remove the unfinished file, a GeoTIFF already finished by close() is kept
+    def abort(self):
+        if self.finished:
+            return
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write_ifd(self):
+        offset_type = 16 if self.bigtiff else 4
+        if 4000 <= self.epsg < 5000:
+            geokeys = [1, 1, 0, 3, geokey_model_type, 0, 1, geokey_model_type_geographic,
+                       geokey_raster_type, 0, 1, 1, geokey_geographic_type, 0, 1, self.epsg]
+        else:
+            geokeys = [1, 1, 0, 3, geokey_model_type, 0, 1, geokey_model_type_projected,
+                       geokey_raster_type, 0, 1, 1, geokey_projected_cs_type, 0, 1, self.epsg]
+        tags = {tiff_tag_image_width: (4, [self.width]),
+                tiff_tag_image_length: (4, [self.height]),
+                tiff_tag_bits_per_sample: (3, [self.dtype.itemsize * 8] * self.bands),
+                tiff_tag_compression: (3, [8 if self.compress else 1]),
+                tiff_tag_photometric_interpretation: (3, [1]),
+                tiff_tag_strip_offsets: (offset_type, self._strip_offsets),
+                tiff_tag_samples_per_pixel: (3, [self.bands]),
+                tiff_tag_rows_per_strip: (4, [self.rows_per_strip]),
+                tiff_tag_strip_byte_counts: (offset_type, self._strip_byte_counts),
+                tiff_tag_planar_configuration: (3, [1]),
+                tiff_tag_sample_format: (3, [{'u': 1, 'i': 2, 'f': 3}[self.dtype.kind]] * self.bands),
+                tiff_tag_model_pixel_scale: (12, [self.geotransform[1], -self.geotransform[5], 0.0]),
+                tiff_tag_model_tiepoint: (12, [0.0, 0.0, 0.0, self.geotransform[0], self.geotransform[3], 0.0]),
+                tiff_tag_geokey_directory: (3, geokeys)}
+        if self.bands > 1:
+            tags[tiff_tag_extra_samples] = (3, [0] * (self.bands - 1))
+        if self.nodata is not None:
+            tags[tiff_tag_gdal_nodata] = (2, repr(float(self.nodata)))
+
+        if self.bigtiff:
+            count_format, entry_format, inline_size, offset_format = '<Q', '<HHQ', 8, '<Q'
+        else:
+            count_format, entry_format, inline_size, offset_format = '<H', '<HHI', 4, '<I'
+        ifd_offset = self._file.tell() + self._file.tell() % 2
+        extra_offset = ifd_offset + struct.calcsize(count_format) + \
+            len(tags) * (struct.calcsize(entry_format) + inline_size) + struct.calcsize(offset_format)
+        entries = []
+        extra = b''
+        for tag in sorted(tags):
+            field_type, values = tags[tag]
+            if field_type == 2:
+                payload = values.encode('latin-1') + b'\0'
+                count = len(payload)
+            else:
+                payload = struct.pack('<' + tiff_field_types[field_type][0] * len(values), *values)
+                count = len(values)
+            if len(payload) <= inline_size:
+                value = payload.ljust(inline_size, b'\0')
+            else:
+                value = struct.pack(offset_format, extra_offset + len(extra))
+                extra += payload + b'\0' * (len(payload) % 2)
+            entries.append(struct.pack(entry_format, tag, field_type, count) + value)
+
+        self._file.write(b'\0' * (ifd_offset - self._file.tell()))
+        self._file.write(struct.pack(count_format, len(entries)) + b''.join(entries) + struct.pack(offset_format, 0))
+        self._file.write(extra)
+        self._file.seek(8 if self.bigtiff else 4)
+        self._file.write(struct.pack(offset_format, ifd_offset))
+
+
+###############################################################################################################
+# function to decode TIFF LZW compressed data
+# codes are packed most significant bit first and grow from 9 to 12 bits, one code earlier than plain LZW
+# 256 clears the code table and 257 marks the end of the data
+# the compiled imagecodecs decoder is used when it is installed (it also releases the GIL so the read ahead thread of
+# the converter runs alongside), otherwise the codes are decoded with numpy by lzw_decode_numpy
+
+def lzw_decode(data):
+    if imagecodecs is not None:
+        return imagecodecs.lzw_decode(data)
+    return lzw_decode_numpy(data)
+
+
+# bit width and bit offset of each code after a clear code, the table grows by one entry for every code after the
+# first and the width grows when the table reaches 511, 1023 and 2047 entries
+_lzw_table_sizes = np.maximum(258, 257 + np.arange(lzw_max_codes))
+lzw_code_widths = (9 + (_lzw_table_sizes >= 511) + (_lzw_table_sizes >= 1023) + (_lzw_table_sizes >= 2047)).astype(
+    np.int64)
+lzw_code_offsets = np.cumsum(lzw_code_widths) - lzw_code_widths
+
+
+###############################################################################################################
+# function to unpack TIFF LZW data into runs of codes, one run for each clear code
+# the code widths only depend on the position of a code after the last clear code, so each run is unpacked with
+# numpy up to the next clear or end code
+# output is a list of arrays of codes, without the clear and end codes
+# raises ValueError if a code is not in the code table
+
+def read_lzw_codes(data):
+    packed = np.frombuffer(bytes(data) + b'\0\0\0', dtype=np.uint8)
+    total_bits = len(data) * 8
+    runs = []
+    run_start = 0
+    while True:
+        code_bits = run_start + lzw_code_offsets
+        count = int(np.searchsorted(code_bits + lzw_code_widths, total_bits, side='right'))
+        code_bits = code_bits[:count]
+        widths = lzw_code_widths[:count]
+        byte_index = code_bits >> 3
+        window = (packed[byte_index].astype(np.int64) << 16) | (packed[byte_index + 1].astype(np.int64) << 8) | \
+            packed[byte_index + 2]
+        codes = (window >> (24 - widths - (code_bits & 7))) & ((1 << widths) - 1)
+        stops = np.flatnonzero((codes == 256) | (codes == 257))
+        run_end = int(stops[0]) if stops.size else count
+        run = codes[:run_end]
+        # a code can be a byte or an entry added by an earlier code of the run (or the code before it)
+        if ((run >= 258) & (run - 258 >= np.arange(run_end))).any() or (run_end and run[0] > 255):
+            raise ValueError("LZW data has a code that is not in the code table")
+        if run_end:
+            runs.append(run.astype(np.int32))
+        if not stops.size:
+            if count == lzw_max_codes:
+                raise ValueError("LZW data has no clear code before the code table is full")
+            return runs
+        if codes[run_end] == 257:
+            return runs
+        run_start = int(code_bits[run_end] + widths[run_end])
+
+
+###############################################################################################################
+# function to decode TIFF LZW data with numpy
+# the table entry added by code i of a run is the output of code i and the first byte of the output of code i + 1,
+# so every output byte is either a literal byte code or a copy of an earlier output byte of the run
+# the length of each output and the byte each copy comes from are found by pointer jumping, in a few passes over
+# whole arrays instead of a python loop over every code
+# runs are decoded in batches of about lzw_decode_batch_bytes, so the index arrays stay a small multiple of that
+
+def lzw_decode_numpy(data):
+    runs = read_lzw_codes(data)
+    if not runs:
+        return b''
+    run_sizes = [run.size for run in runs]
+    codes = np.concatenate(runs)
+    literal = codes < 256
+    run_starts = np.repeat(np.cumsum([0] + run_sizes[:-1]).astype(np.int32), run_sizes)
+    parent = np.where(literal, np.arange(codes.size, dtype=np.int32), run_starts + codes - 258)
+
+    # output length of each code, one more than the length of the code whose output its table entry extends
+    lengths = (~literal).astype(np.int32)
+    pointer = parent
+    while True:
+        next_pointer = pointer[pointer]
+        if np.array_equal(next_pointer, pointer):
+            break
+        lengths += lengths[pointer]
+        pointer = next_pointer
+    lengths += 1
+
+    output = []
+    first_run = 0
+    run_ends = np.cumsum(run_sizes)
+    run_bytes = np.add.reduceat(lengths.astype(np.int64), run_ends - run_sizes)
+    batch_ends = np.cumsum(run_bytes)
+    while first_run < len(runs):
+        last_run = max(first_run + 1, int(np.searchsorted(batch_ends, batch_ends[first_run] - run_bytes[first_run] +
+                                                           lzw_decode_batch_bytes, side='right')))
+        code_start = run_ends[first_run] - run_sizes[first_run]
+        code_end = run_ends[last_run - 1]
+        output.append(_decode_lzw_batch(codes[code_start:code_end], literal[code_start:code_end],
+                                        parent[code_start:code_end] - code_start, lengths[code_start:code_end]))
+        first_run = last_run
+    return b''.join(output)
+
+
+# decode a batch of whole runs, given the codes, which codes are bytes, the code each code extends (itself for bytes)
+# and the output length of each code
+def _decode_lzw_batch(codes, literal, parent, lengths):
+    ends = np.cumsum(lengths, dtype=np.int64)
+    offsets = (ends - lengths).astype(np.int32)
+    # output byte k of a code is byte k of the code it extends, the last byte is the first byte of the next code
+    # after that one
+    source = np.arange(int(ends[-1]), dtype=np.int32)
+    source += np.repeat(offsets[parent] - offsets, lengths)
+    copied = ~literal
+    source[ends[copied] - 1] = offsets[parent[copied] + 1]
+    while True:
+        next_source = source[source]
+        if np.array_equal(next_source, source):
+            break
+        source = next_source
+    return np.repeat(codes.astype(np.uint8), lengths)[source].tobytes()
@@ -0,0 +1,148 @@
+# Automated test module for the native GeoTIFF reader used by the Stand Condition Tool Raster Converter project script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_GEOTIFF
+import SCT_TEST_DATA
+
+
+# test that LZW data is decoded the same by the numpy decoder and the compiled one, and that LZW tiles with the
+# horizontal and floating point predictors read back as the data written, with and without imagecodecs
+def test_read_lzw_predictors():
+    test_folder = tempfile.mkdtemp()
+    compiled_codecs = SCT_GEOTIFF.imagecodecs
+    try:
+        random_state = np.random.RandomState(2)
+        for data in (b'', b'a', random_state.bytes(5000), bytes(bytearray(300000)),
+                     random_state.randint(0, 3, 100000).astype(np.uint8).tobytes()):
+            assert SCT_GEOTIFF.lzw_decode_numpy(SCT_TEST_DATA.lzw_encode(data)) == data
+        try:
+            SCT_GEOTIFF.lzw_decode_numpy(b'\x80\x10e\x90\x10')  # clear, 'A', 300 (not in the table yet), end
+            assert False, "bad LZW code not rejected"
+        except ValueError:
+            pass
+
+        floats = np.cumsum(random_state.normal(0, 50, (6, 37, 29)), axis=2) - 100.0
+        floats[0, 0, 0] = np.nan
+        integers = np.cumsum(random_state.randint(-50, 50, (6, 37, 29)), axis=2)
+        layouts = [(floats.astype(np.float32), {'rows_per_strip': 5, 'predictor': 3}),
+                   (floats, {'tile_size': 16, 'planar': 2, 'predictor': 3}),
+                   (integers.astype(np.int16), {'rows_per_strip': 4, 'predictor': 2}),
+                   ((integers + 40000).astype(np.uint16), {'tile_size': 16, 'predictor': 2}),
+                   (integers.astype(np.int32), {'rows_per_strip': 37, 'planar': 2, 'predictor': 2}),
+                   (floats.astype(np.float32), {'tile_size': 16})]
+        for layout_index, (bands, layout) in enumerate(layouts):
+            tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "lzw%d.tif" % layout_index),
+                                                         bands, compress='lzw', **layout)
+            for codecs in (compiled_codecs, None):
+                SCT_GEOTIFF.imagecodecs = codecs
+                with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+                    assert raster.compression == 5 and raster.predictor == layout.get('predictor', 1)
+                    assert np.array_equal(raster.read_window(0, 37), bands, equal_nan=True)
+                    assert np.array_equal(raster.read_window(7, 20, 3, 17), bands[:, 7:27, 3:20], equal_nan=True)
+    finally:
+        SCT_GEOTIFF.imagecodecs = compiled_codecs
+        shutil.rmtree(test_folder)
+
+
+# test that the pre-flight metadata (bands, data type, size, geotransform, EPSG code) is read from the tags
+def test_read_geotiff_metadata():
+    test_folder = tempfile.mkdtemp()
+    try:
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_test.tif"),
+                                                     np.zeros((6, 20, 30), dtype=np.float64),
+                                                     origin=(140.5, -27.5), pixel_size=0.00025, nodata=-9999,
+                                                     tile_size=16)
+        metadata = SCT_GEOTIFF.read_geotiff_metadata(tiff_path)
+        assert metadata['bands'] == 6 and metadata['data_type'] == 'float64'
+        assert (metadata['samples'], metadata['lines']) == (30, 20)
+        assert metadata['geotransform'] == (140.5, 0.00025, 0.0, -27.5, 0.0, -0.00025)
+        assert metadata['epsg'] == 4326 and metadata['nodata'] == -9999.0
+
+        albers_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "albers.tif"),
+                                                       np.zeros((20, 30), dtype=np.float32),
+                                                       origin=(1000000.0, -3000000.0), pixel_size=30.0, epsg=3577)
+        metadata = SCT_GEOTIFF.read_geotiff_metadata(albers_path)
+        assert metadata['bands'] == 1 and metadata['data_type'] == 'float32' and metadata['epsg'] == 3577
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that files which are not TIFFs are rejected
+def test_read_geotiff_metadata_not_tiff():
+    test_folder = tempfile.mkdtemp()
+    try:
+        not_tiff_path = os.path.join(test_folder, "not_a.tif")
+        with open(not_tiff_path, 'wb') as not_tiff_file:
+            not_tiff_file.write(b'ENVI\n')
+        try:
+            SCT_GEOTIFF.read_geotiff_metadata(not_tiff_path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("non TIFF file was read")
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that GeoTIFFs written a block at a time (blocks not lined up with the strips) read back the same, as classic
+# TIFF and BigTIFF, compressed or not
+def test_geotiff_writer():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bands = np.random.RandomState(0).uniform(-100, 10000, size=(6, 53, 37)).astype(np.float32)
+        bands[2, 5, 6] = np.nan
+        geotransform = (143.0, 0.00025, 0.0, -34.0, 0.0, -0.00025)
+        for bigtiff, compress in [(False, False), (False, True), (True, False), (True, True)]:
+            tiff_path = os.path.join(test_folder, "written.tif")
+            with SCT_GEOTIFF.GeoTiffWriter(tiff_path, 37, 53, 6, np.float32, geotransform, nodata=-9999,
+                                           rows_per_strip=5, compress=compress, bigtiff=bigtiff) as writer:
+                for row_start, row_end in [(0, 7), (7, 30), (30, 53)]:
+                    writer.write_rows(bands[:, row_start:row_end])
+            with SCT_GEOTIFF.GeoTiffRaster(tiff_path) as raster:
+                assert raster.bigtiff == bigtiff and raster.chunk_rows == 5
+                assert np.array_equal(raster.read_rows(0, 53), bands, equal_nan=True)
+                assert raster.metadata() == {'bands': 6, 'data_type': 'float32', 'samples': 37, 'lines': 53,
+                                             'geotransform': geotransform, 'epsg': 4326, 'nodata': -9999.0,
+                                             'compression': 8 if compress else 1}
+
+        writer = SCT_GEOTIFF.GeoTiffWriter(tiff_path, 37, 53, 6, np.float32, geotransform)
+        writer.write_rows(bands[:, :10])
+        try:
+            writer.close()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("incomplete GeoTIFF was closed without an error")
+        writer.abort()
+        assert not os.path.exists(tiff_path)
+
+        # an error while writing removes the unfinished file, abort keeps a finished one
+        try:
+            with SCT_GEOTIFF.GeoTiffWriter(tiff_path, 37, 53, 6, np.float32, geotransform) as writer:
+                writer.write_rows(bands[:, :10])
+                raise RuntimeError("stopped")
+        except RuntimeError:
+            pass
+        assert not os.path.exists(tiff_path)
+        with SCT_GEOTIFF.GeoTiffWriter(tiff_path, 37, 53, 6, np.float32, geotransform) as writer:
+            writer.write_rows(bands)
+        writer.abort()
+        assert os.path.exists(tiff_path)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_read_lzw_predictors()
+    test_read_geotiff_metadata()
+    test_read_geotiff_metadata_not_tiff()
+    test_geotiff_writer()
+    print("Everything passed")
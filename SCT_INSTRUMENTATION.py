@@ -0,0 +1,261 @@
+# Module to time and profile the stages of a Stand Condition Tool run
+# Spans time a stage (describe, convert, header, statistics, ...) and counters add up values such as bytes read and
+# written, both are written to a JSON lines run report as the run goes so a report is left even if the run is stopped
+# Per file stages are timed into a dictionary that travels with the file result, so stages run in multiprocessing
+# workers are reported by the main process with the file they belong to
+# Nothing is recorded until start_run() is called, while no run is being recorded span() returns one shared context
+# manager that does nothing, so the instrumentation costs a function call per stage when it is off
+# A run can also be profiled with cProfile (stats of the main process written next to the report) or tracemalloc
+# (python 3, peak traced memory and the top allocation sites added to the report)
+# Worker processes are profiled with cProfile by wrapping their tasks in profile_worker(), each worker writes its own
+# stats next to the report with its pid in the name, tracemalloc only covers the main process
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import collections
+import json
+import multiprocessing
+import os
+import socket
+import time
+
+# high resolution timer for durations, time.time on python 2
+timer = getattr(time, 'perf_counter', time.time)
+
+instrumentation_profilers = (None, 'cprofile', 'tracemalloc')
+instrumentation_tracemalloc_top = 20  # allocation sites listed in the report
+
+_run = None  # the RunRecorder of the run being recorded, None when instrumentation is off
+_worker_profile = None  # the cProfile of a worker process and its pid, kept across the tasks of the worker
+
+
+###############################################################################################################
+# Class recording one run to a JSON lines report
+# every line is a JSON object with a type of "run" (first line), "span", "file" or "summary" (last line)
+
+class RunRecorder(object):
+
+    def __init__(self, report_path, profiler=None):
+        if profiler not in instrumentation_profilers:
+            raise ValueError("unknown profiler %s, use one of %s" % (profiler, instrumentation_profilers))
+        self.report_path = report_path
+        self.profiler = profiler
+        self.pid = os.getpid()
+        self.start_time = timer()
+        self.stage_seconds = collections.Counter()
+        self.stage_counts = collections.Counter()
+        self.counters = collections.Counter()
+        self._profile = None
+        self._report_file = open(report_path, 'w')
+        self.write_line({'type': 'run', 'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': socket.gethostname(),
+                         'pid': self.pid, 'profiler': profiler})
+        if profiler == 'cprofile':
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif profiler == 'tracemalloc':
+            try:
+                import tracemalloc
+            except ImportError:
+                self.close()
+                raise ValueError("tracemalloc profiling needs python 3.4 or later")
+            tracemalloc.start()
+
+    # write one report line, flushed so the report is complete up to the last stage if the run is stopped
+    def write_line(self, values):
+        self._report_file.write(json.dumps(values, sort_keys=True) + "\n")
+        self._report_file.flush()
+
+    # add a timed stage, path is the file the stage worked on (None for stages of the whole run)
+    def add_span(self, stage, path, start, seconds):
+        self.stage_seconds[stage] += seconds
+        self.stage_counts[stage] += 1
+        self.write_line({'type': 'span', 'stage': stage, 'path': path, 'start': round(start - self.start_time, 6),
+                         'seconds': round(seconds, 6)})
+
+    # add the result of one file (see SCT_CONVERT_RASTER_TO_ENVI.process_input_raster), with its stage timings
+    def add_file(self, result):
+        stages = result.get('stages', {})
+        for stage, seconds in stages.items():
+            self.stage_seconds[stage] += seconds
+            self.stage_counts[stage] += 1
+        for counter in ('bytes_read', 'bytes_written'):
+            self.counters[counter] += result.get(counter, 0)
+        self.counters['files_' + result['status']] += 1
+        self.write_line({'type': 'file', 'path': result['input_raster'], 'status': result['status'],
+                         'message': result.get('message', ''), 'seconds': round(result.get('seconds', 0.0), 6),
+                         'stages': dict((stage, round(seconds, 6)) for stage, seconds in stages.items()),
+                         'bytes_read': result.get('bytes_read', 0), 'bytes_written': result.get('bytes_written', 0),
+                         'read_seconds': round(result.get('read_seconds', 0.0), 6),
+                         'write_seconds': round(result.get('write_seconds', 0.0), 6),
+                         'block_count': result.get('block_count', 0), 'empty_blocks': result.get('empty_blocks', 0)})
+
+    # stop profiling and write the summary line
+    # output is the summary dictionary
+    def finish(self):
+        seconds = timer() - self.start_time
+        summary = {'type': 'summary', 'report': self.report_path, 'seconds': round(seconds, 6),
+                   'stages': dict((stage, {'seconds': round(self.stage_seconds[stage], 6),
+                                           'count': self.stage_counts[stage]}) for stage in self.stage_seconds),
+                   'counters': dict(self.counters)}
+        if self.counters['bytes_read'] and self.stage_seconds['convert']:
+            summary['convert_mb_per_second'] = round(self.counters['bytes_read'] / (1024.0 * 1024.0) /
+                                                     self.stage_seconds['convert'], 3)
+        if self._profile is not None:
+            self._profile.disable()
+            profile_path = os.path.splitext(self.report_path)[0] + ".prof"
+            self._profile.dump_stats(profile_path)
+            summary['profile'] = profile_path
+        elif self.profiler == 'tracemalloc':
+            import tracemalloc
+            summary['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:instrumentation_tracemalloc_top]
+            summary['tracemalloc_top'] = [{'location': "%s:%d" % (statistic.traceback[0].filename,
+                                                                  statistic.traceback[0].lineno),
+                                           'bytes': statistic.size, 'count': statistic.count}
+                                          for statistic in statistics]
+            tracemalloc.stop()
+        self.write_line(summary)
+        self.close()
+        return summary
+
+    def close(self):
+        if not self._report_file.closed:
+            self._report_file.close()
+
+
+###############################################################################################################
+# Class timing one stage, made by span()
+# the time taken is added to the timings dictionary if one is given, otherwise it is recorded in the run report
+
+class Span(object):
+
+    def __init__(self, stage, path=None, timings=None):
+        self.stage = stage
+        self.path = path
+        self.timings = timings
+        self.start = None
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = timer() - self.start
+        if self.timings is not None:
+            self.timings[self.stage] = self.timings.get(self.stage, 0.0) + seconds
+        elif _run is not None and _run.pid == os.getpid():  # workers do not write to the report of the main process
+            _run.add_span(self.stage, self.path, self.start, seconds)
+        return False
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+###############################################################################################################
+# function to time a stage, for use as a with statement
+# inputs are the stage name, the file it works on and the timings dictionary of a file result (per file stages are
+# always timed, so they are reported even when the file was converted by a worker process)
+# output is a Span, or a context manager that does nothing when no run is being recorded and no timings are kept
+
+def span(stage, path=None, timings=None):
+    if _run is None and timings is None:
+        return _null_span
+    return Span(stage, path, timings)
+
+
+###############################################################################################################
+# Class profiling the tasks of a worker process with cProfile, made by profile_worker()
+# the stats of every task the worker has run are written when each task ends, as pool workers can be stopped without
+# running any exit handlers
+
+class WorkerProfile(object):
+
+    def __init__(self, report_path):
+        self.profile_path = get_worker_profile_path(report_path)
+
+    def __enter__(self):
+        global _worker_profile
+        if _worker_profile is None or _worker_profile[1] != os.getpid():
+            import cProfile
+            _worker_profile = (cProfile.Profile(), os.getpid())
+        _worker_profile[0].enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        _worker_profile[0].disable()
+        _worker_profile[0].dump_stats(self.profile_path)
+        return False
+
+
+###############################################################################################################
+# function to get the path the cProfile stats of this worker process are written to, next to the run report
+
+def get_worker_profile_path(report_path):
+    return "%s_%d.prof" % (os.path.splitext(report_path)[0], os.getpid())
+
+
+###############################################################################################################
+# function to profile a task run in a worker process, for use as a with statement
+# inputs are the report path of the run and the profiler
+# output is a WorkerProfile in a worker process when the profiler is "cprofile", otherwise a context manager that
+# does nothing (the main process is profiled by the run itself)
+
+def profile_worker(report_path, profiler):
+    if profiler != 'cprofile' or multiprocessing.current_process().name == 'MainProcess':
+        return _null_span
+    return WorkerProfile(report_path)
+
+
+###############################################################################################################
+# function to add to a counter of the run, does nothing when no run is being recorded
+
+def count(counter, value=1):
+    if _run is not None:
+        _run.counters[counter] += value
+
+
+###############################################################################################################
+# function to add the result of one file to the run report, does nothing when no run is being recorded
+
+def record_file(result):
+    if _run is not None:
+        _run.add_file(result)
+
+
+###############################################################################################################
+# functions to start and finish recording a run
+# start_run inputs are the report path and the profiler (None, "cprofile" or "tracemalloc")
+# finish_run output is the summary dictionary, None if no run was being recorded
+
+def start_run(report_path, profiler=None):
+    global _run
+    finish_run()
+    _run = RunRecorder(report_path, profiler)
+    return _run
+
+
+def finish_run():
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+    return run.finish()
+
+
+###############################################################################################################
+# function to read a run report
+# output is a list of the report lines as dictionaries
+
+def read_run_report(report_path):
+    with open(report_path) as report_file:
+        return [json.loads(line) for line in report_file if line.strip()]
@@ -0,0 +1,148 @@
+# Automated test module for the run report and profiling of the Stand Condition Tool Raster Converter project script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import glob
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import SCT_CONVERT_RASTER_TO_ENVI
+import SCT_INSTRUMENTATION
+import SCT_TEST_DATA
+
+
+# test that spans cost nothing while no run is recorded, but per file timings are always kept
+def test_span_without_run():
+    assert SCT_INSTRUMENTATION.finish_run() is None
+    assert SCT_INSTRUMENTATION.span('convert') is SCT_INSTRUMENTATION.span('header')
+    with SCT_INSTRUMENTATION.span('convert'):
+        pass
+    SCT_INSTRUMENTATION.count('bytes_read', 10)
+    SCT_INSTRUMENTATION.record_file({'input_raster': 'a.tif', 'status': 'converted'})
+    timings = {}
+    for _ in range(2):
+        with SCT_INSTRUMENTATION.span('convert', 'a.tif', timings):
+            pass
+    assert list(timings.keys()) == ['convert'] and timings['convert'] >= 0
+
+
+# test that a batch run writes a report with a line per run stage and per file, and a summary of all the stages
+def test_run_report():
+    test_folder = tempfile.mkdtemp()
+    try:
+        input_rasters = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_3_%d.tif" % index),
+                                                          np.full((6, 20, 30), 100.0, dtype=np.float32),
+                                                          epsg=4326 if index else 3857)
+                         for index in range(3)]
+        output_folder = os.path.join(test_folder, "output")
+        os.mkdir(output_folder)
+        report_path = os.path.join(output_folder, "SCT_run_report.jsonl")
+
+        SCT_INSTRUMENTATION.start_run(report_path)
+        with SCT_INSTRUMENTATION.span('batch', output_folder):
+            results = SCT_CONVERT_RASTER_TO_ENVI.run_batch(input_rasters, output_folder)
+        SCT_INSTRUMENTATION.count('tiles_checked', 3)
+        summary = SCT_INSTRUMENTATION.finish_run()
+        assert SCT_INSTRUMENTATION.span('batch') is SCT_INSTRUMENTATION._null_span
+
+        converted = [result for result in results if result['status'] == 'converted'][0]
+        assert sorted(converted['stages']) == ['convert', 'describe', 'header', 'validate']
+        assert converted['bytes_read'] == 6 * 20 * 30 * 4 and converted['bytes_written'] == 6 * 20 * 30 * 2
+        assert converted['read_seconds'] >= 0 and converted['write_seconds'] >= 0
+
+        report = SCT_INSTRUMENTATION.read_run_report(report_path)
+        assert [line['type'] for line in report] == ['run', 'file', 'file', 'file', 'span', 'summary']
+        assert report[-1] == summary and summary['report'] == report_path
+        assert sorted(line['status'] for line in report if line['type'] == 'file') == ['converted', 'converted',
+                                                                                       'skipped']
+        assert report[4]['stage'] == 'batch' and report[4]['path'] == output_folder
+        assert summary['stages']['describe']['count'] == 3 and summary['stages']['convert']['count'] == 2
+        assert summary['stages']['batch']['count'] == 1
+        assert summary['counters'] == {'bytes_read': 2 * 6 * 20 * 30 * 4, 'bytes_written': 2 * 6 * 20 * 30 * 2,
+                                       'files_converted': 2, 'files_skipped': 1, 'tiles_checked': 3}
+        assert summary['convert_mb_per_second'] > 0
+    finally:
+        SCT_INSTRUMENTATION.finish_run()
+        shutil.rmtree(test_folder)
+
+
+# test that the optional profilers add their results to the report
+def test_run_profilers():
+    test_folder = tempfile.mkdtemp()
+    try:
+        report_path = os.path.join(test_folder, "SCT_run_report.jsonl")
+        SCT_INSTRUMENTATION.start_run(report_path, 'cprofile')
+        with SCT_INSTRUMENTATION.span('sum'):
+            sum(range(1000))
+        summary = SCT_INSTRUMENTATION.finish_run()
+        assert summary['profile'] == os.path.join(test_folder, "SCT_run_report.prof")
+        assert os.path.getsize(summary['profile']) > 0
+
+        if sys.version_info >= (3, 4):
+            SCT_INSTRUMENTATION.start_run(report_path, 'tracemalloc')
+            blocks = [np.ones(100000) for _ in range(3)]
+            summary = SCT_INSTRUMENTATION.finish_run()
+            assert len(blocks) == 3 and summary['tracemalloc_peak_bytes'] >= 3 * 800000
+            assert summary['tracemalloc_top'][0]['bytes'] >= 800000
+
+        try:
+            SCT_INSTRUMENTATION.start_run(report_path, 'timeit')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("unknown profiler was accepted")
+    finally:
+        SCT_INSTRUMENTATION.finish_run()
+        shutil.rmtree(test_folder)
+
+
+# test that conversion workers write their own cProfile stats, and that a task run in the main process does not
+def test_worker_profiles():
+    test_folder = tempfile.mkdtemp()
+    saved_profiler = SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_profiler
+    try:
+        input_rasters = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_3_%d.tif" % index),
+                                                          np.full((6, 20, 30), 100.0, dtype=np.float32))
+                         for index in range(4)]
+        output_folder = os.path.join(test_folder, "output")
+        os.mkdir(output_folder)
+        tasks = [(input_raster, output_folder, None) for input_raster in input_rasters]
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_profiler = 'cprofile'
+        assert SCT_CONVERT_RASTER_TO_ENVI.process_input_raster_task(tasks[0])['status'] == 'converted'
+        assert glob.glob(os.path.join(output_folder, "*.prof")) == []
+
+        pool = SCT_CONVERT_RASTER_TO_ENVI.create_process_pool(2)
+        try:
+            results = pool.map(SCT_CONVERT_RASTER_TO_ENVI.process_input_raster_task, tasks, 1)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        assert [result['status'] for result in results] == ['converted'] * 4
+        profile_paths = glob.glob(os.path.join(output_folder, "SCT_run_report_*.prof"))
+        assert 1 <= len(profile_paths) <= 2
+        profiled_calls = 0
+        for profile_path in profile_paths:
+            stats = pstats.Stats(profile_path)
+            profiled_calls += sum(stat[1] for function, stat in stats.stats.items()
+                                  if function[2] == 'process_input_raster')
+        assert profiled_calls == 4
+    finally:
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_profiler = saved_profiler
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_span_without_run()
+    test_run_report()
+    test_run_profilers()
+    test_worker_profiles()
+    print("Everything passed")
@@ -0,0 +1,175 @@
+# Module to build reduced resolution overviews (pyramids) of the Stand Condition Tool 16 bit BIL files without arcpy
+# Every level (2, 4, 8 ... times smaller) is built from a single streaming pass over the base raster, either from the
+# blocks of rows as the converter writes them or by reading an existing bil file a block at a time
+# Each level is written as its own BIL file with an ENVI header, so it can be opened as a quick look image
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import os
+
+import numpy as np
+
+import SCT_BIL_READER
+import SCT_ENVI_HEADER
+
+# overviews are built until the next level would have fewer than this many rows or columns
+overview_min_size = 256
+
+# default memory allowed for one block of base rows when building overviews from an existing bil file
+overview_default_block_memory_bytes = 64 * 1024 * 1024
+
+overview_resampling_methods = ('nearest', 'average')
+
+
+###############################################################################################################
+# function to get the overview reduction factors for a raster size
+# output is a list of factors (2, 4, 8 ...), empty if the raster is too small for any overviews
+
+def get_overview_factors(samples, lines, min_size=overview_min_size):
+    factors = []
+    factor = 2
+    while min(samples, lines) // factor >= min_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+###############################################################################################################
+# function to get the file path of one overview level of a bil file
+
+def get_overview_path(bil_path, overview_folder, factor):
+    bil_base_fn = os.path.splitext(os.path.basename(bil_path))[0]
+    return os.path.join(overview_folder, "%s_ovr%d.BIL" % (bil_base_fn, factor))
+
+
+###############################################################################################################
+# Class building all the overview levels of a raster from successive blocks of base rows
+# inputs are the base bil path (used to name the overviews), its metadata dictionary (samples, lines, bands, ulxmap,
+# ulymap, xdim, ydim, data_type), the folder to write the overviews into and the resampling method
+# blocks are passed to update() in BIL order (rows, bands, columns) from the top of the raster down, in any number
+# of rows, finish() writes the last rows and the ENVI headers
+
+class OverviewBuilder(object):
+
+    def __init__(self, bil_path, metadata, overview_folder, resampling='nearest', min_size=overview_min_size):
+        if resampling not in overview_resampling_methods:
+            raise ValueError("unknown overview resampling method %s" % resampling)
+        self.metadata = metadata
+        self.resampling = resampling
+        self.factors = get_overview_factors(metadata['samples'], metadata['lines'], min_size)
+        # blocks are processed in multiples of the largest factor so every level gets whole cells
+        self.row_multiple = self.factors[-1] if self.factors else 1
+        self._carry = None
+        self._files = []
+        self.overview_paths = [get_overview_path(bil_path, overview_folder, factor) for factor in self.factors]
+        if self.factors and not os.path.isdir(overview_folder):
+            os.makedirs(overview_folder)
+        try:
+            for overview_path in self.overview_paths:
+                self._files.append(open(overview_path, 'wb'))
+        except Exception:
+            self.close()
+            raise
+
+    # close the overview files without writing headers, for use when the conversion fails
+    def close(self):
+        for overview_file in self._files:
+            overview_file.close()
+        self._files = []
+
+    # add the next block of base rows
+    def update(self, block, nodata_value):
+        if not self.factors:
+            return
+        if self._carry is not None:
+            block = np.concatenate((self._carry, block), axis=0)
+            self._carry = None
+        whole_rows = block.shape[0] - block.shape[0] % self.row_multiple
+        if whole_rows < block.shape[0]:
+            self._carry = block[whole_rows:].copy()
+        if whole_rows:
+            self._write_levels(block[:whole_rows], nodata_value)
+
+    # write the remaining rows and the ENVI headers, output is the list of overview files written
+    def finish(self, nodata_value):
+        if self._carry is not None:
+            self._write_levels(self._carry, nodata_value)
+            self._carry = None
+        self.close()
+        for factor, overview_path in zip(self.factors, self.overview_paths):
+            SCT_ENVI_HEADER.write_envi_header(overview_path, self.get_level_metadata(factor))
+        return list(self.overview_paths)
+
+    # get the metadata dictionary of one overview level, the upper left pixel centre moves with the pixel size
+    def get_level_metadata(self, factor):
+        metadata = self.metadata
+        return {'samples': -(-metadata['samples'] // factor),
+                'lines': -(-metadata['lines'] // factor),
+                'bands': metadata['bands'],
+                'ulxmap': metadata['ulxmap'] + metadata['xdim'] * (factor - 1) / 2.0,
+                'ulymap': metadata['ulymap'] - metadata['ydim'] * (factor - 1) / 2.0,
+                'xdim': metadata['xdim'] * factor,
+                'ydim': metadata['ydim'] * factor,
+                'data_type': metadata.get('data_type', SCT_ENVI_HEADER.envi_data_type_int16)}
+
+    # reduce a block of base rows (a multiple of the largest factor, or the last rows of the raster) to every level
+    def _write_levels(self, block, nodata_value):
+        for factor, overview_file in zip(self.factors, self._files):
+            if self.resampling == 'nearest':
+                level = reduce_block_nearest(block, factor)
+            else:
+                level = reduce_block_average(block, factor, nodata_value)
+            level.astype(block.dtype.newbyteorder('<'), copy=False).tofile(overview_file)
+
+
+###############################################################################################################
+# function to reduce a block in BIL order (rows, bands, columns) by a factor, taking the pixel nearest the centre of
+# each factor x factor cell (cells cut off at the edge of the raster take their nearest pixel inside it)
+
+def reduce_block_nearest(block, factor):
+    rows, bands, cols = block.shape
+    row_index = np.minimum(np.arange(-(-rows // factor)) * factor + factor // 2, rows - 1)
+    col_index = np.minimum(np.arange(-(-cols // factor)) * factor + factor // 2, cols - 1)
+    return block[row_index][:, :, col_index]
+
+
+###############################################################################################################
+# function to reduce a block in BIL order (rows, bands, columns) by a factor, averaging the pixels of each
+# factor x factor cell that are not NODATA (cells with no valid pixels are NODATA)
+
+def reduce_block_average(block, factor, nodata_value):
+    rows, bands, cols = block.shape
+    level_rows = -(-rows // factor)
+    level_cols = -(-cols // factor)
+    padded = np.full((level_rows * factor, bands, level_cols * factor), nodata_value, dtype=block.dtype)
+    padded[:rows, :, :cols] = block
+    valid = padded != nodata_value
+    cells = (level_rows, factor, bands, level_cols, factor)
+    sums = np.where(valid, padded, 0).astype(np.float64).reshape(cells).sum(axis=(1, 4))
+    counts = valid.reshape(cells).sum(axis=(1, 4))
+    level = np.full((level_rows, bands, level_cols), nodata_value, dtype=block.dtype)
+    has_values = counts > 0
+    level[has_values] = np.rint(sums[has_values] / counts[has_values])
+    return level
+
+
+###############################################################################################################
+# function to build the overviews of an existing bil file with an ESRI or ENVI header
+# the base raster is read once, a block of rows at a time
+# inputs are the bil path, the overview folder, the resampling method, the NODATA value and the block memory budget
+# output is the list of overview files written
+
+def build_overviews(bil_path, overview_folder, resampling='nearest', nodata_value=-32768,
+                    block_memory_bytes=overview_default_block_memory_bytes):
+    with SCT_BIL_READER.BilRaster(bil_path) as base:
+        builder = OverviewBuilder(bil_path, base.metadata, overview_folder, resampling)
+        row_bytes = base.bands * base.samples * base.dtype.itemsize * 4  # block and working copies
+        block_rows = max(builder.row_multiple,
+                         int(block_memory_bytes // row_bytes) // builder.row_multiple * builder.row_multiple)
+        try:
+            for row_start in range(0, base.lines, block_rows):
+                builder.update(base.read_window(row_start, min(block_rows, base.lines - row_start)), nodata_value)
+        except Exception:
+            builder.close()
+            raise
+    return builder.finish(nodata_value)
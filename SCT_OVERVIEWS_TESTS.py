@@ -0,0 +1,85 @@
+# Automated test module for the native overview builder used by the Stand Condition Tool Raster Converter project
+# script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_BIL_CONVERTER
+import SCT_ENVI_HEADER
+import SCT_OVERVIEWS
+import SCT_TEST_DATA
+
+test_nodata = -32768
+
+
+# test that overview levels stop before a level would be smaller than the minimum size
+def test_get_overview_factors():
+    assert SCT_OVERVIEWS.get_overview_factors(9472, 9472) == [2, 4, 8, 16, 32]
+    assert SCT_OVERVIEWS.get_overview_factors(600, 300) == []
+    assert SCT_OVERVIEWS.get_overview_factors(40, 33, min_size=8) == [2, 4]
+
+
+# test nearest and average reduction of a block, including NODATA pixels and cells cut off at the edge
+def test_reduce_block():
+    block = np.arange(5 * 2 * 7, dtype=np.int16).reshape(5, 2, 7)
+    nearest = SCT_OVERVIEWS.reduce_block_nearest(block, 2)
+    assert nearest.shape == (3, 2, 4)
+    assert np.array_equal(nearest[:, 0, :], block[[1, 3, 4], 0, :][:, [1, 3, 5, 6]])
+
+    block[0, 0, 0] = test_nodata
+    block[0:2, 1, 0:2] = test_nodata
+    average = SCT_OVERVIEWS.reduce_block_average(block, 2, test_nodata)
+    assert average.shape == (3, 2, 4)
+    assert average[0, 0, 0] == np.rint((block[0, 0, 1] + block[1, 0, 0] + block[1, 0, 1]) / 3.0)
+    assert average[0, 1, 0] == test_nodata
+    assert average[2, 0, 3] == block[4, 0, 6]
+
+
+# test that overviews built while converting (in blocks that do not line up with the levels) match overviews built
+# from the finished bil file in a single read, and match reducing the whole raster at once
+def test_inline_and_deferred_overviews():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bands = np.random.RandomState(1).uniform(0, 10000, size=(6, 530, 515)).astype(np.float32)
+        bands[:, :40, :] = np.nan
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "tile.tif"), bands, rows_per_strip=3)
+        for resampling in SCT_OVERVIEWS.overview_resampling_methods:
+            bil_path = os.path.join(test_folder, "tile.BIL")
+            inline_folder = os.path.join(test_folder, "inline_" + resampling)
+            metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(tiff_path, bil_path, block_memory_bytes=200000,
+                                                                overview_folder=inline_folder,
+                                                                overview_resampling=resampling)
+            assert [os.path.basename(path) for path in metadata['overviews']] == ["tile_ovr2.BIL"]
+            SCT_ENVI_HEADER.write_envi_header(bil_path, metadata)
+
+            deferred_folder = os.path.join(test_folder, "deferred_" + resampling)
+            deferred_paths = SCT_OVERVIEWS.build_overviews(bil_path, deferred_folder, resampling,
+                                                           block_memory_bytes=100000)
+            base = np.fromfile(bil_path, dtype='<i2').reshape(530, 6, 515)
+            if resampling == 'nearest':
+                expected = SCT_OVERVIEWS.reduce_block_nearest(base, 2)
+            else:
+                expected = SCT_OVERVIEWS.reduce_block_average(base, 2, test_nodata)
+            for overview_path in metadata['overviews'] + deferred_paths:
+                assert np.array_equal(np.fromfile(overview_path, dtype='<i2').reshape(265, 6, 258), expected)
+
+            level_metadata = SCT_ENVI_HEADER.read_bil_header_metadata(deferred_paths[0])
+            assert (level_metadata['lines'], level_metadata['samples']) == (265, 258)
+            assert level_metadata['xdim'] == 0.0005
+            assert abs(level_metadata['ulxmap'] - (143.0 + 0.00025)) < 1e-12
+            assert abs(level_metadata['ulymap'] - (-34.0 - 0.00025)) < 1e-12
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_get_overview_factors()
+    test_reduce_block()
+    test_inline_and_deferred_overviews()
+    print("Everything passed")
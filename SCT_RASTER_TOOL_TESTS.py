@@ -5,6 +5,14 @@
 # Required imports
 
 from SCT_CONVERT_RASTER_TO_ENVI import *
+import SCT_BIL_READER
+import SCT_CONVERT_RASTER_TO_ENVI
+import SCT_TEST_DATA
+import SCT_TILE_INDEX
+import json
+import numpy as np
+import shutil
+import tempfile
 
 
 # function to confirm correct aquisition of input varables in ESRI tool or IDE mode
@@ -36,11 +44,9 @@ def test_convert_rasterinput_to_esri_bil():
         output_raster = r'\\prod.local\storage\GSS\STAND_CONDITION_TOOL_PROJECT\TOOLS\TESTDATA\output\MDB_P75_3_0000009472-0000009472.bil'
         # run convert raster function
         convert_rasterinput_to_esri_bil(input_raster, output_raster)
-        output_raster_bands = read_raster_bands(output_raster) # get new raster bands
-        pixel_format = arcpy.Describe(output_raster_bands[0]).pixelType # get new raster pixel type
-        raster_format = arcpy.Describe(output_raster).format # get new raster format
-        assert arcpy.Exists(output_raster) and (len(output_raster_bands) == 6) and (raster_format == 'BIL')\
-               and (pixel_format == 'S16')
+        with SCT_BIL_READER.BilRaster(output_raster) as output_bil: # read the new raster header, without arcpy
+            # BilRaster only opens band interleaved by line files
+            assert (output_bil.bands == 6) and (output_bil.dtype == np.dtype('<i2'))
     except Exception as err:
         printerrormsg("convert raster function error", str(err.args), str(traceback.format_exc()))
         raise(AssertionError)
@@ -51,9 +57,180 @@ def test_get_dataset_projection_factory_code():
     stand_condition_tool_data_spatial_reference_code = 4326
     assert(get_dataset_projection_factory_code(output_raster) == stand_condition_tool_data_spatial_reference_code)
 
+
+# stand in for arcpy that records the CopyRaster calls, to test which inputs are sent to CopyRaster
+class RecordingArcpy(object):
+
+    class env(object):
+        pass
+
+    def __init__(self):
+        self.copied = []
+
+    def CopyRaster_management(self, in_raster, out_rasterdataset, **parameters):
+        self.copied.append((in_raster, out_rasterdataset, parameters['format']))
+
+    def AddMessage(self, message):
+        pass
+
+    AddWarning = AddError = AddMessage
+
+
+# test that the numpy backend converts GeoTIFFs and hands other formats to CopyRaster instead of failing them
+def test_convert_non_geotiff_with_copyraster():
+    test_folder = tempfile.mkdtemp()
+    saved_arcpy = SCT_CONVERT_RASTER_TO_ENVI.arcpy
+    try:
+        tiff_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_3_0.tif"),
+                                                     np.full((6, 20, 30), 100.0, dtype=np.float32))
+        img_path = os.path.join(test_folder, "MDB_P75_3_1.img")
+        SCT_CONVERT_RASTER_TO_ENVI.arcpy = None
+        assert SCT_CONVERT_RASTER_TO_ENVI.convert_rasterinput_to_esri_bil(img_path, img_path[:-4] + ".BIL") is False
+        SCT_CONVERT_RASTER_TO_ENVI.arcpy = RecordingArcpy()
+        conversion = SCT_CONVERT_RASTER_TO_ENVI.convert_rasterinput_to_esri_bil(tiff_path, tiff_path[:-4] + ".BIL")
+        assert isinstance(conversion, dict) and conversion['lines'] == 20
+        assert SCT_CONVERT_RASTER_TO_ENVI.convert_rasterinput_to_esri_bil(img_path, img_path[:-4] + ".BIL") is True
+        assert SCT_CONVERT_RASTER_TO_ENVI.arcpy.copied == [(img_path, img_path[:-4] + ".BIL", "Esri BIL")]
+    finally:
+        SCT_CONVERT_RASTER_TO_ENVI.arcpy = saved_arcpy
+        shutil.rmtree(test_folder)
+
+
+# test that the batch worker count is limited by the number of files and the batch memory budget
+def test_get_batch_worker_count():
+    saved_settings = (SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_worker_count,
+                      SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_batch_memory_bytes,
+                      SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_pipeline_depth,
+                      SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_skip_empty,
+                      SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_reproject)
+    try:
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_worker_count = 64
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_batch_memory_bytes = \
+            2 * SCT_CONVERT_RASTER_TO_ENVI.get_worker_memory_bytes()
+        assert get_batch_worker_count(1) == 1
+        assert get_batch_worker_count(100) == min(2, multiprocessing.cpu_count())
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_batch_memory_bytes = 0
+        assert get_batch_worker_count(100) == 1
+
+        # a worker holds its pipeline buffers, the first valid block of the scan and a reprojected source window
+        block_memory_bytes = SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_block_memory_bytes
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_pipeline_depth = 2
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_skip_empty = True
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_reproject = True
+        assert SCT_CONVERT_RASTER_TO_ENVI.get_worker_memory_bytes() == block_memory_bytes * 5 // 2
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_pipeline_depth = 0
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_skip_empty = False
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_reproject = False
+        assert SCT_CONVERT_RASTER_TO_ENVI.get_worker_memory_bytes() == block_memory_bytes
+    finally:
+        (SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_worker_count,
+         SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_batch_memory_bytes,
+         SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_pipeline_depth,
+         SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_skip_empty,
+         SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_reproject) = saved_settings
+
+
+# test that the batch summary has one row per input file
+def test_write_batch_summary():
+    test_folder = tempfile.mkdtemp()
+    try:
+        results = [{'input_raster': 'b.tif', 'output_raster': 'b.BIL', 'status': 'failed', 'message': 'bad, file',
+                    'seconds': 0.5},
+                   {'input_raster': 'a.tif', 'output_raster': 'a.BIL', 'status': 'converted', 'message': '',
+                    'seconds': 1.5}]
+        summary_path = write_batch_summary(results, test_folder)
+        with open(summary_path) as summary_file:
+            rows = list(csv.DictReader(summary_file))
+        assert [row['input_raster'] for row in rows] == ['a.tif', 'b.tif']
+        assert rows[1]['status'] == 'failed' and rows[1]['message'] == 'bad, file'
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a batch converts valid GeoTIFFs without arcpy, skips invalid ones and skips converted tiles when rerun
+def test_run_batch():
+    test_folder = tempfile.mkdtemp()
+    try:
+        input_rasters = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_3_%d.tif" % index),
+                                                          np.full((6, 20, 30), 100.0 * index, dtype=np.float32))
+                         for index in range(3)]
+        input_rasters.append(SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "five_bands.tif"),
+                                                              np.zeros((5, 20, 30), dtype=np.float32)))
+        input_rasters.append(SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "mercator.tif"),
+                                                              np.zeros((6, 20, 30), dtype=np.float32), epsg=3857))
+        input_rasters.append(SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "albers.tif"),
+                                                              np.full((6, 20, 30), 100.0, dtype=np.float32),
+                                                              origin=(1170000.0, -3990000.0), pixel_size=30.0,
+                                                              epsg=3577))
+        input_rasters.append(SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "edge.tif"),
+                                                              np.full((6, 20, 30), -9999.0, dtype=np.float32),
+                                                              nodata=-9999.0))
+        output_folder = os.path.join(test_folder, "output")
+        os.mkdir(output_folder)
+
+        results = dict((os.path.basename(result['input_raster']), result['status'])
+                       for result in validate_input_rasters(input_rasters, output_folder))
+        assert results == {'MDB_P75_3_0.tif': 'valid', 'MDB_P75_3_1.tif': 'valid', 'MDB_P75_3_2.tif': 'valid',
+                           'five_bands.tif': 'skipped', 'mercator.tif': 'skipped', 'albers.tif': 'valid',
+                           'edge.tif': 'valid'}
+
+        results = dict((os.path.basename(result['input_raster']), result['status'])
+                       for result in run_batch(input_rasters, output_folder))
+        assert results == {'MDB_P75_3_0.tif': 'converted', 'MDB_P75_3_1.tif': 'converted',
+                           'MDB_P75_3_2.tif': 'converted', 'five_bands.tif': 'skipped', 'mercator.tif': 'skipped',
+                           'albers.tif': 'converted', 'edge.tif': 'empty'}
+        assert not os.path.exists(os.path.join(output_folder, "edge.BIL"))
+        with open(os.path.join(output_folder, "MDB_P75_3_2.hdr")) as header_file:
+            assert header_file.readline().strip() == 'ENVI'
+        with SCT_BIL_READER.BilRaster(os.path.join(output_folder, "MDB_P75_3_2.BIL")) as output_bil:
+            assert (output_bil.lines, output_bil.bands, output_bil.samples) == (20, 6, 30)
+            assert np.all(output_bil.data == 200)
+        assert os.path.exists(os.path.join(output_folder, "MDB_P75_3_2.stats.json"))
+
+        results = dict((os.path.basename(result['input_raster']), result['status'])
+                       for result in run_batch(input_rasters, output_folder))
+        assert results['MDB_P75_3_0.tif'] == 'unchanged' and results['five_bands.tif'] == 'skipped'
+        assert results['edge.tif'] == 'empty'
+        statistics_path = write_batch_statistics(run_batch(input_rasters, output_folder), output_folder)
+        with open(statistics_path) as statistics_file:
+            assert json.load(statistics_file)['bands'][0]['mean'] == 100.0
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a region of interest is extracted from the converted tiles into its own folder, so extracting again does
+# not index the earlier extract as a tile
+def test_extract_region_of_interest():
+    test_folder = tempfile.mkdtemp()
+    try:
+        input_rasters = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_3_%d.tif" % index),
+                                                          np.full((6, 20, 30), 100.0 * (index + 1), dtype=np.float32),
+                                                          origin=(145.0 + index * 0.01, -36.0), pixel_size=0.01 / 30)
+                         for index in range(2)]
+        output_folder = os.path.join(test_folder, "output")
+        os.mkdir(output_folder)
+        run_batch(input_rasters, output_folder)
+        bounds = (145.005, -36.005, 145.015, -36.0)
+        for _ in range(2):
+            extract_path = extract_region_of_interest(output_folder, bounds)
+            assert os.path.dirname(extract_path) == os.path.join(output_folder, "SCT_extract")
+            with SCT_BIL_READER.BilRaster(extract_path) as extract_bil:
+                assert (extract_bil.lines, extract_bil.bands, extract_bil.samples) == (15, 6, 30)
+                assert np.all(extract_bil.data[:, :, :15] == 100) and np.all(extract_bil.data[:, :, 15:] == 200)
+        tile_index = SCT_TILE_INDEX.TileIndex()
+        assert tile_index.add_folder(output_folder) == [] and len(tile_index.tiles) == 2
+    finally:
+        shutil.rmtree(test_folder)
+
+
 if __name__ == "__main__":
     test_get_inputvariables()
     test_convert_rasterinput_to_esri_bil()
     test_get_dataset_projection_factory_code()
+    test_convert_non_geotiff_with_copyraster()
     test_create_envi_header_template()
+    test_get_batch_worker_count()
+    test_write_batch_summary()
+    test_run_batch()
+    test_extract_region_of_interest()
     printmsg("Everything passed")
@@ -0,0 +1,466 @@
+# Module to reproject GeoTIFFs in the common Australian coordinate systems onto the EPSG:4326 grid of the Stand
+# Condition Tool while they are converted, so tiles delivered in Albers or MGA do not need a separate reprojection
+# pass in ArcGIS
+# Supported are GDA94 and GDA2020 geographic, Australian Albers (EPSG:3577 and 9473), the MGA zones 49 to 56
+# (EPSG:28349 to 28356 and 7849 to 7856) and the WGS84 UTM zones that Landsat scenes are delivered in (EPSG:32601 to
+# 32660 and 32701 to 32760), all on the GRS80 ellipsoid (WGS84 differs from it by a fraction of a millimetre), GDA94
+# and GDA2020 are taken to be the same as WGS84 (they differ by less than 2 m, well under a 30 m pixel)
+# The output pixels are found with an approximate transform: the exact source position is worked out on a coarse
+# control grid of output pixels and interpolated bilinearly for the pixels in between, the control grid is made fine
+# enough that the interpolation is within reproject_max_error_pixels of the exact transform, the last few control grids
+# made are cached for each source coordinate system and geotransform
+# Resampling is nearest neighbour, ReprojectedRaster reads the source a block at a time and has the read_rows
+# interface of SCT_GEOTIFF.GeoTiffRaster so it can be passed straight to the streaming converter
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import collections
+import math
+
+import numpy as np
+
+import SCT_GEOTIFF
+
+# GRS80 ellipsoid
+grs80_semi_major_axis = 6378137.0
+grs80_flattening = 1 / 298.257222101
+
+# output grid, the SCT pixel size in degrees with pixel edges on multiples of the pixel size
+reproject_target_epsg = 4326
+reproject_pixel_size = 0.000269494585235856
+
+# spacing of the control grid in output pixels, halved until the interpolation error is small enough
+reproject_control_step = 64
+reproject_max_error_pixels = 0.125
+
+# points along each edge of the source used to find the output bounds
+reproject_edge_points = 65
+
+# projection parameters of the supported coordinate systems (EPSG code to projection name and parameters)
+reproject_coordinate_systems = {4283: ('geographic', {}), 7844: ('geographic', {}),
+                                3577: ('albers', {'lat_1': -18.0, 'lat_2': -36.0, 'lat_0': 0.0, 'lon_0': 132.0,
+                                                  'false_easting': 0.0, 'false_northing': 0.0}),
+                                9473: ('albers', {'lat_1': -18.0, 'lat_2': -36.0, 'lat_0': 0.0, 'lon_0': 132.0,
+                                                  'false_easting': 0.0, 'false_northing': 0.0})}
+for _zone in range(49, 57):
+    # MGA zones on GDA94 (283xx) and GDA2020 (78xx)
+    for _epsg in (28300 + _zone, 7800 + _zone):
+        reproject_coordinate_systems[_epsg] = ('transverse_mercator', {'lon_0': _zone * 6.0 - 183.0,
+                                                                       'scale_factor': 0.9996,
+                                                                       'false_easting': 500000.0,
+                                                                       'false_northing': 10000000.0})
+for _zone in range(1, 61):
+    # WGS84 UTM zones, north (326xx) and south (327xx)
+    for _epsg, _false_northing in ((32600 + _zone, 0.0), (32700 + _zone, 10000000.0)):
+        reproject_coordinate_systems[_epsg] = ('transverse_mercator', {'lon_0': _zone * 6.0 - 183.0,
+                                                                       'scale_factor': 0.9996,
+                                                                       'false_easting': 500000.0,
+                                                                       'false_northing': _false_northing})
+
+# control grids by source EPSG code, source geotransform and output grid, least recently used first
+_control_grids = collections.OrderedDict()
+reproject_control_grid_cache_size = 4  # control grids kept, tiles are converted one at a time by each process
+
+
+###############################################################################################################
+# function to check if a coordinate system can be reprojected to EPSG:4326
+
+def is_supported_epsg(epsg):
+    return epsg == reproject_target_epsg or epsg in reproject_coordinate_systems
+
+
+###############################################################################################################
+# Transverse Mercator on GRS80 (the MGA zones), with the series of Kruger to the fourth order in n, accurate to
+# better than a millimetre across a zone
+# forward inputs are longitudes and latitudes in degrees, inverse inputs are eastings and northings in metres
+
+def _get_transverse_mercator_series():
+    n = grs80_flattening / (2 - grs80_flattening)
+    rectifying_radius = grs80_semi_major_axis / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    alpha = (n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16 + 41 * n ** 4 / 180,
+             13 * n ** 2 / 48 - 3 * n ** 3 / 5 + 557 * n ** 4 / 1440,
+             61 * n ** 3 / 240 - 103 * n ** 4 / 140,
+             49561 * n ** 4 / 161280)
+    beta = (n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96 - n ** 4 / 360,
+            n ** 2 / 48 + n ** 3 / 15 - 437 * n ** 4 / 1440,
+            17 * n ** 3 / 480 - 37 * n ** 4 / 840,
+            4397 * n ** 4 / 161280)
+    return rectifying_radius, alpha, beta
+
+
+def transverse_mercator_forward(lon, lat, parameters):
+    rectifying_radius, alpha, _ = _get_transverse_mercator_series()
+    eccentricity = math.sqrt(grs80_flattening * (2 - grs80_flattening))
+    sin_lat = np.sin(np.radians(lat))
+    delta_lon = np.radians(np.asarray(lon, dtype=np.float64) - parameters['lon_0'])
+    # conformal latitude
+    tau = np.sinh(np.arctanh(sin_lat) - eccentricity * np.arctanh(eccentricity * sin_lat))
+    xi_prime = np.arctan2(tau, np.cos(delta_lon))
+    eta_prime = np.arctanh(np.sin(delta_lon) / np.sqrt(1 + tau ** 2))
+    xi = xi_prime.copy()
+    eta = eta_prime.copy()
+    for order, coefficient in enumerate(alpha, 1):
+        xi += coefficient * np.sin(2 * order * xi_prime) * np.cosh(2 * order * eta_prime)
+        eta += coefficient * np.cos(2 * order * xi_prime) * np.sinh(2 * order * eta_prime)
+    scale = parameters['scale_factor'] * rectifying_radius
+    return parameters['false_easting'] + scale * eta, parameters['false_northing'] + scale * xi
+
+
+def transverse_mercator_inverse(x, y, parameters):
+    rectifying_radius, _, beta = _get_transverse_mercator_series()
+    eccentricity_squared = grs80_flattening * (2 - grs80_flattening)
+    scale = parameters['scale_factor'] * rectifying_radius
+    xi = (np.asarray(y, dtype=np.float64) - parameters['false_northing']) / scale
+    eta = (np.asarray(x, dtype=np.float64) - parameters['false_easting']) / scale
+    xi_prime = xi.copy()
+    eta_prime = eta.copy()
+    for order, coefficient in enumerate(beta, 1):
+        xi_prime -= coefficient * np.sin(2 * order * xi) * np.cosh(2 * order * eta)
+        eta_prime -= coefficient * np.cos(2 * order * xi) * np.sinh(2 * order * eta)
+    conformal_lat = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))
+    delta_lon = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+    # geodetic latitude from the conformal latitude
+    e2, e4, e6, e8 = (eccentricity_squared ** power for power in (1, 2, 3, 4))
+    lat = (conformal_lat +
+           (e2 / 2 + 5 * e4 / 24 + e6 / 12 + 13 * e8 / 360) * np.sin(2 * conformal_lat) +
+           (7 * e4 / 48 + 29 * e6 / 240 + 811 * e8 / 11520) * np.sin(4 * conformal_lat) +
+           (7 * e6 / 120 + 81 * e8 / 1120) * np.sin(6 * conformal_lat) +
+           4279 * e8 / 161280 * np.sin(8 * conformal_lat))
+    return parameters['lon_0'] + np.degrees(delta_lon), np.degrees(lat)
+
+
+###############################################################################################################
+# Albers equal area conic on GRS80 (Australian Albers), from Snyder's Map Projections - A Working Manual
+# forward inputs are longitudes and latitudes in degrees, inverse inputs are eastings and northings in metres
+
+def _albers_q(sin_lat):
+    eccentricity = math.sqrt(grs80_flattening * (2 - grs80_flattening))
+    return (1 - eccentricity ** 2) * (sin_lat / (1 - eccentricity ** 2 * sin_lat ** 2) -
+                                      np.log((1 - eccentricity * sin_lat) / (1 + eccentricity * sin_lat)) /
+                                      (2 * eccentricity))
+
+
+def _get_albers_constants(parameters):
+    eccentricity_squared = grs80_flattening * (2 - grs80_flattening)
+    sin_1 = math.sin(math.radians(parameters['lat_1']))
+    sin_2 = math.sin(math.radians(parameters['lat_2']))
+    m_1 = math.cos(math.radians(parameters['lat_1'])) / math.sqrt(1 - eccentricity_squared * sin_1 ** 2)
+    m_2 = math.cos(math.radians(parameters['lat_2'])) / math.sqrt(1 - eccentricity_squared * sin_2 ** 2)
+    q_1 = _albers_q(sin_1)
+    n = (m_1 ** 2 - m_2 ** 2) / (_albers_q(sin_2) - q_1)
+    c = m_1 ** 2 + n * q_1
+    rho_0 = grs80_semi_major_axis * math.sqrt(c - n * _albers_q(math.sin(math.radians(parameters['lat_0'])))) / n
+    return n, c, rho_0
+
+
+def albers_forward(lon, lat, parameters):
+    n, c, rho_0 = _get_albers_constants(parameters)
+    rho = grs80_semi_major_axis * np.sqrt(c - n * _albers_q(np.sin(np.radians(lat)))) / n
+    theta = n * np.radians(np.asarray(lon, dtype=np.float64) - parameters['lon_0'])
+    return (parameters['false_easting'] + rho * np.sin(theta),
+            parameters['false_northing'] + rho_0 - rho * np.cos(theta))
+
+
+def albers_inverse(x, y, parameters):
+    n, c, rho_0 = _get_albers_constants(parameters)
+    eccentricity_squared = grs80_flattening * (2 - grs80_flattening)
+    x = np.asarray(x, dtype=np.float64) - parameters['false_easting']
+    y = rho_0 - (np.asarray(y, dtype=np.float64) - parameters['false_northing'])
+    sign = 1.0 if n > 0 else -1.0
+    rho = np.hypot(x, y)
+    theta = np.arctan2(sign * x, sign * y)
+    q = (c - (rho * n / grs80_semi_major_axis) ** 2) / n
+    # geodetic latitude from the authalic latitude
+    authalic_lat = np.arcsin(np.clip(q / _albers_q(1.0), -1.0, 1.0))
+    e2, e4, e6 = (eccentricity_squared ** power for power in (1, 2, 3))
+    lat = (authalic_lat +
+           (e2 / 3 + 31 * e4 / 180 + 517 * e6 / 5040) * np.sin(2 * authalic_lat) +
+           (23 * e4 / 360 + 251 * e6 / 3780) * np.sin(4 * authalic_lat) +
+           761 * e6 / 45360 * np.sin(6 * authalic_lat))
+    return parameters['lon_0'] + np.degrees(theta / n), np.degrees(lat)
+
+
+###############################################################################################################
+# functions to transform coordinates between a supported coordinate system and longitude/latitude
+# output is a tuple of numpy arrays
+
+def geographic_to_projected(epsg, lon, lat):
+    projection, parameters = reproject_coordinate_systems[epsg]
+    if projection == 'albers':
+        return albers_forward(lon, lat, parameters)
+    if projection == 'transverse_mercator':
+        return transverse_mercator_forward(lon, lat, parameters)
+    return np.array(lon, dtype=np.float64), np.array(lat, dtype=np.float64)
+
+
+def projected_to_geographic(epsg, x, y):
+    projection, parameters = reproject_coordinate_systems[epsg]
+    if projection == 'albers':
+        return albers_inverse(x, y, parameters)
+    if projection == 'transverse_mercator':
+        return transverse_mercator_inverse(x, y, parameters)
+    return np.array(x, dtype=np.float64), np.array(y, dtype=np.float64)
+
+
+###############################################################################################################
+# function to get the EPSG:4326 output grid covering a source raster
+# inputs are the source EPSG code, its GDAL style geotransform (north up), width and height
+# the edges of the source are transformed at reproject_edge_points points each and the bounds snapped outwards to
+# multiples of the pixel size, so tiles reprojected separately share one pixel grid
+# output is a tuple of the output geotransform, width and height
+
+def get_output_grid(source_epsg, source_geotransform, width, height, pixel_size=reproject_pixel_size):
+    left, xdim, _, top, _, ydim = source_geotransform
+    steps = np.linspace(0.0, 1.0, reproject_edge_points)
+    edge_columns = np.concatenate([steps * width, steps * width, np.zeros_like(steps), np.full_like(steps, width)])
+    edge_rows = np.concatenate([np.zeros_like(steps), np.full_like(steps, height), steps * height, steps * height])
+    lon, lat = projected_to_geographic(source_epsg, left + edge_columns * xdim, top + edge_rows * ydim)
+    # a small tolerance so edges that are already on the grid are not pushed out a pixel
+    first_column = int(math.floor(lon.min() / pixel_size + 1e-6))
+    last_column = int(math.ceil(lon.max() / pixel_size - 1e-6))
+    first_row = int(math.floor(-lat.max() / pixel_size + 1e-6))
+    last_row = int(math.ceil(-lat.min() / pixel_size - 1e-6))
+    geotransform = (first_column * pixel_size, pixel_size, 0.0, -first_row * pixel_size, 0.0, -pixel_size)
+    return geotransform, last_column - first_column, last_row - first_row
+
+
+###############################################################################################################
+# function to get the exact source pixel position of output pixel centres
+# inputs are the source EPSG code and geotransform, the output geotransform and output rows and columns (arrays of
+# the same shape, fractions allowed)
+# output is a tuple of the source columns and rows, as fractional pixel coordinates from the upper left corner of the
+# source (pixel i covers i to i + 1)
+
+def get_source_pixels(source_epsg, source_geotransform, output_geotransform, rows, columns):
+    lon = output_geotransform[0] + (np.asarray(columns, dtype=np.float64) + 0.5) * output_geotransform[1]
+    lat = output_geotransform[3] + (np.asarray(rows, dtype=np.float64) + 0.5) * output_geotransform[5]
+    x, y = geographic_to_projected(source_epsg, lon, lat)
+    return (x - source_geotransform[0]) / source_geotransform[1], (y - source_geotransform[3]) / source_geotransform[5]
+
+
+###############################################################################################################
+# Class holding the control grid of an output grid, the exact source pixel positions of every step-th output row and
+# column, made with get_control_grid()
+
+class ControlGrid(object):
+
+    def __init__(self, source_epsg, source_geotransform, output_geotransform, output_width, output_height, step):
+        self.step = step
+        # control points at every step pixels, covering the last row and column
+        self.rows = np.arange(0, step * (int(math.ceil((output_height - 1) / float(step))) + 1), step)
+        self.columns = np.arange(0, step * (int(math.ceil((output_width - 1) / float(step))) + 1), step)
+        control_rows, control_columns = np.meshgrid(self.rows, self.columns, indexing='ij')
+        self.source_columns, self.source_rows = get_source_pixels(source_epsg, source_geotransform,
+                                                                  output_geotransform, control_rows, control_columns)
+
+    # interpolate the source pixel positions of output pixels, rows and columns are arrays that broadcast together
+    # output is a tuple of the source columns and rows, in the broadcast shape
+    def interpolate_points(self, rows, columns):
+        row_position = np.asarray(rows, dtype=np.float64) / self.step
+        col_position = np.asarray(columns, dtype=np.float64) / self.step
+        row_index = np.clip(np.floor(row_position), 0, max(len(self.rows) - 2, 0)).astype(np.int64)
+        col_index = np.clip(np.floor(col_position), 0, max(len(self.columns) - 2, 0)).astype(np.int64)
+        row_fraction = row_position - row_index
+        col_fraction = col_position - col_index
+        row_next = np.minimum(row_index + 1, len(self.rows) - 1)
+        col_next = np.minimum(col_index + 1, len(self.columns) - 1)
+
+        def bilinear(values):
+            top = values[row_index, col_index] * (1 - col_fraction) + values[row_index, col_next] * col_fraction
+            bottom = values[row_next, col_index] * (1 - col_fraction) + values[row_next, col_next] * col_fraction
+            return top * (1 - row_fraction) + bottom * row_fraction
+
+        return bilinear(self.source_columns), bilinear(self.source_rows)
+
+    # interpolate the source pixel positions of a window of output pixels, along the control rows first and then
+    # between them, so each output pixel only costs two lookups per coordinate
+    # output is a tuple of the source columns and rows, shaped (row_count, col_count)
+    def interpolate(self, row_start, row_count, col_start, col_count):
+        row_position = np.arange(row_start, row_start + row_count, dtype=np.float64) / self.step
+        col_position = np.arange(col_start, col_start + col_count, dtype=np.float64) / self.step
+        row_index = np.clip(np.floor(row_position), 0, max(len(self.rows) - 2, 0)).astype(np.int64)
+        col_index = np.clip(np.floor(col_position), 0, max(len(self.columns) - 2, 0)).astype(np.int64)
+        row_fraction = (row_position - row_index)[:, np.newaxis]
+        col_fraction = col_position - col_index
+        row_next = np.minimum(row_index + 1, len(self.rows) - 1)
+        col_next = np.minimum(col_index + 1, len(self.columns) - 1)
+        control_rows = slice(row_index[0], row_next[-1] + 1)
+
+        def separable(values):
+            values = values[control_rows]
+            along_rows = values[:, col_index] * (1 - col_fraction) + values[:, col_next] * col_fraction
+            return along_rows[row_index - control_rows.start] * (1 - row_fraction) + \
+                along_rows[row_next - control_rows.start] * row_fraction
+
+        return separable(self.source_columns), separable(self.source_rows)
+
+
+###############################################################################################################
+# function to get the control grid for reprojecting a source raster onto an output grid
+# the step starts at reproject_control_step output pixels and is halved until the interpolated source position at
+# the centre of every control cell is within reproject_max_error_pixels source pixels of the exact position
+# the last reproject_control_grid_cache_size control grids are cached, so tiles that share a geotransform, or a tile
+# opened again, only work it out once, without the cache growing over a batch of tiles that do not
+
+def get_control_grid(source_epsg, source_geotransform, output_geotransform, output_width, output_height):
+    key = (source_epsg, tuple(source_geotransform), tuple(output_geotransform), output_width, output_height)
+    if key in _control_grids:
+        _control_grids[key] = _control_grids.pop(key)  # most recently used
+    else:
+        step = reproject_control_step
+        while True:
+            control_grid = ControlGrid(source_epsg, source_geotransform, output_geotransform, output_width,
+                                       output_height, step)
+            if step == 1:
+                break
+            # check the centres of the control cells against the exact transform
+            check_rows = np.minimum(control_grid.rows[:-1] + step // 2, output_height - 1) \
+                if len(control_grid.rows) > 1 else control_grid.rows
+            check_columns = np.minimum(control_grid.columns[:-1] + step // 2, output_width - 1) \
+                if len(control_grid.columns) > 1 else control_grid.columns
+            check_rows, check_columns = np.meshgrid(check_rows, check_columns, indexing='ij')
+            exact_columns, exact_rows = get_source_pixels(source_epsg, source_geotransform, output_geotransform,
+                                                          check_rows, check_columns)
+            approximate_columns, approximate_rows = control_grid.interpolate_points(check_rows, check_columns)
+            error = max(np.abs(approximate_columns - exact_columns).max(), np.abs(approximate_rows - exact_rows).max())
+            if error <= reproject_max_error_pixels:
+                break
+            step //= 2
+        _control_grids[key] = control_grid
+        while len(_control_grids) > reproject_control_grid_cache_size:
+            _control_grids.popitem(last=False)
+    return _control_grids[key]
+
+
+###############################################################################################################
+# Class reading a GeoTIFF reprojected onto the EPSG:4326 output grid with nearest neighbour resampling
+# input is an open SCT_GEOTIFF.GeoTiffRaster in a supported coordinate system, the output pixel size and the memory
+# allowed for the source pixels read for one block
+# it has the properties and read_rows/read_window methods of a GeoTiffRaster, output pixels outside the source are
+# NaN (the data type is at least float32) and source NODATA values are passed through
+# compressed sources are read in whole strip or tile rows and the rows of the last read are kept, so the next block
+# and the other column half of a split window do not decode them again
+# raises ValueError for rasters that are rotated, not georeferenced or in an unsupported coordinate system, and for a
+# source stored as a single compressed strip that is more than the block memory
+
+class ReprojectedRaster(object):
+
+    def __init__(self, source, pixel_size=reproject_pixel_size, block_memory_bytes=64 * 1024 * 1024):
+        if source.epsg not in reproject_coordinate_systems:
+            raise ValueError("%s is in EPSG %s, which can not be reprojected" % (source.path, source.epsg))
+        if source.geotransform is None:
+            raise ValueError("%s has no georeferencing" % source.path)
+        if source.geotransform[2] != 0.0 or source.geotransform[4] != 0.0:
+            raise ValueError("%s is rotated, only north up rasters can be reprojected" % source.path)
+        SCT_GEOTIFF.check_single_strip_memory(source, source.width * source.bands * source.dtype.itemsize,
+                                              block_memory_bytes)
+        self.source = source
+        self.path = source.path
+        self.source_epsg = source.epsg
+        self.block_memory_bytes = block_memory_bytes
+        self.geotransform, self.width, self.height = get_output_grid(source.epsg, source.geotransform, source.width,
+                                                                     source.height, pixel_size)
+        self.epsg = reproject_target_epsg
+        self.bands = source.bands
+        self.dtype = np.result_type(source.dtype, np.float32)
+        self.nodata = source.nodata
+        self.compression = source.compression
+        self.chunk_rows = 1  # any number of rows can be read at a time
+        self.row_step = 1
+        self.control_grid = get_control_grid(source.epsg, source.geotransform, self.geotransform, self.width,
+                                             self.height)
+        self._source_chunks = {}  # source strip or tile rows of the last read, by chunk row index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._source_chunks = {}
+        self.source.close()
+
+    # get the raster metadata, as GeoTiffRaster.metadata()
+    def metadata(self):
+        return {'bands': self.bands,
+                'data_type': self.dtype.name,
+                'samples': self.width,
+                'lines': self.height,
+                'geotransform': self.geotransform,
+                'epsg': self.epsg,
+                'nodata': self.nodata,
+                'compression': self.compression}
+
+    # read a block of whole output rows, shaped (bands, row_count, width)
+    def read_rows(self, row_start, row_count, out=None):
+        return self.read_window(row_start, row_count, 0, self.width, out)
+
+    # read a window of the output grid, shaped (bands, row_count, col_count), into out if it is given
+    def read_window(self, row_start, row_count, col_start=0, col_count=None, out=None):
+        if col_count is None:
+            col_count = self.width - col_start
+        if row_start < 0 or col_start < 0 or row_start + row_count > self.height or \
+                col_start + col_count > self.width:
+            raise ValueError("window rows %d:%d, columns %d:%d is outside the reprojected %s (%d x %d)"
+                             % (row_start, row_start + row_count, col_start, col_start + col_count, self.path,
+                                self.height, self.width))
+        source_columns, source_rows = self.control_grid.interpolate(row_start, row_count, col_start, col_count)
+        if out is None:
+            window = np.full((self.bands, row_count, col_count), np.nan, dtype=self.dtype)
+        else:
+            window = out
+            window.fill(np.nan)
+        self._sample(np.floor(source_rows).astype(np.int64), np.floor(source_columns).astype(np.int64), window)
+        return window
+
+    # copy the nearest source pixels into a window, the source pixels the window covers are read in one go unless
+    # they are more than the block memory allows, when the window is split into halves of its columns
+    def _sample(self, source_rows, source_columns, window):
+        valid = (source_rows >= 0) & (source_rows < self.source.height) & \
+                (source_columns >= 0) & (source_columns < self.source.width)
+        all_valid = valid.all()
+        if not all_valid and not valid.any():
+            return
+        rows = source_rows if all_valid else source_rows[valid]
+        columns = source_columns if all_valid else source_columns[valid]
+        first_row, last_row = int(rows.min()), int(rows.max())
+        first_column, last_column = int(columns.min()), int(columns.max())
+        source_bytes = self.bands * (last_row - first_row + 1) * (last_column - first_column + 1) * \
+            self.source.dtype.itemsize
+        if source_bytes > self.block_memory_bytes and window.shape[2] > 1:
+            half = window.shape[2] // 2
+            self._sample(source_rows[:, :half], source_columns[:, :half], window[:, :, :half])
+            self._sample(source_rows[:, half:], source_columns[:, half:], window[:, :, half:])
+            return
+        source_window = self._read_source(first_row, last_row - first_row + 1, first_column,
+                                          last_column - first_column + 1)
+        # gather along the flattened source window, every band at once
+        source_pixels = source_window.reshape(self.bands, -1)
+        flat_index = (rows - first_row) * source_window.shape[2] + (columns - first_column)
+        if all_valid:
+            window[...] = np.take(source_pixels, flat_index.ravel(), axis=1).reshape(window.shape)
+        else:
+            window[:, valid] = np.take(source_pixels, flat_index, axis=1)
+
+    # read a window of the source, compressed sources are read in whole chunk rows which are kept until the next read
+    def _read_source(self, first_row, row_count, first_column, column_count):
+        step = min(self.source.row_step, self.source.height)
+        if step == 1:
+            return self.source.read_window(first_row, row_count, first_column, column_count)
+        first_chunk = first_row // step
+        last_chunk = (first_row + row_count - 1) // step
+        chunks = {}
+        for chunk in range(first_chunk, last_chunk + 1):
+            chunk_pixels = self._source_chunks.get(chunk)
+            if chunk_pixels is None:
+                chunk_start = chunk * step
+                chunk_pixels = self.source.read_rows(chunk_start, min(step, self.source.height - chunk_start))
+            chunks[chunk] = chunk_pixels
+        self._source_chunks = chunks
+        if first_chunk == last_chunk:
+            rows = chunks[first_chunk]
+        else:
+            rows = np.concatenate([chunks[chunk] for chunk in range(first_chunk, last_chunk + 1)], axis=1)
+        row_offset = first_row - first_chunk * step
+        return rows[:, row_offset:row_offset + row_count, first_column:first_column + column_count]
@@ -0,0 +1,185 @@
+# Automated test module for the reprojection to EPSG:4326 used by the Stand Condition Tool Raster Converter project
+# script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_BIL_CONVERTER
+import SCT_BIL_READER
+import SCT_GEOTIFF
+import SCT_REPROJECT
+import SCT_TEST_DATA
+
+
+# test the projections against published and independently computed coordinates, and their round trips
+def test_projections():
+    # Flinders Peak, the GDA94 MGA zone 55 worked example of the Geodetic Datum of Australia technical manual
+    easting, northing = SCT_REPROJECT.geographic_to_projected(28355, 144 + 25 / 60.0 + 29.5244 / 3600.0,
+                                                              -(37 + 57 / 60.0 + 3.7203 / 3600.0))
+    assert abs(easting - 273741.297) < 0.001 and abs(northing - 5796489.777) < 0.001
+    x, y = SCT_REPROJECT.geographic_to_projected(3577, np.array([145.0, 150.5]), np.array([-36.0, -28.25]))
+    assert np.allclose(x, [1170106.2051, 1787195.9086], atol=0.001)
+    assert np.allclose(y, [-3992812.7703, -3196677.2903], atol=0.001)
+
+    lon = np.linspace(138.0, 153.0, 31)
+    lat = np.linspace(-38.0, -24.0, 31)
+    for epsg in (3577, 9473, 28354, 28355, 28356, 7855, 4283):
+        x, y = SCT_REPROJECT.geographic_to_projected(epsg, lon, lat)
+        round_trip_lon, round_trip_lat = SCT_REPROJECT.projected_to_geographic(epsg, x, y)
+        assert np.abs(round_trip_lon - lon).max() < 1e-8 and np.abs(round_trip_lat - lat).max() < 1e-7
+    assert SCT_REPROJECT.is_supported_epsg(28349) and SCT_REPROJECT.is_supported_epsg(4326)
+    assert not SCT_REPROJECT.is_supported_epsg(32600) and not SCT_REPROJECT.is_supported_epsg(2193)
+
+    # WGS84 UTM zones are the MGA zones in the south, and have no false northing in the north
+    assert SCT_REPROJECT.is_supported_epsg(32601) and SCT_REPROJECT.is_supported_epsg(32760)
+    assert np.allclose(SCT_REPROJECT.geographic_to_projected(32755, lon, lat),
+                       SCT_REPROJECT.geographic_to_projected(28355, lon, lat), atol=1e-6)
+    south_x, south_y = SCT_REPROJECT.geographic_to_projected(32754, lon, lat)
+    north_x, north_y = SCT_REPROJECT.geographic_to_projected(32654, lon, lat)
+    assert np.allclose(north_x, south_x, atol=1e-6) and np.allclose(north_y, south_y - 10000000.0, atol=1e-6)
+
+
+# test that the interpolated control grid is within the error allowed of the exact transform and that the last control
+# grids are cached
+def test_control_grid():
+    source_geotransform = (1170000.0, 30.0, 0.0, -3990000.0, 0.0, -30.0)
+    geotransform, width, height = SCT_REPROJECT.get_output_grid(3577, source_geotransform, 2000, 1500)
+    pixel_size = SCT_REPROJECT.reproject_pixel_size
+    assert abs(geotransform[0] / pixel_size - round(geotransform[0] / pixel_size)) < 1e-6
+    assert abs(geotransform[3] / pixel_size - round(geotransform[3] / pixel_size)) < 1e-6
+    corner_lon, corner_lat = SCT_REPROJECT.projected_to_geographic(3577, [1170000.0, 1230000.0],
+                                                                   [-3990000.0, -4035000.0])
+    assert geotransform[0] <= corner_lon.min() and geotransform[0] + width * pixel_size >= corner_lon.max()
+    assert geotransform[3] >= corner_lat.max() and geotransform[3] - height * pixel_size <= corner_lat.min()
+
+    control_grid = SCT_REPROJECT.get_control_grid(3577, source_geotransform, geotransform, width, height)
+    assert SCT_REPROJECT.get_control_grid(3577, source_geotransform, geotransform, width, height) is control_grid
+    rows, columns = np.meshgrid(np.arange(0, height, 7), np.arange(0, width, 5), indexing='ij')
+    exact_columns, exact_rows = SCT_REPROJECT.get_source_pixels(3577, source_geotransform, geotransform, rows,
+                                                                columns)
+    approximate_columns, approximate_rows = control_grid.interpolate_points(rows, columns)
+    assert np.abs(approximate_columns - exact_columns).max() < SCT_REPROJECT.reproject_max_error_pixels
+    assert np.abs(approximate_rows - exact_rows).max() < SCT_REPROJECT.reproject_max_error_pixels
+    window_columns, window_rows = control_grid.interpolate(14, 3, 10, 4)
+    assert window_columns.shape == window_rows.shape == (3, 4)
+    assert np.array_equal(window_rows, control_grid.interpolate_points(np.arange(14, 17)[:, np.newaxis],
+                                                                       np.arange(10, 14))[1])
+
+    # the tiles of a delivery each have their own geotransform, the cache keeps only the most recently used grids
+    for tile in range(2 * SCT_REPROJECT.reproject_control_grid_cache_size):
+        tile_geotransform = (1170000.0 + tile * 3000.0, 30.0, 0.0, -3990000.0, 0.0, -30.0)
+        SCT_REPROJECT.get_control_grid(3577, tile_geotransform,
+                                       *SCT_REPROJECT.get_output_grid(3577, tile_geotransform, 100, 100))
+        assert SCT_REPROJECT.get_control_grid(3577, source_geotransform, geotransform, width, height) is control_grid
+    assert len(SCT_REPROJECT._control_grids) == SCT_REPROJECT.reproject_control_grid_cache_size
+
+
+# test that an MGA tile is reprojected in the same pass as the conversion, nearest neighbour, with pixels outside the
+# tile and NODATA pixels written as NODATA
+def test_reprojected_conversion():
+    test_folder = tempfile.mkdtemp()
+    try:
+        source_rows, source_columns = np.mgrid[0:150, 0:200]
+        pixels = np.array([source_rows * 200 + source_columns + band for band in range(6)], dtype=np.float32)
+        pixels[:, 10:20, 10:20] = -9999.0
+        source_geotransform = (273000.0, 30.0, 0.0, 5800000.0, 0.0, -30.0)
+        input_raster = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_mga55.tif"), pixels,
+                                                        origin=(273000.0, 5800000.0), pixel_size=30.0, nodata=-9999.0,
+                                                        epsg=28355, rows_per_strip=16)
+        output_bil = os.path.join(test_folder, "MDB_P75_mga55.BIL")
+        # a small block memory so the source is read in several blocks and column splits
+        metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(input_raster, output_bil, 64 * 1024)
+        assert 'reprojected_from' not in metadata  # reprojection is only done when asked for
+        metadata = SCT_BIL_CONVERTER.convert_geotiff_to_bil(input_raster, output_bil, 64 * 1024, reproject=True)
+        assert metadata['reprojected_from'] == 28355
+        assert metadata['xdim'] == metadata['ydim'] == SCT_REPROJECT.reproject_pixel_size
+        with SCT_GEOTIFF.GeoTiffRaster(input_raster) as source:
+            with SCT_REPROJECT.ReprojectedRaster(source) as reprojected:
+                geotransform = reprojected.geotransform
+                assert (metadata['samples'], metadata['lines']) == (reprojected.width, reprojected.height)
+                assert reprojected.metadata()['epsg'] == 4326 and reprojected.dtype == np.float32
+        SCT_BIL_CONVERTER.SCT_ENVI_HEADER.write_envi_header(output_bil, metadata)
+
+        with SCT_BIL_READER.BilRaster(output_bil) as output:
+            assert np.allclose(output.geotransform, geotransform)
+            output_pixels = np.array(output.read_window(0, output.lines)).transpose(1, 0, 2)
+        rows, columns = np.mgrid[0:output_pixels.shape[1], 0:output_pixels.shape[2]]
+        exact_columns, exact_rows = SCT_REPROJECT.get_source_pixels(28355, source_geotransform, geotransform, rows,
+                                                                    columns)
+        inside = (exact_columns >= 0) & (exact_columns < 200) & (exact_rows >= 0) & (exact_rows < 150)
+        # pixels well inside a source pixel, away from where the approximate transform could round differently
+        clear = inside & (np.abs(exact_columns - np.rint(exact_columns)) > 0.01) & \
+            (np.abs(exact_rows - np.rint(exact_rows)) > 0.01)
+        expected = pixels[:, np.floor(exact_rows[clear]).astype(int), np.floor(exact_columns[clear]).astype(int)]
+        expected[expected == -9999.0] = SCT_BIL_CONVERTER.bil_nodata_value
+        assert np.array_equal(output_pixels[:, clear], expected)
+        outside = (exact_columns < -0.01) | (exact_columns > 200.01) | (exact_rows < -0.01) | (exact_rows > 150.01)
+        assert (output_pixels[:, outside] == SCT_BIL_CONVERTER.bil_nodata_value).all()
+        assert (output_pixels[:, clear] == SCT_BIL_CONVERTER.bil_nodata_value).any()
+        assert inside.sum() > 0.8 * 150 * 200
+    finally:
+        shutil.rmtree(test_folder)
+
+
+###############################################################################################################
+# test a source stored as a single compressed strip is refused when it does not fit the block memory, and is
+# otherwise decoded once for the whole reprojection
+
+def test_reprojected_single_strip():
+    test_folder = tempfile.mkdtemp()
+    decode_chunk = SCT_GEOTIFF.GeoTiffRaster._decode_chunk
+    decoded = []
+
+    def counting_decode_chunk(raster, index, *args, **kwargs):
+        decoded.append(index)
+        return decode_chunk(raster, index, *args, **kwargs)
+
+    try:
+        source_rows, source_columns = np.mgrid[0:120, 0:100]
+        pixels = np.array([source_rows * 100 + source_columns + band for band in range(6)], dtype=np.float32)
+        albers_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_albers.tif"), pixels,
+                                                       origin=(1100000.0, -3900000.0), pixel_size=30.0,
+                                                       nodata=-9999.0, epsg=3577, rows_per_strip=120, compress=True)
+        strips_path = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_strips.tif"), pixels,
+                                                       origin=(1100000.0, -3900000.0), pixel_size=30.0,
+                                                       nodata=-9999.0, epsg=3577, rows_per_strip=8)
+        with SCT_GEOTIFF.GeoTiffRaster(albers_path) as source:
+            try:
+                SCT_REPROJECT.ReprojectedRaster(source, block_memory_bytes=64 * 1024)
+                assert False, "a single strip larger than the block memory should be refused"
+            except ValueError as error:
+                assert "single compressed strip" in str(error)
+
+        SCT_GEOTIFF.GeoTiffRaster._decode_chunk = counting_decode_chunk
+        with SCT_GEOTIFF.GeoTiffRaster(albers_path) as source:
+            with SCT_REPROJECT.ReprojectedRaster(source, block_memory_bytes=512 * 1024) as reprojected:
+                # small blocks and column halves, which all fall in the one strip
+                half = reprojected.width // 2
+                blocks = [np.concatenate([reprojected.read_window(row, min(10, reprojected.height - row), 0, half),
+                                          reprojected.read_window(row, min(10, reprojected.height - row), half)],
+                                         axis=2)
+                          for row in range(0, reprojected.height, 10)]
+        SCT_GEOTIFF.GeoTiffRaster._decode_chunk = decode_chunk
+        assert decoded == [0]
+        with SCT_GEOTIFF.GeoTiffRaster(strips_path) as source:
+            with SCT_REPROJECT.ReprojectedRaster(source) as reprojected:
+                expected = reprojected.read_rows(0, reprojected.height)
+        assert np.array_equal(np.concatenate(blocks, axis=1), expected, equal_nan=True)
+        assert (~np.isnan(expected)).sum() > 0.8 * 6 * 120 * 100
+    finally:
+        SCT_GEOTIFF.GeoTiffRaster._decode_chunk = decode_chunk
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_projections()
+    test_control_grid()
+    test_reprojected_conversion()
+    test_reprojected_single_strip()
+    print("Everything passed")
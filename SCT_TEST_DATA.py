@@ -0,0 +1,195 @@
+# Helper module to create small synthetic GeoTIFF files for the Stand Condition Tool automated tests
+# Writes classic little endian GeoTIFFs, stripped or tiled, chunky or planar, uncompressed, deflate or LZW compressed,
+# with or without horizontal or floating point predictors
+
+import struct
+import zlib
+
+import numpy as np
+
+# GeoKey codes
+geokey_model_type = 1024
+geokey_raster_type = 1025
+geokey_geographic_type = 2048
+geokey_projected_cs_type = 3072
+
+
+# function to encode the values for one TIFF tag, returns the field type, value count and packed bytes
+def _pack_tag(field_type, values):
+    if field_type == 2:
+        data = values.encode('latin-1') + b'\0'
+        return field_type, len(data), data
+    value_format = {3: 'H', 4: 'I', 12: 'd'}[field_type]
+    return field_type, len(values), struct.pack('<' + value_format * len(values), *values)
+
+
+###############################################################################################################
+# function to LZW compress data as TIFF does, a plain reference encoder for testing the readers
+# codes are packed most significant bit first, starting with a clear code (256) and ending with 257, and the code
+# table is cleared when it is full
+
+def lzw_encode(data):
+    codes = [256]
+    table = dict((bytes(bytearray([value])), value) for value in range(256))
+    next_code = 258
+    prefix = b''
+    for value in bytearray(data):
+        entry = prefix + bytes(bytearray([value]))
+        if entry in table:
+            prefix = entry
+            continue
+        codes.append(table[prefix])
+        table[entry] = next_code
+        next_code += 1
+        prefix = entry[-1:]
+        if next_code == 4094:
+            codes.append(256)
+            table = dict((bytes(bytearray([value])), value) for value in range(256))
+            next_code = 258
+    if prefix:
+        codes.append(table[prefix])
+    codes.append(257)
+
+    # the width of a code depends on the size of the reader's code table, which grows by one for every code after
+    # the first one following a clear code, one code earlier than plain LZW
+    packed = bytearray()
+    bit_buffer = 0
+    bit_count = 0
+    run_index = 0
+    for code in codes:
+        table_size = 258 if run_index <= 1 else 257 + run_index
+        code_width = 9 + (table_size >= 511) + (table_size >= 1023) + (table_size >= 2047)
+        run_index = 0 if code == 256 else run_index + 1
+        bit_buffer = (bit_buffer << code_width) | code
+        bit_count += code_width
+        while bit_count >= 8:
+            bit_count -= 8
+            packed.append((bit_buffer >> bit_count) & 255)
+        bit_buffer &= (1 << bit_count) - 1
+    if bit_count:
+        packed.append((bit_buffer << (8 - bit_count)) & 255)
+    return bytes(packed)
+
+
+# function to apply a TIFF predictor to a chunk shaped (rows, columns, samples), output is the bytes to compress
+# 2 differences each sample from the one to its left, 3 stores each row as big endian byte planes and differences
+# the bytes with a stride of the number of samples
+def _apply_predictor(piece, predictor):
+    if predictor == 2:
+        differenced = piece.copy()
+        differenced[:, 1:] = piece[:, 1:] - piece[:, :-1]
+        return differenced.tobytes()
+    rows, cols, samples = piece.shape
+    big_endian = piece.astype(piece.dtype.newbyteorder('>'))
+    planes = big_endian.view(np.uint8).reshape(rows, cols * samples, piece.dtype.itemsize).transpose(0, 2, 1)
+    row_bytes = np.ascontiguousarray(planes).reshape(rows, cols * piece.dtype.itemsize, samples)
+    differenced = row_bytes.copy()
+    differenced[:, 1:] = row_bytes[:, 1:] - row_bytes[:, :-1]
+    return differenced.tobytes()
+
+
+###############################################################################################################
+# function to write a test GeoTIFF
+# inputs are the output path and an array shaped (bands, rows, columns) or (rows, columns)
+# origin is the upper left corner, pixel_size the pixel width and height in map units
+# compress is False, True (deflate) or 'lzw', predictor is 1 (none), 2 (horizontal) or 3 (floating point)
+# if sparse is set, strips or tiles that are all NODATA are not written, as GDAL does with SPARSE_OK
+# output is the path of the file written
+
+def write_test_geotiff(path, data, origin=(143.0, -34.0), pixel_size=0.00025, nodata=None, epsg=4326,
+                       rows_per_strip=None, tile_size=None, planar=1, compress=False, sparse=False,
+                       predictor=1):
+    data = np.asarray(data)
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    data = data.astype(data.dtype.newbyteorder('<'))
+    bands, rows, cols = data.shape
+
+    if tile_size:
+        chunk_rows = chunk_cols = tile_size
+    else:
+        chunk_rows = rows_per_strip or rows
+        chunk_cols = cols
+    chunks_down = (rows + chunk_rows - 1) // chunk_rows
+    chunks_across = (cols + chunk_cols - 1) // chunk_cols
+
+    # pack the image data, one plane of all bands (chunky) or one plane per band (planar)
+    planes = [data] if planar == 1 else [data[band:band + 1] for band in range(bands)]
+    chunks = []
+    for plane in planes:
+        for chunk_row in range(chunks_down):
+            for chunk_col in range(chunks_across):
+                piece = plane[:, chunk_row * chunk_rows:(chunk_row + 1) * chunk_rows,
+                              chunk_col * chunk_cols:(chunk_col + 1) * chunk_cols]
+                if sparse and nodata is not None and (piece == nodata).all():
+                    chunks.append(b'')
+                    continue
+                if tile_size:  # tiles are padded to the full tile size
+                    padded = np.zeros((piece.shape[0], tile_size, tile_size), dtype=piece.dtype)
+                    padded[:, :piece.shape[1], :piece.shape[2]] = piece
+                    piece = padded
+                pixels = np.ascontiguousarray(piece.transpose(1, 2, 0))
+                raw = pixels.tobytes() if predictor == 1 else _apply_predictor(pixels, predictor)
+                if compress == 'lzw':
+                    raw = lzw_encode(raw)
+                elif compress:
+                    raw = zlib.compress(raw)
+                chunks.append(raw)
+
+    offsets = []
+    position = 8
+    for chunk in chunks:
+        offsets.append(position if chunk else 0)
+        position += len(chunk)
+    byte_counts = [len(chunk) for chunk in chunks]
+
+    sample_format = {'u': 1, 'i': 2, 'f': 3}[data.dtype.kind]
+    if 4000 <= epsg < 5000:
+        geokeys = [1, 1, 0, 3, geokey_model_type, 0, 1, 2, geokey_raster_type, 0, 1, 1,
+                   geokey_geographic_type, 0, 1, epsg]
+    else:
+        geokeys = [1, 1, 0, 3, geokey_model_type, 0, 1, 1, geokey_raster_type, 0, 1, 1,
+                   geokey_projected_cs_type, 0, 1, epsg]
+
+    tags = {256: (4, [cols]),
+            257: (4, [rows]),
+            258: (3, [data.dtype.itemsize * 8] * bands),
+            259: (3, [5 if compress == 'lzw' else 8 if compress else 1]),
+            262: (3, [1]),
+            277: (3, [bands]),
+            284: (3, [planar]),
+            339: (3, [sample_format] * bands),
+            33550: (12, [pixel_size, pixel_size, 0.0]),
+            33922: (12, [0.0, 0.0, 0.0, origin[0], origin[1], 0.0]),
+            34735: (3, geokeys)}
+    if tile_size:
+        tags.update({322: (3, [tile_size]), 323: (3, [tile_size]), 324: (4, offsets), 325: (4, byte_counts)})
+    else:
+        tags.update({273: (4, offsets), 278: (4, [chunk_rows]), 279: (4, byte_counts)})
+    if predictor != 1:
+        tags[317] = (3, [predictor])
+    if nodata is not None:
+        tags[42113] = (2, repr(float(nodata)))
+
+    position += position % 2
+    ifd_offset = position
+    extra_offset = ifd_offset + 2 + 12 * len(tags) + 4
+    entries = []
+    extra = b''
+    for tag in sorted(tags):
+        field_type, count, payload = _pack_tag(*tags[tag])
+        if len(payload) <= 4:
+            value = payload.ljust(4, b'\0')
+        else:
+            value = struct.pack('<I', extra_offset + len(extra))
+            extra += payload + b'\0' * (len(payload) % 2)
+        entries.append(struct.pack('<HHI', tag, field_type, count) + value)
+
+    with open(path, 'wb') as tiff_file:
+        tiff_file.write(b'II' + struct.pack('<HI', 42, ifd_offset))
+        for chunk in chunks:
+            tiff_file.write(chunk)
+        tiff_file.write(b'\0' * (ifd_offset - 8 - sum(byte_counts)))
+        tiff_file.write(struct.pack('<H', len(entries)) + b''.join(entries) + struct.pack('<I', 0))
+        tiff_file.write(extra)
+    return path
@@ -0,0 +1,119 @@
+# Module for the persistent tile metadata cache used by the Stand Condition Tool input file converter
+# Input rasters are keyed by path, file size and modification time, and the cache holds their band count, EPSG code,
+# dimensions and conversion status, so reruns of a batch skip tiles that are unchanged and already converted and a
+# crashed batch carries on from where it stopped
+# The cache is an SQLite database, only the main process of a batch writes to it
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import os
+import sqlite3
+import time
+
+tile_cache_table_sql = """CREATE TABLE IF NOT EXISTS tiles (
+                              path TEXT PRIMARY KEY,
+                              size INTEGER,
+                              mtime REAL,
+                              bands INTEGER,
+                              epsg INTEGER,
+                              samples INTEGER,
+                              lines INTEGER,
+                              status TEXT,
+                              output_raster TEXT,
+                              output_size INTEGER,
+                              message TEXT,
+                              updated REAL)"""
+
+# fields describing the input raster
+tile_description_fields = ('bands', 'epsg', 'samples', 'lines')
+
+
+###############################################################################################################
+# function to get the cache key (file size and modification time) of an input raster
+# output is a (size, mtime) tuple, (None, None) if the file is missing or can not be read
+
+def get_file_key(input_raster):
+    try:
+        file_stat = os.stat(input_raster)
+    except OSError:
+        return None, None
+    return file_stat.st_size, file_stat.st_mtime
+
+
+###############################################################################################################
+# Class wrapping the SQLite tile cache
+# input is the path of the cache database, which is created if it does not exist
+
+class TileMetadataCache(object):
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._connection = sqlite3.connect(cache_path)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute(tile_cache_table_sql)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    # get the cache entry for an input raster as a dictionary
+    # returns None if the raster is not in the cache or its size or modification time have changed since it was cached
+    def get_tile(self, input_raster):
+        row = self._connection.execute("SELECT * FROM tiles WHERE path = ?", (os.path.abspath(input_raster),)) \
+            .fetchone()
+        if row is None:
+            return None
+        size, mtime = get_file_key(input_raster)
+        if size is None or row['size'] != size or row['mtime'] != mtime:
+            return None
+        return dict((key, row[key]) for key in row.keys())
+
+    # get the cached description (bands, epsg, samples, lines) of an input raster, None if not cached or stale
+    def get_description(self, input_raster):
+        tile = self.get_tile(input_raster)
+        if tile is None or tile['bands'] is None:
+            return None
+        return dict((field, tile[field]) for field in tile_description_fields)
+
+    # check whether an input raster is unchanged since it was converted and its output bil and header still exist
+    # with the expected size
+    def is_converted(self, input_raster, output_raster):
+        tile = self.get_tile(input_raster)
+        if tile is None or tile['status'] != 'converted' or tile['output_raster'] != os.path.abspath(output_raster):
+            return False
+        header_path = os.path.splitext(output_raster)[0] + ".hdr"
+        if not os.path.exists(output_raster) or not os.path.exists(header_path):
+            return False
+        return os.path.getsize(output_raster) == tile['output_size']
+
+    # check whether an input raster is unchanged since it was found to be all NODATA
+    def is_empty(self, input_raster):
+        tile = self.get_tile(input_raster)
+        return tile is not None and tile['status'] == 'empty'
+
+    # store the description and conversion status of an input raster
+    # inputs are the input raster path, a description dictionary (any of bands, epsg, samples, lines), the status
+    # (for example converting, converted, skipped or failed), the output raster and a message
+    # an input that is missing or can not be read is stored without its size and modification time, so it is
+    # recorded with its status but never treated as unchanged
+    def update_tile(self, input_raster, description=None, status=None, output_raster=None, message=''):
+        size, mtime = get_file_key(input_raster)
+        description = description or {}
+        output_size = None
+        if output_raster is not None and os.path.exists(output_raster):
+            output_size = os.path.getsize(output_raster)
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tiles (path, size, mtime, bands, epsg, samples, lines, status, output_raster,"
+                " output_size, message, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(input_raster), size, mtime,
+                 description.get('bands'), description.get('epsg'), description.get('samples'),
+                 description.get('lines'), status,
+                 os.path.abspath(output_raster) if output_raster is not None else None, output_size, message,
+                 time.time()))
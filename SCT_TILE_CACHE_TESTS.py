@@ -0,0 +1,106 @@
+# Automated test module for the tile metadata cache used by the Stand Condition Tool Raster Converter project script
+# Test files are written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import SCT_CONVERT_RASTER_TO_ENVI
+import SCT_TEST_DATA
+import SCT_TILE_CACHE
+
+test_description = {'bands': 6, 'epsg': 4326, 'samples': 9472, 'lines': 9472}
+
+
+# function to write a small test file
+def write_test_file(path, size):
+    with open(path, 'wb') as test_file:
+        test_file.write(b'\0' * size)
+    return path
+
+
+# test that a converted tile is recognised on a rerun and that its cached description is returned
+def test_converted_tile_is_skipped():
+    test_folder = tempfile.mkdtemp()
+    try:
+        input_raster = write_test_file(os.path.join(test_folder, 'tile.tif'), 100)
+        output_raster = write_test_file(os.path.join(test_folder, 'tile.BIL'), 60)
+        write_test_file(os.path.join(test_folder, 'tile.hdr'), 10)
+        cache_path = os.path.join(test_folder, 'cache.sqlite')
+
+        with SCT_TILE_CACHE.TileMetadataCache(cache_path) as tile_cache:
+            assert tile_cache.get_description(input_raster) is None
+            assert not tile_cache.is_converted(input_raster, output_raster)
+            tile_cache.update_tile(input_raster, test_description, 'converted', output_raster)
+
+        # reopen the cache as a new run would
+        with SCT_TILE_CACHE.TileMetadataCache(cache_path) as tile_cache:
+            assert tile_cache.get_description(input_raster) == test_description
+            assert tile_cache.is_converted(input_raster, output_raster)
+            assert not tile_cache.is_converted(input_raster, os.path.join(test_folder, 'other.BIL'))
+
+            # a truncated output (for example from a crashed run) is converted again
+            write_test_file(output_raster, 30)
+            assert not tile_cache.is_converted(input_raster, output_raster)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a tile is converted again and not described from the cache once the input file has changed
+def test_changed_tile_is_not_skipped():
+    test_folder = tempfile.mkdtemp()
+    try:
+        input_raster = write_test_file(os.path.join(test_folder, 'tile.tif'), 100)
+        output_raster = write_test_file(os.path.join(test_folder, 'tile.BIL'), 60)
+        write_test_file(os.path.join(test_folder, 'tile.hdr'), 10)
+        with SCT_TILE_CACHE.TileMetadataCache(os.path.join(test_folder, 'cache.sqlite')) as tile_cache:
+            tile_cache.update_tile(input_raster, test_description, 'converted', output_raster)
+            write_test_file(input_raster, 200)
+            assert tile_cache.get_tile(input_raster) is None
+            assert tile_cache.get_description(input_raster) is None
+            assert not tile_cache.is_converted(input_raster, output_raster)
+
+            # failed tiles keep their description but are not treated as converted
+            tile_cache.update_tile(input_raster, test_description, 'failed', output_raster, 'convert error')
+            assert tile_cache.get_description(input_raster) == test_description
+            assert not tile_cache.is_converted(input_raster, output_raster)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a missing input is stored with its status but never cached as unchanged, and that a batch with a missing
+# input reports it and still writes the summary
+def test_missing_tile_is_reported():
+    test_folder = tempfile.mkdtemp()
+    try:
+        missing_raster = os.path.join(test_folder, 'missing.tif')
+        with SCT_TILE_CACHE.TileMetadataCache(os.path.join(test_folder, 'cache.sqlite')) as tile_cache:
+            assert tile_cache.get_tile(missing_raster) is None
+            tile_cache.update_tile(missing_raster, None, 'failed', None, 'missing')
+            assert tile_cache.get_tile(missing_raster) is None
+            assert not tile_cache.is_empty(missing_raster)
+
+        input_raster = SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, 'MDB_P75_3_0.tif'),
+                                                        np.full((6, 4, 5), 100.0, dtype=np.float32))
+        output_folder = os.path.join(test_folder, 'output')
+        os.mkdir(output_folder)
+        for _ in range(2):  # the rerun reads the cache entry of the missing input
+            results = SCT_CONVERT_RASTER_TO_ENVI.run_batch([missing_raster, input_raster], output_folder)
+            statuses = dict((os.path.basename(result['input_raster']), result['status']) for result in results)
+            assert statuses['missing.tif'] in ('skipped', 'failed')
+            assert statuses['MDB_P75_3_0.tif'] in ('converted', 'unchanged')
+            summary_path = SCT_CONVERT_RASTER_TO_ENVI.write_batch_summary(results, output_folder)
+            assert os.path.exists(summary_path)
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_converted_tile_is_skipped()
+    test_changed_tile_is_not_skipped()
+    test_missing_tile_is_reported()
+    print("Everything passed")
@@ -0,0 +1,192 @@
+# Module for a virtual mosaic over the tiles exported for the Stand Condition Tool (MDB_P75_*_<row>-<col>.tif) or the
+# bil files converted from them, without merging the tiles into one basin mosaic
+# Each tile is indexed by its bounds, worked out from its geotransform (GeoTIFF tags) or its ULXMAP, ULYMAP, XDIM
+# and YDIM header values (bil files), and put in the cells of a regular lon/lat grid it overlaps
+# A window given by lon/lat bounds looks up only the grid cells it covers, reads only the tiles that overlap it and
+# stitches them together in memory
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import math
+import os
+
+import numpy as np
+
+import SCT_BIL_READER
+import SCT_GEOTIFF
+
+# size of the lookup grid cells in map units (degrees for the 4326 SCT tiles), a few tiles per cell
+tile_index_default_cell_size = 1.0
+
+# tiles must line up with the window pixel grid to within this fraction of a pixel
+tile_index_pixel_tolerance = 1e-3
+
+
+###############################################################################################################
+# function to describe a GeoTIFF or bil tile for the index
+# output is a dictionary of the path, format ('geotiff' or 'bil'), samples, lines, bands, the outer edges of the
+# tile (left, top, right, bottom), the pixel size (xdim, ydim), the numpy data type, the NODATA value (or None) and
+# the EPSG code (None for bil tiles and GeoTIFFs with a user defined coordinate system)
+# raises ValueError for tiles that are rotated or have no georeferencing
+
+def describe_tile(tile_path):
+    if SCT_GEOTIFF.is_geotiff_path(tile_path):
+        metadata = SCT_GEOTIFF.read_geotiff_metadata(tile_path)
+        geotransform = metadata['geotransform']
+        if geotransform is None:
+            raise ValueError("%s has no georeferencing" % tile_path)
+        if geotransform[2] != 0.0 or geotransform[4] != 0.0:
+            raise ValueError("%s is rotated, only north up tiles can be indexed" % tile_path)
+        tile = {'format': 'geotiff', 'left': geotransform[0], 'top': geotransform[3], 'xdim': geotransform[1],
+                'ydim': -geotransform[5], 'data_type': metadata['data_type'], 'nodata': metadata['nodata'],
+                'epsg': metadata['epsg']}
+    else:
+        metadata = SCT_BIL_READER.read_bil_header(tile_path)
+        # the header gives the centre of the upper left pixel
+        tile = {'format': 'bil', 'left': metadata['ulxmap'] - metadata['xdim'] / 2.0,
+                'top': metadata['ulymap'] + metadata['ydim'] / 2.0, 'xdim': metadata['xdim'],
+                'ydim': metadata['ydim'], 'data_type': metadata['dtype'].str, 'nodata': metadata['nodata'],
+                'epsg': None}
+    tile.update({'path': tile_path, 'samples': metadata['samples'], 'lines': metadata['lines'],
+                 'bands': metadata['bands']})
+    tile['right'] = tile['left'] + tile['samples'] * tile['xdim']
+    tile['bottom'] = tile['top'] - tile['lines'] * tile['ydim']
+    return tile
+
+
+###############################################################################################################
+# function to get the value used for pixels of a window that no tile covers
+# NaN for floating point data, otherwise the lowest value of the data type (-32768 for the 16 bit SCT bil files)
+
+def get_fill_value(dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return np.nan
+    return np.iinfo(dtype).min if dtype.kind == 'i' else 0
+
+
+###############################################################################################################
+# Class holding the tile index
+# tiles are added with add_tile() or add_folder(), find_tiles() gives the tiles overlapping some bounds and
+# read_window() reads and stitches them
+# bounds are (min x, min y, max x, max y) in the map units of the tiles, ie. (west, south, east, north) lon/lat
+
+class TileIndex(object):
+
+    def __init__(self, cell_size=tile_index_default_cell_size):
+        self.cell_size = cell_size
+        self.tiles = []
+        self._grid = {}  # (cell column, cell row) to the numbers of the tiles overlapping that cell
+
+    # get the range of grid cells covered by some bounds
+    def _get_cells(self, bounds):
+        min_x, min_y, max_x, max_y = bounds
+        return (range(int(math.floor(min_x / self.cell_size)), int(math.floor(max_x / self.cell_size)) + 1),
+                range(int(math.floor(min_y / self.cell_size)), int(math.floor(max_y / self.cell_size)) + 1))
+
+    # add one GeoTIFF or bil tile, output is the tile description
+    def add_tile(self, tile_path):
+        tile = describe_tile(tile_path)
+        tile_number = len(self.tiles)
+        self.tiles.append(tile)
+        cell_columns, cell_rows = self._get_cells((tile['left'], tile['bottom'], tile['right'], tile['top']))
+        for cell_column in cell_columns:
+            for cell_row in cell_rows:
+                self._grid.setdefault((cell_column, cell_row), []).append(tile_number)
+        return tile
+
+    # add every GeoTIFF or bil file in a folder (not sub folders)
+    # output is a list of (file, error message) for the files that could not be indexed
+    def add_folder(self, tile_folder):
+        failures = []
+        for filename in sorted(os.listdir(tile_folder)):
+            tile_path = os.path.join(tile_folder, filename)
+            if not (SCT_GEOTIFF.is_geotiff_path(tile_path) or os.path.splitext(filename)[1].lower() == '.bil'):
+                continue
+            try:
+                self.add_tile(tile_path)
+            except (IOError, OSError, KeyError, IndexError, ValueError) as err:
+                failures.append((tile_path, str(err)))
+        return failures
+
+    # get the descriptions of the tiles that overlap some bounds, in the order they were added
+    def find_tiles(self, bounds):
+        min_x, min_y, max_x, max_y = bounds
+        cell_columns, cell_rows = self._get_cells(bounds)
+        tile_numbers = set()
+        for cell_column in cell_columns:
+            for cell_row in cell_rows:
+                tile_numbers.update(self._grid.get((cell_column, cell_row), ()))
+        return [self.tiles[tile_number] for tile_number in sorted(tile_numbers)
+                if self.tiles[tile_number]['left'] < max_x and self.tiles[tile_number]['right'] > min_x and
+                self.tiles[tile_number]['bottom'] < max_y and self.tiles[tile_number]['top'] > min_y]
+
+    # read the pixels covering some bounds from the overlapping tiles
+    # the window is on the pixel grid of the tiles and takes in every pixel the bounds touch
+    # pixels not covered by any tile (and tile NODATA pixels) are set to fill_value, by default get_fill_value()
+    # output is a tuple of the window shaped (bands, rows, columns) and its GDAL style geotransform
+    # raises ValueError if no tile overlaps the bounds or the overlapping tiles do not share a pixel grid
+    def read_window(self, bounds, fill_value=None):
+        tiles = self.find_tiles(bounds)
+        if not tiles:
+            raise ValueError("no tiles overlap %s" % (bounds,))
+        min_x, min_y, max_x, max_y = bounds
+        first_tile = tiles[0]
+        xdim = first_tile['xdim']
+        ydim = first_tile['ydim']
+        for tile in tiles:
+            if tile['bands'] != first_tile['bands']:
+                raise ValueError("%s has %d bands, %s has %d" % (tile['path'], tile['bands'], first_tile['path'],
+                                                                 first_tile['bands']))
+            if abs(tile['xdim'] - xdim) > xdim * tile_index_pixel_tolerance or \
+                    abs(tile['ydim'] - ydim) > ydim * tile_index_pixel_tolerance:
+                raise ValueError("%s has a different pixel size to %s" % (tile['path'], first_tile['path']))
+
+        # snap the bounds outwards to the pixel grid of the first tile
+        first_column = int(math.floor((min_x - first_tile['left']) / xdim + tile_index_pixel_tolerance))
+        last_column = int(math.ceil((max_x - first_tile['left']) / xdim - tile_index_pixel_tolerance))
+        first_row = int(math.floor((first_tile['top'] - max_y) / ydim + tile_index_pixel_tolerance))
+        last_row = int(math.ceil((first_tile['top'] - min_y) / ydim - tile_index_pixel_tolerance))
+        window_left = first_tile['left'] + first_column * xdim
+        window_top = first_tile['top'] - first_row * ydim
+        dtype = np.result_type(*[np.dtype(tile['data_type']) for tile in tiles])
+        if fill_value is None:
+            fill_value = get_fill_value(dtype)
+        window = np.full((first_tile['bands'], max(last_row - first_row, 1), max(last_column - first_column, 1)),
+                         fill_value, dtype=dtype)
+
+        for tile in tiles:
+            # position of the tile in the window, in whole pixels
+            column_offset = (tile['left'] - window_left) / xdim
+            row_offset = (window_top - tile['top']) / ydim
+            if abs(column_offset - round(column_offset)) > tile_index_pixel_tolerance or \
+                    abs(row_offset - round(row_offset)) > tile_index_pixel_tolerance:
+                raise ValueError("%s is not on the pixel grid of %s" % (tile['path'], first_tile['path']))
+            column_offset = int(round(column_offset))
+            row_offset = int(round(row_offset))
+            # intersection of the tile and the window, in window pixels
+            left = max(0, column_offset)
+            right = min(window.shape[2], column_offset + tile['samples'])
+            top = max(0, row_offset)
+            bottom = min(window.shape[1], row_offset + tile['lines'])
+            if left >= right or top >= bottom:
+                continue
+            block = read_tile_window(tile, top - row_offset, bottom - top, left - column_offset, right - left)
+            if tile['nodata'] is not None:
+                block = np.where(block == tile['nodata'], fill_value, block)
+            window[:, top:bottom, left:right] = block
+
+        return window, (window_left, xdim, 0.0, window_top, 0.0, -ydim)
+
+
+###############################################################################################################
+# function to read a window of one indexed tile, shaped (bands, row_count, col_count)
+# GeoTIFFs decode only the strips or tiles the window touches, bil files are memory mapped (see SCT_BIL_READER) so
+# only the rows of the window are read
+
+def read_tile_window(tile, row_start, row_count, col_start, col_count):
+    if tile['format'] == 'geotiff':
+        with SCT_GEOTIFF.GeoTiffRaster(tile['path']) as raster:
+            return raster.read_window(row_start, row_count, col_start, col_count)
+    with SCT_BIL_READER.BilRaster(tile['path']) as raster:
+        return raster.read_window_band_first(row_start, row_count, col_start, col_count)
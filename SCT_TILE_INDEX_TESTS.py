@@ -0,0 +1,104 @@
+# Automated test module for the virtual mosaic tile index used by the Stand Condition Tool Raster Converter project
+# script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+import SCT_BIL_CONVERTER
+import SCT_ENVI_HEADER
+import SCT_TEST_DATA
+import SCT_TILE_INDEX
+
+test_pixel_size = 0.25
+test_origin = (143.0, -34.0)
+
+
+# function to write a 3 x 2 grid of 20 x 30 pixel GeoTIFF tiles cut from one mosaic, output is the mosaic
+# shaped (bands, rows, columns)
+def write_test_tiles(tile_folder, tile_size=(20, 30)):
+    tile_rows, tile_cols = tile_size
+    mosaic = np.arange(6 * 2 * tile_rows * 3 * tile_cols, dtype=np.float32).reshape(6, 2 * tile_rows, 3 * tile_cols)
+    for tile_row in range(2):
+        for tile_col in range(3):
+            origin = (test_origin[0] + tile_col * tile_cols * test_pixel_size,
+                      test_origin[1] - tile_row * tile_rows * test_pixel_size)
+            SCT_TEST_DATA.write_test_geotiff(
+                os.path.join(tile_folder, "MDB_P75_3_%010d-%010d.tif" % (tile_row, tile_col)),
+                mosaic[:, tile_row * tile_rows:(tile_row + 1) * tile_rows,
+                       tile_col * tile_cols:(tile_col + 1) * tile_cols],
+                origin=origin, pixel_size=test_pixel_size, rows_per_strip=7)
+    return mosaic
+
+
+# test that windows read from GeoTIFF and converted bil tiles match the same window of the mosaic, reading only the
+# overlapping tiles
+def test_read_window():
+    test_folder = tempfile.mkdtemp()
+    try:
+        mosaic = write_test_tiles(test_folder)
+        bil_folder = os.path.join(test_folder, "bil")
+        os.mkdir(bil_folder)
+        for filename in os.listdir(test_folder):
+            if filename.endswith(".tif"):
+                bil_path = os.path.join(bil_folder, filename.replace(".tif", ".BIL"))
+                SCT_ENVI_HEADER.write_envi_header(
+                    bil_path, SCT_BIL_CONVERTER.convert_geotiff_to_bil(os.path.join(test_folder, filename), bil_path))
+
+        for tile_folder, expected_dtype in [(test_folder, np.float32), (bil_folder, np.int16)]:
+            tile_index = SCT_TILE_INDEX.TileIndex(cell_size=2.0)
+            assert tile_index.add_folder(tile_folder) == []
+            assert len(tile_index.tiles) == 6
+
+            # window across the corner of four tiles, bounds part way through pixels are snapped outwards
+            bounds = (143.0 + 25.1 * test_pixel_size, -34.0 - 33.0 * test_pixel_size,
+                      143.0 + 40.0 * test_pixel_size, -34.0 - 12.9 * test_pixel_size)
+            assert len(tile_index.find_tiles(bounds)) == 4
+            window, geotransform = tile_index.read_window(bounds)
+            assert window.dtype == expected_dtype
+            assert np.array_equal(window, mosaic[:, 12:33, 25:40])
+            assert geotransform == (143.0 + 25 * test_pixel_size, test_pixel_size, 0.0,
+                                    -34.0 - 12 * test_pixel_size, 0.0, -test_pixel_size)
+
+            # window hanging off the west edge of the mosaic is filled
+            window, geotransform = tile_index.read_window((142.0, -35.0, 143.5, -34.5))
+            assert len(tile_index.find_tiles((142.0, -35.0, 143.5, -34.5))) == 1
+            assert np.array_equal(window[:, :, 4:], mosaic[:, 2:4, 0:2])
+            if expected_dtype == np.float32:
+                assert np.all(np.isnan(window[:, :, :4]))
+            else:
+                assert np.all(window[:, :, :4] == -32768)
+
+            with pytest.raises(ValueError):
+                tile_index.read_window((150.0, -30.0, 151.0, -29.0))
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that a tile off the pixel grid of the others can not be stitched
+def test_read_window_off_grid():
+    test_folder = tempfile.mkdtemp()
+    try:
+        bands = np.zeros((6, 10, 10), dtype=np.float32)
+        SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "a.tif"), bands, origin=(143.0, -34.0),
+                                         pixel_size=test_pixel_size)
+        SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "b.tif"), bands, origin=(145.1, -34.0),
+                                         pixel_size=test_pixel_size)
+        tile_index = SCT_TILE_INDEX.TileIndex()
+        tile_index.add_folder(test_folder)
+        with pytest.raises(ValueError):
+            tile_index.read_window((144.0, -35.0, 146.0, -34.5))
+    finally:
+        shutil.rmtree(test_folder)
+
+
+if __name__ == "__main__":
+    test_read_window()
+    test_read_window_off_grid()
+    print("Everything passed")
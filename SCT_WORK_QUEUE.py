@@ -0,0 +1,376 @@
+# Module for the shared folder work queue used to spread a Stand Condition Tool batch over several machines
+# The queue is a folder on a share that every worker can write to, with one JSON file per task in a tasks folder.
+# A worker claims a task by creating its lease file in the leases folder with O_CREAT | O_EXCL, which only one worker
+# can do, and writes the task result to the done folder when it has finished
+# Each claim writes a unique token in its lease file, a worker only renews or releases a lease holding its token so it
+# never touches the lease of a worker that claimed the task again after its own lease expired
+# A worker renews (touches) its lease while it works on a task, a lease that has not been renewed for lease_seconds
+# is treated as left by a dead worker and the task is claimed again, up to max_attempts times
+# Lease times are the modification times of the lease files, so the clocks of the workers and the file server must
+# agree to well within lease_seconds
+# No database is used, SQLite locking is not reliable on network shares
+
+# Created by MDBA for the Stand Condition Tool input file converter
+
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+
+work_queue_tasks_folder = "tasks"
+work_queue_leases_folder = "leases"
+work_queue_done_folder = "done"
+work_queue_default_lease_seconds = 600.0  # a lease not renewed for this long is expired
+work_queue_default_max_attempts = 3  # times a task is claimed before it is abandoned as failed
+work_queue_poll_seconds = 5.0  # wait between claims while the remaining tasks are leased by other workers
+work_queue_summary_id = "summary"  # lease name for writing the batch files, task ids always end in a hash
+
+
+###############################################################################################################
+# function to make a file name safe task id from an input raster path
+# the file name is kept so the queue folders can be read, with a hash of the full path so tiles with the same name in
+# different folders are different tasks
+
+def get_task_id(input_raster):
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.splitext(os.path.basename(input_raster))[0])
+    return "%s-%s" % (name, hashlib.sha1(input_raster.encode('utf-8')).hexdigest()[:10])
+
+
+###############################################################################################################
+# functions to get a file name safe name for this process, and for a worker, that are unique over all the machines
+# working on a queue
+
+def get_host_id():
+    return "%s-%d" % (re.sub(r'[^A-Za-z0-9_.-]', '_', socket.gethostname()), os.getpid())
+
+
+def get_worker_id(index=0):
+    return "%s-%d" % (get_host_id(), index)
+
+
+###############################################################################################################
+# function to create a file only if it does not exist, atomically even on a network share
+# output is True if the file was created, False if it already existed
+
+def create_exclusive(path, values):
+    try:
+        file_descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        if os.path.exists(path):
+            return False
+        raise
+    try:
+        os.write(file_descriptor, json.dumps(values, sort_keys=True).encode('utf-8'))
+    finally:
+        os.close(file_descriptor)
+    return True
+
+
+###############################################################################################################
+# function to write a file that readers must never see half written, by writing a temporary file and renaming it
+# output is True if the file was written, False if it already existed (eg. a task result written by a worker whose
+# lease had expired), the first file written is kept
+
+def write_once(path, values):
+    temporary_path = "%s.%s.tmp" % (path, get_worker_id(random.randint(0, 1 << 30)))
+    with open(temporary_path, 'w') as temporary_file:
+        json.dump(values, temporary_file, sort_keys=True)
+    return move_once(temporary_path, path)
+
+
+###############################################################################################################
+# function to move a file to a path only if nothing is there yet, the source file is removed either way
+# output is True if the file was moved, False if the path already existed
+
+def move_once(source_path, path):
+    try:
+        if os.name == 'nt':
+            os.rename(source_path, path)  # does not replace an existing file on Windows
+        else:
+            os.link(source_path, path)  # rename replaces existing files on other systems, link does not
+    except OSError:  # already there
+        return False
+    finally:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+    return True
+
+
+def read_json(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+###############################################################################################################
+# Class for a task claimed by a worker, made by WorkQueue.claim
+# the lease is renewed by renew(), or by a heartbeat thread while it is used as a with statement, and released by
+# complete() or release(), token is the unique token written in the lease file by this claim
+
+class Lease(object):
+
+    def __init__(self, work_queue, task_id, task, worker_id, attempt, token):
+        self.work_queue = work_queue
+        self.task_id = task_id
+        self.task = task
+        self.worker_id = worker_id
+        self.attempt = attempt
+        self.token = token
+        self.path = work_queue.get_lease_path(task_id)
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._renew_until_stopped, name="SCT lease heartbeat")
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._heartbeat.join()
+        self.release()
+        return False
+
+    def _renew_until_stopped(self):
+        while not self._stop.wait(self.work_queue.lease_seconds / 4.0):
+            self.renew()
+
+    # touch the lease file so other workers do not treat the task as abandoned
+    def renew(self):
+        try:
+            if read_json(self.path).get('token') == self.token:
+                os.utime(self.path, None)
+        except (IOError, OSError, ValueError):  # released, or broken by another worker after it expired
+            pass
+
+    # write the result of the task and release the lease
+    # output is True if this is the result kept for the task
+    def complete(self, result):
+        written = self.work_queue.write_result(self.task_id, dict(result, worker=self.worker_id,
+                                                                  attempt=self.attempt))
+        self.release()
+        return written
+
+    # give the task back to the queue, without a result
+    # the lease file is first renamed to a tombstone, so no other worker can break and claim it while its token is
+    # checked, a lease that turns out to belong to another claim is put back unless the task was claimed again
+    def release(self):
+        tombstone_path = "%s.%s.released" % (self.path, self.token)
+        try:
+            os.rename(self.path, tombstone_path)
+        except OSError:  # already released, or broken by another worker after it expired
+            return
+        try:
+            owned = read_json(tombstone_path).get('token') == self.token
+        except (IOError, OSError, ValueError):  # lease file of another claim left half written
+            owned = False
+        if owned:
+            os.remove(tombstone_path)
+        else:
+            move_once(tombstone_path, self.path)
+
+
+###############################################################################################################
+# Class wrapping a shared queue folder, which is created if it does not exist
+# tasks are dictionaries that can be written as JSON, with the input_raster that identifies them
+
+class WorkQueue(object):
+
+    def __init__(self, queue_folder, lease_seconds=work_queue_default_lease_seconds,
+                 max_attempts=work_queue_default_max_attempts):
+        self.queue_folder = queue_folder
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for folder in (work_queue_tasks_folder, work_queue_leases_folder, work_queue_done_folder):
+            folder_path = os.path.join(queue_folder, folder)
+            try:
+                os.makedirs(folder_path)
+            except OSError:  # made by another worker
+                if not os.path.isdir(folder_path):
+                    raise
+
+    def get_task_path(self, task_id):
+        return os.path.join(self.queue_folder, work_queue_tasks_folder, task_id + ".json")
+
+    def get_lease_path(self, task_id):
+        return os.path.join(self.queue_folder, work_queue_leases_folder, task_id + ".lease")
+
+    def get_result_path(self, task_id):
+        return os.path.join(self.queue_folder, work_queue_done_folder, task_id + ".json")
+
+    # add tasks that are not already in the queue, every worker can add the same tasks when it starts
+    # output is the number of tasks added
+    def add_tasks(self, tasks):
+        added_count = 0
+        for task in tasks:
+            if write_once(self.get_task_path(get_task_id(task['input_raster'])), task):
+                added_count += 1
+        return added_count
+
+    def get_task_ids(self):
+        return sorted(os.path.splitext(filename)[0] for filename in
+                      os.listdir(os.path.join(self.queue_folder, work_queue_tasks_folder))
+                      if filename.endswith(".json"))
+
+    def is_done(self, task_id):
+        return os.path.exists(self.get_result_path(task_id))
+
+    def write_result(self, task_id, result):
+        return write_once(self.get_result_path(task_id), result)
+
+    # get the results of the finished tasks, in task id order
+    def get_results(self):
+        results = []
+        for task_id in self.get_task_ids():
+            try:
+                results.append(read_json(self.get_result_path(task_id)))
+            except (IOError, OSError):  # not finished
+                pass
+        return results
+
+    # count the tasks that are done, leased by a worker, leased by a worker that has stopped renewing the lease and
+    # waiting to be claimed
+    def get_status(self):
+        status = {'done': 0, 'leased': 0, 'expired': 0, 'waiting': 0}
+        for task_id in self.get_task_ids():
+            if self.is_done(task_id):
+                status['done'] += 1
+                continue
+            lease_age = self.get_lease_age(task_id)
+            if lease_age is None:
+                status['waiting'] += 1
+            elif lease_age > self.lease_seconds:
+                status['expired'] += 1
+            else:
+                status['leased'] += 1
+        return status
+
+    def is_complete(self):
+        return all(self.is_done(task_id) for task_id in self.get_task_ids())
+
+    # seconds since a lease was last renewed, None if the task is not leased
+    def get_lease_age(self, task_id):
+        try:
+            return time.time() - os.stat(self.get_lease_path(task_id)).st_mtime
+        except OSError:
+            return None
+
+    # claim the next task that is not done or leased, tasks with expired leases are claimed again
+    # workers start looking at different tasks so they do not all race for the first one
+    # output is a Lease, None if there is no task that can be claimed now
+    def claim(self, worker_id):
+        task_ids = self.get_task_ids()
+        if not task_ids:
+            return None
+        start = random.randrange(len(task_ids))
+        for task_id in task_ids[start:] + task_ids[:start]:
+            if self.is_done(task_id):
+                continue
+            lease = self.claim_task(task_id, worker_id)
+            if lease is not None:
+                return lease
+        return None
+
+    # claim one task
+    # output is a Lease, None if the task is done, leased by another worker or abandoned after max_attempts
+    def claim_task(self, task_id, worker_id):
+        lease = self.create_lease(task_id, worker_id)
+        if lease is None:
+            return None
+        lease.task = read_json(self.get_task_path(task_id))
+        if self.is_done(task_id):  # finished by another worker between the check and the claim
+            lease.release()
+            return None
+        if lease.attempt > self.max_attempts:
+            lease.complete(dict(lease.task, status='failed',
+                                message="abandoned after %d expired leases" % self.max_attempts))
+            return None
+        return lease
+
+    # claim the writing of the batch files once every task is done, so two workers finishing together do not both write
+    # them, the lease expires like a task lease if its worker stops
+    # output is a Lease with no task, None if another worker is writing the batch files
+    def claim_summary(self, worker_id):
+        return self.create_lease(work_queue_summary_id, worker_id)
+
+    # the batch files are written once for the whole queue, marked by a result file of the summary lease so machines
+    # started after they are written do not write them again (remove the marker to write them again)
+    def is_summary_written(self):
+        return self.is_done(work_queue_summary_id)
+
+    def write_summary_marker(self, values):
+        return write_once(self.get_result_path(work_queue_summary_id), values)
+
+    # create the lease file of a task, an expired lease is broken first
+    # output is a Lease with no task, None if the task is leased by another worker
+    def create_lease(self, task_id, worker_id):
+        attempt = 1
+        lease_age = self.get_lease_age(task_id)
+        if lease_age is not None:
+            if lease_age <= self.lease_seconds:
+                return None
+            attempt = self.break_expired_lease(task_id)
+            if attempt is None:
+                return None
+        token = uuid.uuid4().hex
+        lease_values = {'worker': worker_id, 'host': socket.gethostname(), 'pid': os.getpid(), 'attempt': attempt,
+                        'token': token, 'claimed': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        if not create_exclusive(self.get_lease_path(task_id), lease_values):
+            return None
+        return Lease(self, task_id, None, worker_id, attempt, token)
+
+    # remove an expired lease so the task can be claimed again
+    # only one worker at a time can break a lease, it holds a break lock (itself an exclusive file, broken in turn
+    # if its worker died while holding it) and checks the lease is still expired before removing it
+    # output is the attempt number of the next claim, None if another worker is breaking or has renewed the lease
+    def break_expired_lease(self, task_id):
+        lease_path = self.get_lease_path(task_id)
+        break_path = lease_path + ".break"
+        if not create_exclusive(break_path, {'worker': get_worker_id()}):
+            try:
+                if time.time() - os.stat(break_path).st_mtime > self.lease_seconds:
+                    os.remove(break_path)
+            except OSError:
+                pass
+            return None
+        try:
+            lease_age = self.get_lease_age(task_id)
+            if lease_age is None or lease_age <= self.lease_seconds:
+                return None
+            try:
+                attempt = read_json(lease_path).get('attempt', 1) + 1
+            except ValueError:  # lease file left half written
+                attempt = 2
+            os.remove(lease_path)
+            return attempt
+        except OSError:
+            return None
+        finally:
+            os.remove(break_path)
+
+
+###############################################################################################################
+# function to run one worker, which claims and runs tasks until every task in the queue is done
+# inputs are the queue, the function that runs a task (it is given the task dictionary and returns a result
+# dictionary that can be written as JSON), the worker id and whether to wait for tasks leased by other workers (so
+# their tasks are claimed again if they die) or stop when there is nothing left to claim
+# output is the list of results of the tasks this worker ran
+
+def run_worker(work_queue, run_task, worker_id, wait_for_leases=True, poll_seconds=work_queue_poll_seconds):
+    results = []
+    while True:
+        lease = work_queue.claim(worker_id)
+        if lease is None:
+            if not wait_for_leases or work_queue.is_complete():
+                return results
+            time.sleep(poll_seconds)
+            continue
+        with lease:
+            result = run_task(lease.task)
+            if lease.complete(result):
+                results.append(result)
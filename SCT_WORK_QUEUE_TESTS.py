@@ -0,0 +1,220 @@
+# Automated test module for the shared folder work queue used by the Stand Condition Tool Raster Converter project
+# script
+# Test data is synthetic and written to a temporary folder, no arcpy or network share is needed
+
+# Required imports
+
+import csv
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import SCT_CONVERT_RASTER_TO_ENVI
+import SCT_TEST_DATA
+import SCT_WORK_QUEUE
+
+
+# function to make the queue tasks for some test input rasters
+def make_test_tasks(count):
+    return [{'input_raster': os.path.join("\\\\server", "share", "MDB_P75_%d.tif" % index)} for index in range(count)]
+
+
+# task run by the test workers, it records each run in a file of its own so runs of the same task by two workers are
+# seen
+def run_test_task(task):
+    marker_folder = os.environ['SCT_WORK_QUEUE_TEST_MARKERS']
+    marker_path = os.path.join(marker_folder, SCT_WORK_QUEUE.get_task_id(task['input_raster']))
+    assert SCT_WORK_QUEUE.create_exclusive(marker_path, {'pid': os.getpid()}), "task was run twice"
+    return {'input_raster': task['input_raster'], 'status': 'converted'}
+
+
+# multiprocessing worker for the test queue
+def run_test_worker(queue_folder):
+    work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder)
+    return SCT_WORK_QUEUE.run_worker(work_queue, run_test_task, SCT_WORK_QUEUE.get_worker_id(), poll_seconds=0.01)
+
+
+# test that tasks are added once, claimed by one worker at a time and finished with their result
+def test_claim_and_complete():
+    queue_folder = tempfile.mkdtemp()
+    try:
+        work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder)
+        assert work_queue.add_tasks(make_test_tasks(3)) == 3
+        assert work_queue.add_tasks(make_test_tasks(4)) == 1  # every worker adds the same list when it starts
+        task_ids = work_queue.get_task_ids()
+        assert len(task_ids) == 4 and task_ids[0].startswith("MDB_P75_0-")
+
+        first_lease = work_queue.claim_task(task_ids[0], "host_a-1-0")
+        assert first_lease.task == make_test_tasks(1)[0] and first_lease.attempt == 1
+        assert work_queue.claim_task(task_ids[0], "host_b-1-0") is None
+        other_ids = set()
+        for _ in range(3):
+            other_ids.add(work_queue.claim("host_b-1-0").task_id)
+        assert other_ids == set(task_ids[1:]) and work_queue.claim("host_b-1-0") is None
+        assert work_queue.get_status() == {'done': 0, 'leased': 4, 'expired': 0, 'waiting': 0}
+
+        assert first_lease.complete({'input_raster': first_lease.task['input_raster'], 'status': 'converted'})
+        assert not os.path.exists(first_lease.path) and work_queue.is_done(task_ids[0])
+        assert not work_queue.write_result(task_ids[0], {'status': 'failed'})  # the first result is kept
+        assert work_queue.get_results() == [{'input_raster': first_lease.task['input_raster'],
+                                             'status': 'converted', 'worker': "host_a-1-0", 'attempt': 1}]
+        assert work_queue.get_status() == {'done': 1, 'leased': 3, 'expired': 0, 'waiting': 0}
+        assert not work_queue.is_complete()
+    finally:
+        shutil.rmtree(queue_folder)
+
+
+# test that a lease that is not renewed expires and is claimed again, a lease kept renewed by its heartbeat is not,
+# and a task whose leases keep expiring is abandoned
+def test_lease_expiry():
+    queue_folder = tempfile.mkdtemp()
+    try:
+        work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder, lease_seconds=0.2, max_attempts=2)
+        work_queue.add_tasks(make_test_tasks(2))
+        task_id = work_queue.get_task_ids()[0]
+
+        with work_queue.claim_task(task_id, "host_a-1-0"):
+            time.sleep(0.5)
+            assert work_queue.claim_task(task_id, "host_b-1-0") is None
+        assert work_queue.get_lease_age(task_id) is None  # released when the with statement ends
+
+        dead_lease = work_queue.claim_task(task_id, "host_a-1-0")
+        time.sleep(0.3)
+        assert work_queue.get_status()['expired'] == 1
+        second_lease = work_queue.claim_task(task_id, "host_b-1-0")
+        assert second_lease.attempt == 2
+        dead_lease.release()  # a worker that comes back does not release the new lease
+        assert work_queue.get_lease_age(task_id) is not None
+
+        time.sleep(0.3)
+        assert work_queue.claim_task(task_id, "host_c-1-0") is None
+        result = work_queue.get_results()[0]
+        assert result['status'] == 'failed' and result['message'] == "abandoned after 2 expired leases"
+        assert result['input_raster'] == make_test_tasks(1)[0]['input_raster']
+        assert not second_lease.complete({'status': 'converted'})
+    finally:
+        shutil.rmtree(queue_folder)
+
+
+# test that a worker whose lease expired does not renew or release the lease of the next claim, even when the task was
+# claimed again by a worker with the same name
+def test_lease_token():
+    queue_folder = tempfile.mkdtemp()
+    try:
+        work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder, lease_seconds=0.2)
+        work_queue.add_tasks(make_test_tasks(1))
+        task_id = work_queue.get_task_ids()[0]
+
+        dead_lease = work_queue.claim_task(task_id, "host_a-1-0")
+        time.sleep(0.3)
+        new_lease = work_queue.claim_task(task_id, "host_a-1-0")
+        assert new_lease.token != dead_lease.token
+
+        expired_time = time.time() - 100
+        os.utime(new_lease.path, (expired_time, expired_time))
+        dead_lease.renew()
+        assert work_queue.get_lease_age(task_id) > 50
+        new_lease.renew()
+        assert work_queue.get_lease_age(task_id) < 50
+
+        dead_lease.release()
+        assert SCT_WORK_QUEUE.read_json(new_lease.path)['token'] == new_lease.token
+        new_lease.release()
+        assert work_queue.get_lease_age(task_id) is None
+        assert os.listdir(os.path.join(queue_folder, SCT_WORK_QUEUE.work_queue_leases_folder)) == []
+    finally:
+        shutil.rmtree(queue_folder)
+
+
+# test that several worker processes run every task exactly once
+def test_worker_processes():
+    queue_folder = tempfile.mkdtemp()
+    marker_folder = tempfile.mkdtemp()
+    os.environ['SCT_WORK_QUEUE_TEST_MARKERS'] = marker_folder
+    try:
+        SCT_WORK_QUEUE.WorkQueue(queue_folder).add_tasks(make_test_tasks(40))
+        pool = multiprocessing.Pool(3)
+        try:
+            worker_results = pool.map(run_test_worker, [queue_folder] * 3)
+        finally:
+            pool.close()
+            pool.join()
+        assert sum(len(results) for results in worker_results) == 40
+        assert len(os.listdir(marker_folder)) == 40
+        work_queue = SCT_WORK_QUEUE.WorkQueue(queue_folder)
+        assert work_queue.is_complete() and work_queue.get_status()['done'] == 40
+        assert os.listdir(os.path.join(queue_folder, SCT_WORK_QUEUE.work_queue_leases_folder)) == []
+    finally:
+        del os.environ['SCT_WORK_QUEUE_TEST_MARKERS']
+        shutil.rmtree(queue_folder)
+        shutil.rmtree(marker_folder)
+
+
+# test that the queue mode converts the input rasters and writes the summary of the whole queue, and does not
+# convert them again when it is restarted
+def test_run_queue():
+    test_folder = tempfile.mkdtemp()
+    try:
+        input_rasters = [SCT_TEST_DATA.write_test_geotiff(os.path.join(test_folder, "MDB_P75_3_%d.tif" % index),
+                                                          np.full((6, 20, 30), 100.0, dtype=np.float32),
+                                                          epsg=4326 if index else 3857)
+                         for index in range(3)]
+        output_folder = os.path.join(test_folder, "output")
+        os.mkdir(output_folder)
+        results = SCT_CONVERT_RASTER_TO_ENVI.run_queue(input_rasters, output_folder)
+        assert sorted(result['status'] for result in results) == ['converted', 'converted', 'skipped']
+        assert all(os.path.exists(result['output_raster']) for result in results if result['status'] == 'converted')
+
+        summary_path = os.path.join(output_folder, SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_summary_filename)
+        with open(summary_path) as summary_file:
+            summary_rows = list(csv.DictReader(summary_file))
+        assert [row['input_raster'] for row in summary_rows] == input_rasters
+        work_queue = SCT_WORK_QUEUE.WorkQueue(os.path.join(output_folder, "SCT_work_queue"))
+        assert work_queue.get_lease_age(SCT_WORK_QUEUE.work_queue_summary_id) is None
+        assert work_queue.is_summary_written()
+
+        # machines finishing after the batch files are written do not write them again
+        os.remove(summary_path)
+        assert SCT_CONVERT_RASTER_TO_ENVI.run_queue(input_rasters, output_folder) == []
+        assert not os.path.exists(summary_path)
+
+        # a summary lease left by a machine that stopped while writing the batch files expires
+        os.remove(work_queue.get_result_path(SCT_WORK_QUEUE.work_queue_summary_id))
+        dead_lease = work_queue.claim_summary("host_a-1-0")
+        assert work_queue.claim_summary("host_b-1-0") is None
+        expired_time = time.time() - 2 * SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_queue_lease_seconds
+        os.utime(dead_lease.path, (expired_time, expired_time))
+        assert SCT_CONVERT_RASTER_TO_ENVI.run_queue(input_rasters, output_folder) == []
+        assert os.path.exists(summary_path) and work_queue.is_summary_written()
+        assert work_queue.get_lease_age(SCT_WORK_QUEUE.work_queue_summary_id) is None
+    finally:
+        shutil.rmtree(test_folder)
+
+
+# test that in queue mode every machine writes its run report to a file of its own in the shared output folder
+def test_queue_run_report_path():
+    saved_mode = SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_mode
+    try:
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_mode = "convert"
+        assert SCT_CONVERT_RASTER_TO_ENVI.get_run_report_path("output") == os.path.join("output",
+                                                                                        "SCT_run_report.jsonl")
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_mode = "queue"
+        report_path = SCT_CONVERT_RASTER_TO_ENVI.get_run_report_path("output")
+        assert report_path == os.path.join("output", "SCT_run_report_%s.jsonl" % SCT_WORK_QUEUE.get_host_id())
+        assert str(os.getpid()) in report_path
+    finally:
+        SCT_CONVERT_RASTER_TO_ENVI.stand_condition_tool_mode = saved_mode
+
+
+if __name__ == "__main__":
+    test_claim_and_complete()
+    test_lease_expiry()
+    test_lease_token()
+    test_worker_processes()
+    test_run_queue()
+    test_queue_run_report_path()
+    print("Everything passed")